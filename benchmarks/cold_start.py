@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""
+Measure the cold start of the skill: how long `import main` takes and how long the first request takes in a
+fresh process, with and without GENERALIST_PREINIT. Every run is a new Python process, like a new Lambda
+container. Prints one JSON line per run (easy to collect in CI) and a summary per mode.
+
+Lambda runs the import during its init phase, so with pre-initialisation the DynamoDB client and connection
+move out of the first request and into the import.
+
+    python benchmarks/cold_start.py --runs 10
+    python benchmarks/cold_start.py --backend dynamodb --endpoint http://localhost:8000 --runs 10
+    python benchmarks/cold_start.py --importtime    # the slowest imports of one cold start
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from common import percentile
+
+import events
+
+
+def child():
+    """Runs in the fresh process: time the import and the first two requests and print them as JSON."""
+    start = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+
+    user = events.SimulatedUser('amzn1.ask.account.cold-start')
+    response = main.lambda_handler(user.event(events.launch_request()), None)
+    first = time.perf_counter()
+    user.receive(response)
+    main.lambda_handler(user.event(events.intent_request('AMAZON.HelpIntent')), None)
+    second = time.perf_counter()
+
+    print(json.dumps({'import_ms': 1000 * (imported - start),
+                      'first_request_ms': 1000 * (first - imported),
+                      'second_request_ms': 1000 * (second - first),
+                      'boto3_loaded': 'boto3' in sys.modules}))
+
+
+def run(args, preinit, importtime=False):
+    env = dict(os.environ,
+               GENERALIST_PREINIT='1' if preinit else '0',
+               GENERALIST_STORAGE=args.backend,
+               GENERALIST_SQLITE_PATH=':memory:',
+               GENERALIST_LOG_LEVEL='ERROR')
+    if args.endpoint:
+        env['GENERALIST_DB_URL'] = args.endpoint
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [os.path.abspath(__file__), '--child']
+    result = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    if result.returncode != 0:
+        sys.exit("cold start run failed:\n" + result.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help="fresh processes per mode")
+    parser.add_argument('--backend', choices=['sqlite', 'dynamodb'], default='sqlite')
+    parser.add_argument('--endpoint', help="DynamoDB endpoint, e.g. http://localhost:8000 for DynamoDB Local")
+    parser.add_argument('--importtime', action='store_true', help="show the slowest imports of one cold start")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child()
+
+    if args.importtime:
+        result = run(args, preinit=True, importtime=True)
+        rows = []
+        for line in result.stderr.splitlines():
+            if line.startswith('import time:') and '|' in line and 'cumulative' not in line:
+                _, cumulative, name = line[len('import time:'):].split('|')
+                rows.append((int(cumulative), name.rstrip()))
+        for cumulative, name in sorted(rows, reverse=True)[:15]:
+            print("{:>10.1f}ms {}".format(cumulative / 1000.0, name))
+        return
+
+    for preinit in (False, True):
+        samples = {'import_ms': [], 'first_request_ms': [], 'second_request_ms': []}
+        for _ in range(args.runs):
+            measured = json.loads(run(args, preinit).stdout.strip().splitlines()[-1])
+            measured.update(preinit=preinit, backend=args.backend)
+            print(json.dumps(measured))
+            for key in samples:
+                samples[key].append(measured[key])
+        print("preinit={!s:<5} ".format(preinit) + "  ".join(
+            "{}: p50={:.1f} p95={:.1f}".format(key, percentile(values, 50), percentile(values, 95))
+            for key, values in sorted(samples.items())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+"""Helpers shared by the benchmark scripts."""
+
+from __future__ import print_function
+
+import os
+import sys
+
+# Let the scripts import the skill's modules when run from anywhere.
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(label, samples, width=8):
+    """Print one line of latency statistics (samples are in seconds)."""
+    print("{:<{width}} n={:<5d} mean={:8.3f}ms  p50={:8.3f}ms  p95={:8.3f}ms  p99={:8.3f}ms".format(
+        label, len(samples), 1000 * sum(samples) / len(samples), 1000 * percentile(samples, 50),
+        1000 * percentile(samples, 95), 1000 * percentile(samples, 99), width=width))
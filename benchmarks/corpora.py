@@ -0,0 +1,132 @@
+"""
+Realistic list steps, for the benchmarks where what the text looks like matters (compression, say). Steps are
+written the way Alexa hands them to the skill: lower case, with little punctuation, and numbers as digits.
+"""
+
+# Steps of a handful of everyday recipes.
+RECIPE_STEPS = [
+    'preheat the oven to 350 degrees and line a baking sheet with parchment paper',
+    'in a large bowl whisk together the flour baking soda and salt',
+    'cream the butter and both sugars until light and fluffy about 3 minutes',
+    'beat in the eggs one at a time then add the vanilla',
+    'stir the dry ingredients into the wet ingredients until just combined',
+    'fold in the chocolate chips and chopped walnuts',
+    'scoop rounded tablespoons of dough onto the baking sheet 2 inches apart',
+    'bake for 10 to 12 minutes until the edges are golden',
+    'let the cookies cool on the sheet for 5 minutes before moving them to a rack',
+    'bring a large pot of salted water to a boil',
+    'cook the pasta until al dente and save a cup of the cooking water',
+    'heat 2 tablespoons of olive oil in a skillet over medium heat',
+    'add the diced onion and cook until soft and translucent about 5 minutes',
+    'add the garlic and red pepper flakes and cook for 30 seconds',
+    'pour in the crushed tomatoes and simmer for 15 minutes',
+    'season with salt and pepper to taste',
+    'toss the pasta with the sauce adding cooking water to loosen it',
+    'top with grated parmesan and torn basil leaves',
+    'pat the chicken thighs dry with paper towels',
+    'rub the chicken with paprika cumin garlic powder and salt',
+    'sear the chicken skin side down for 6 minutes without moving it',
+    'flip the chicken and transfer the pan to the oven for 20 minutes',
+    'check that the chicken reaches 165 degrees inside',
+    'let the meat rest for 10 minutes before slicing',
+    'melt the butter in a saucepan over low heat',
+    'whisk in the flour and cook for 1 minute to make a roux',
+    'slowly pour in the milk whisking constantly so no lumps form',
+    'simmer until the sauce coats the back of a spoon',
+    'stir in the shredded cheddar a handful at a time',
+    'grease a 9 by 13 inch baking dish',
+    'layer half the noodles then half the ricotta mixture then half the sauce',
+    'repeat the layers and finish with mozzarella on top',
+    'cover with foil and bake for 25 minutes then uncover and bake 15 more',
+    'peel and chop the potatoes into 1 inch cubes',
+    'boil the potatoes until a fork slides in easily about 15 minutes',
+    'drain the potatoes and mash them with butter and warm cream',
+    'rinse the rice under cold water until the water runs clear',
+    'combine the rice and water in a pot and bring to a boil',
+    'cover reduce the heat to low and cook for 18 minutes',
+    'fluff the rice with a fork and let it sit covered for 5 minutes',
+    'zest and juice 2 lemons',
+    'mix the yogurt lemon juice dill and a pinch of salt for the sauce',
+    'slice the cucumber thinly and toss it with the vinegar',
+    'marinate the tofu in soy sauce ginger and sesame oil for at least 30 minutes',
+    'stir fry the vegetables over high heat for 3 minutes',
+    'add the sauce and cook until glossy and thick',
+    'sprinkle with sesame seeds and sliced green onions',
+    'knead the dough for 8 minutes until smooth and elastic',
+    'place the dough in an oiled bowl cover and let it rise for 1 hour',
+    'punch down the dough and shape it into a loaf',
+    'brush the top with beaten egg',
+    'bake until the loaf sounds hollow when tapped about 35 minutes',
+    'blend the bananas milk frozen berries and honey until smooth',
+    'chill the dough in the fridge for at least 2 hours',
+    'roll the dough out to a quarter inch thick on a floured counter',
+    'cut out the shapes and transfer them to the tray',
+    'whip the cream with powdered sugar to soft peaks',
+    'spread the frosting over the cooled cake',
+    'garnish with fresh mint and serve right away',
+    'store leftovers in an airtight container for up to 3 days'
+]
+
+# Items of household, travel and on-call checklists.
+CHECKLIST_ITEMS = [
+    'check the tire pressure on all four tires',
+    'top up the windshield washer fluid',
+    'make sure the spare tire and jack are in the trunk',
+    'pack the phone charger and the car charger',
+    'lock the back door and the garage',
+    'turn off the coffee maker and the iron',
+    'set the thermostat to 62 degrees',
+    'take out the trash and the recycling',
+    'water the plants on the porch',
+    'ask the neighbors to collect the mail',
+    'confirm the backup finished overnight',
+    'check the disk usage on the database servers',
+    'drain traffic from the first web server',
+    'restart the web servers one at a time',
+    'watch the error rate for 10 minutes after each restart',
+    'roll back if the error rate goes above 1 percent',
+    'post an update in the team channel',
+    'close the maintenance ticket',
+    'passport and boarding passes',
+    'toothbrush toothpaste and floss',
+    'two pairs of jeans and five t shirts',
+    'rain jacket',
+    'sunscreen and sunglasses',
+    'medications for the week',
+    'book and headphones',
+    'call the vet to book the annual checkup',
+    'pay the electricity bill',
+    'renew the car registration before the end of the month',
+    'pick up the dry cleaning on thursday',
+    'buy milk eggs bread and bananas',
+    'get a birthday card for mom',
+    'replace the batteries in the smoke detectors',
+    'clean the gutters before it rains',
+    'test the sump pump',
+    'change the furnace filter',
+    'vacuum the living room and the stairs',
+    'wipe down the kitchen counters',
+    'empty the dishwasher',
+    'fold the laundry and put it away',
+    'feed the cat twice a day half a can each time',
+    "refill the dog's water bowl",
+    'walk the dog at 7 and again at 6',
+    'sign the permission slip for the field trip',
+    'pack lunches for tomorrow',
+    'charge the laptop overnight',
+    "print the slides for the 9 o'clock meeting",
+    'review the budget spreadsheet before friday',
+    'send the invoice to the client',
+    'back up the photos to the external drive',
+    'update the router firmware',
+    'cancel the streaming trial before it renews',
+    'schedule the dentist appointment',
+    'return the library books',
+    'measure the window for the new blinds',
+    'order more printer ink',
+    'defrost the freezer',
+    'sharpen the kitchen knives',
+    'oil the squeaky hinge on the bedroom door',
+    'check the smoke alarm in the hallway',
+    'reset the wifi password and tell everyone'
+]
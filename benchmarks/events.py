@@ -0,0 +1,103 @@
+"""
+Synthetic Alexa traffic for the benchmarks.
+
+SimulatedUser plays one user's side of a conversation the way the Alexa service does: it carries
+sessionAttributes from each response into the next request and starts a new session whenever the skill ends
+one. user_script() yields the requests of a realistic day with one list: build it one 'add' at a time, save
+it, then come back later, load it and play through it.
+"""
+
+from __future__ import print_function
+
+import itertools
+
+APP_ID = 'amzn1.ask.skill.e208302c-710b-4f30-9344-d0ae6ca3b774'
+
+QUANTITIES = ['1', '2', '3', '4', 'a half', 'a quarter', 'one and a half', '12', '250']
+UNITS = ['cups', 'teaspoons', 'tablespoons', 'grams', 'ounces', 'large', 'cans of', 'pinches of']
+INGREDIENTS = ['flour', 'sugar', 'brown sugar', 'eggs', 'unsalted butter', 'cocoa powder', 'vanilla extract',
+               'baking soda', 'chopped walnuts', 'milk', 'sea salt', 'chocolate chips', 'diced tomatoes']
+ACTIONS = ['Preheat the oven to 350 degrees', 'Whisk everything together until smooth',
+           'Fold in the dry ingredients', 'Check the tire pressure', 'Lock the back door',
+           'Restart the web servers one at a time', 'Confirm the backup finished overnight',
+           'Let it rest for ten minutes before slicing', 'Water the plants on the porch']
+
+_request_ids = itertools.count()
+_session_ids = itertools.count()
+
+
+def list_step(rng):
+    """Something a user might say after 'add'."""
+    if rng.random() < 0.6:
+        return '{} {} {}'.format(rng.choice(QUANTITIES), rng.choice(UNITS), rng.choice(INGREDIENTS))
+    return rng.choice(ACTIONS)
+
+
+def launch_request():
+    return {'type': 'LaunchRequest'}
+
+
+def intent_request(name, **slots):
+    return {'type': 'IntentRequest',
+            'intent': {'name': name,
+                       'slots': {k: {'name': k, 'value': v} for k, v in slots.items()}}}
+
+
+def session_ended_request():
+    return {'type': 'SessionEndedRequest', 'reason': 'USER_INITIATED'}
+
+
+def request_label(request):
+    """The intent name of an intent request, otherwise the request type."""
+    return request['intent']['name'] if request['type'] == 'IntentRequest' else request['type']
+
+
+def user_script(rng, list_name, list_size, plays):
+    """Yield the requests of one user building a list of list_size steps and later playing through it."""
+    yield launch_request()
+    yield intent_request('CreateListIntent', listName=list_name)
+    for _ in range(list_size):
+        yield intent_request('AddItemIntent', Item=list_step(rng))
+    yield intent_request('SaveIntent')
+
+    yield launch_request()
+    yield intent_request('LoadListIntent', listName=list_name)
+    for _ in range(plays):
+        yield intent_request(rng.choice(['AMAZON.NextIntent'] * 6 +
+                                        ['AMAZON.PreviousIntent', 'PeekIntent', 'ReviewIntent']))
+    yield intent_request('AMAZON.StopIntent')
+
+
+class SimulatedUser(object):
+    """One Alexa user. Builds complete events for their requests and keeps their session going."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.session_id = None
+        self.attributes = None
+
+    def event(self, request):
+        """Wrap request in the event Alexa would send for this user right now."""
+        new = self.session_id is None
+        if new:
+            self.session_id = 'amzn1.echo-api.session.{}'.format(next(_session_ids))
+            self.attributes = None
+
+        session = {'new': new,
+                   'sessionId': self.session_id,
+                   'application': {'applicationId': APP_ID},
+                   'user': {'userId': self.user_id}}
+        if self.attributes is not None:
+            session['attributes'] = self.attributes
+
+        request = dict(request, requestId='amzn1.echo-api.request.{}'.format(next(_request_ids)))
+        return {'version': '1.0', 'session': session, 'request': request}
+
+    def receive(self, response):
+        """Take in the skill's response. A response that ends the session means the next request starts a
+        new one."""
+        if response is None or response['response'].get('shouldEndSession', True):
+            self.session_id = None
+            self.attributes = None
+        else:
+            self.attributes = response.get('sessionAttributes')
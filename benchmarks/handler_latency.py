@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+Drive lambda_handler with synthetic Alexa traffic and report where the time goes.
+
+Every simulated user builds a list one 'add' at a time, saves it, then loads it and plays through it with a
+mix of next/previous/peek/review before saying stop. Users are interleaved at random, the way requests from
+many households land on one warm container. For every intent the report gives p50/p95/p99 latency, storage
+calls, bytes written to storage and the size of the response payload, followed by peak memory.
+
+By default storage is an in-memory SQLite database. Use --backend dynamodb --endpoint http://localhost:8000
+to run against DynamoDB Local (add --create-tables the first time).
+
+    python benchmarks/handler_latency.py --users 50 --list-sizes 5,20,100 --plays 40
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import contextlib
+import itertools
+import json
+import os
+import random
+import resource
+import time
+import tracemalloc
+
+from common import percentile
+
+import events
+import storage
+
+
+def create_tables(endpoint):
+    """Create StoredSession and Lists in DynamoDB Local if they aren't there yet."""
+    import dynamodb_storage
+    dynamodb_storage.DB_URL = endpoint
+    dynamodb_storage.reset()
+    ddb = dynamodb_storage.dynamodb()
+    existing = set(t.name for t in ddb.tables.all())
+    keys = {storage.SESSION_TABLENAME: [('userId', 'HASH')],
+            storage.LISTS_TABLENAME: [('userId', 'HASH'), ('listName', 'RANGE')]}
+    for name, key in keys.items():
+        if name not in existing:
+            ddb.create_table(TableName=name,
+                             KeySchema=[{'AttributeName': a, 'KeyType': t} for a, t in key],
+                             AttributeDefinitions=[{'AttributeName': a, 'AttributeType': 'S'} for a, _ in key],
+                             BillingMode='PAY_PER_REQUEST').wait_until_exists()
+
+
+def traffic(args, rng):
+    """Yield (user, request) pairs for every simulated user, interleaved at random."""
+    active = []
+    for n in range(args.users):
+        user = events.SimulatedUser('amzn1.ask.account.benchmark-{}'.format(n))
+        # A user works through their lists one after another.
+        scripts = [events.user_script(rng, 'list of {} steps'.format(size), size, args.plays)
+                   for size in args.list_sizes]
+        active.append((user, itertools.chain(*scripts)))
+
+    while active:
+        index = rng.randrange(len(active))
+        user, requests = active[index]
+        try:
+            yield user, next(requests)
+        except StopIteration:
+            active.pop(index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20, help="number of simulated users")
+    parser.add_argument('--list-sizes', default='5,25,100',
+                        type=lambda s: [int(n) for n in s.split(',')],
+                        help="comma separated list sizes; every user builds and plays one list of each")
+    parser.add_argument('--plays', type=int, default=30, help="playback requests per list")
+    parser.add_argument('--seed', type=int, default=510)
+    parser.add_argument('--backend', choices=['sqlite', 'dynamodb'], default='sqlite')
+    parser.add_argument('--sqlite-path', default=':memory:')
+    parser.add_argument('--endpoint', default='http://localhost:8000', help="DynamoDB Local endpoint")
+    parser.add_argument('--create-tables', action='store_true', help="create the DynamoDB tables first")
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help="also track peak Python allocations (slows every request down)")
+    parser.add_argument('--verbose', action='store_true', help="keep the skill's own log output")
+    args = parser.parse_args()
+
+    if args.backend == 'sqlite':
+        import sqlite_storage
+        inner = sqlite_storage.SQLiteStorage(path=args.sqlite_path)
+    else:
+        import dynamodb_storage
+        if args.create_tables:
+            create_tables(args.endpoint)
+        dynamodb_storage.DB_URL = args.endpoint
+        dynamodb_storage.reset()
+        inner = dynamodb_storage.DynamoDBStorage()
+    instrumented = storage.InstrumentedStorage(inner)
+    storage.set_backend(instrumented)
+
+    import main as skill
+
+    rng = random.Random(args.seed)
+    stats = collections.defaultdict(lambda: collections.defaultdict(list))
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    log = open(os.devnull, 'w') if not args.verbose else None
+    started = time.perf_counter()
+    for user, request in traffic(args, rng):
+        event = user.event(request)
+        instrumented.reset()
+        # The skill's log output is still formatted, it just doesn't go to the terminal.
+        with contextlib.redirect_stdout(log) if log else contextlib.suppress():
+            start = time.perf_counter()
+            response = skill.lambda_handler(event, None)
+            elapsed = time.perf_counter() - start
+        user.receive(response)
+
+        row = stats[events.request_label(request)]
+        row['latency'].append(elapsed)
+        row['calls'].append(instrumented.calls)
+        row['storage'].append(instrumented.seconds)
+        row['written'].append(instrumented.bytes_written)
+        row['response'].append(len(json.dumps(response, default=str)) if response else 0)
+    wall = time.perf_counter() - started
+
+    print("{:<22} {:>6} {:>9} {:>9} {:>9} {:>7} {:>10} {:>10} {:>10}".format(
+        'intent', 'n', 'p50 ms', 'p95 ms', 'p99 ms', 'calls', 'storage ms', 'written B', 'response B'))
+    total = 0
+    for label in sorted(stats):
+        row = stats[label]
+        n = len(row['latency'])
+        total += n
+        print("{:<22} {:>6d} {:>9.3f} {:>9.3f} {:>9.3f} {:>7.2f} {:>10.3f} {:>10.0f} {:>10.0f}".format(
+            label, n, 1000 * percentile(row['latency'], 50), 1000 * percentile(row['latency'], 95),
+            1000 * percentile(row['latency'], 99), sum(row['calls']) / float(n),
+            1000 * sum(row['storage']) / n, sum(row['written']) / float(n), sum(row['response']) / float(n)))
+
+    print("\n{} requests in {:.2f}s ({:.0f} requests/s), backend={}".format(total, wall, total / wall, args.backend))
+    if args.tracemalloc:
+        print("peak traced Python memory: {:.1f} KiB".format(tracemalloc.get_traced_memory()[1] / 1024.0))
+    # ru_maxrss is KiB on Linux.
+    print("peak resident set size: {:.1f} MiB".format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""
+What compressing list pages (dynamodb_storage.pack_steps()) saves in DynamoDB capacity, and what it costs in CPU.
+
+Lists of --steps steps are made up from realistic recipe and checklist steps (see corpora.py) and from the
+synthetic steps the other benchmarks use, then laid out in pages as dynamodb_storage.py writes them, once with
+every page stored as plain listItems and once with pages over GENERALIST_DB_COMPRESS_BYTES compressed. For each
+corpus and page size it reports
+
+    stored_bytes  the size of every page item of the finished list
+    build_wcu     write capacity units for the page writes of building the list by voice: one write of the page
+                  holding the new step per 'add' (the header write that goes with it is the same either way)
+    load_wcu      write capacity units to write the whole list at once, as a bulk import or an edit does
+    read_rcu      read capacity units to read every page once with an eventually consistent GetItem
+    encode_us     median time to turn one page into its item attribute
+    decode_us     median time to turn one page item back into its steps
+
+Item sizes follow DynamoDB's billing rules (see list_format.py) with a userId as long as a real Alexa one. No
+DynamoDB calls are made; everything is computed locally.
+
+    python benchmarks/list_compression.py --steps 200 --page-sizes 10,25,50
+"""
+
+from __future__ import print_function
+
+import argparse
+import math
+import random
+import time
+
+from common import percentile
+
+from boto3.dynamodb.types import TypeSerializer
+
+import corpora
+import dynamodb_storage
+import events
+from list_format import item_size
+
+# Alexa userIds are 'amzn1.ask.account.' followed by about 200 more characters.
+USER_ID = 'amzn1.ask.account.' + 'A' * 200
+
+
+def corpus_steps(corpus):
+    """A function that makes lists of n steps from corpus, reshuffled each time it runs out, so no page shorter
+    than the corpus repeats a step."""
+    def steps(rng, n):
+        made = []
+        while len(made) < n:
+            made.extend(rng.sample(corpus, len(corpus)))
+        return made[:n]
+    return steps
+
+
+CORPORA = (
+    ('recipe', corpus_steps(corpora.RECIPE_STEPS)),
+    ('checklist', corpus_steps(corpora.CHECKLIST_ITEMS)),
+    ('synthetic', lambda rng, n: [events.list_step(rng) for _ in range(n)])
+)
+
+
+def page_item_size(page, page_items):
+    """The billed size of a page item holding page_items."""
+    item = dynamodb_storage.DynamoDBStorage.page_item(USER_ID, 'brownie recipe', page, page_items, 1)
+    serializer = TypeSerializer()
+    return sum(len(name.encode('utf-8')) + item_size(serializer.serialize(value)) for name, value in item.items())
+
+
+def write_units(size):
+    return math.ceil(size / 1024.0)
+
+
+def read_units(size):
+    # An eventually consistent read costs half a unit per 4 KB.
+    return 0.5 * math.ceil(size / 4096.0)
+
+
+def median_us(function, samples):
+    times = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return 1e6 * percentile(times, 50)
+
+
+def measure(steps, page_size, iterations):
+    pages = [steps[start:start + page_size] for start in range(0, len(steps), page_size)]
+    sizes = [page_item_size(page, page_items) for page, page_items in enumerate(pages)]
+    # Building by voice writes the page the new step lands on, as it is after that step, on every add.
+    build = sum(write_units(page_item_size(step // page_size, steps[step - step % page_size:step + 1]))
+                for step in range(len(steps)))
+    items = [dynamodb_storage.pack_steps(page_items) for page_items in pages]
+    return {
+        'stored_bytes': sum(sizes),
+        'build_wcu': build,
+        'load_wcu': sum(write_units(size) for size in sizes),
+        'read_rcu': sum(read_units(size) for size in sizes),
+        'encode_us': median_us(lambda: [dynamodb_storage.pack_steps(page_items) for page_items in pages],
+                               iterations) / len(pages),
+        'decode_us': median_us(lambda: [dynamodb_storage.unpack_steps(item) for item in items],
+                               iterations) / len(pages)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--steps', type=int, default=200, help="steps in each list")
+    parser.add_argument('--page-sizes', default='10,25,50', help="comma separated page sizes")
+    parser.add_argument('--threshold', type=int, default=dynamodb_storage.DB_COMPRESS_BYTES or 768,
+                        help="GENERALIST_DB_COMPRESS_BYTES for the compressed form")
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    fields = ('stored_bytes', 'build_wcu', 'load_wcu', 'read_rcu', 'encode_us', 'decode_us')
+    print("{:<10} {:>5} {:<6} ".format('corpus', 'page', 'form') + " ".join("{:>12}".format(f) for f in fields))
+    for name, make_steps in CORPORA:
+        steps = make_steps(random.Random(args.seed), args.steps)
+        for page_size in [int(s) for s in args.page_sizes.split(',')]:
+            results = []
+            for threshold in (0, args.threshold):
+                dynamodb_storage.DB_COMPRESS_BYTES = threshold
+                results.append(measure(steps, page_size, args.iterations))
+            plain, packed = results
+            for form, result in (('plain', plain), ('packed', packed)):
+                print("{:<10} {:>5} {:<6} ".format(name, page_size, form) + " ".join(
+                    "{:>12.1f}".format(result[f]) if isinstance(result[f], float) else "{:>12d}".format(result[f])
+                    for f in fields))
+            print("{:<10} {:>5} {:<6} ".format(name, page_size, 'saved') + " ".join(
+                "{:>11.1f}%".format(100.0 * (plain[f] - packed[f]) / plain[f]) if plain[f] else "{:>12}".format('-')
+                for f in fields[:4]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""
+Compare the two ways listItems has been stored: the old {step: text} map keyed by str(step) and the ordered
+list that replaced it. For each list size it reports
+
+    item_bytes     the DynamoDB item size, which is what read and write capacity are billed on
+    wire_bytes     the size of the listItems attribute in the low-level DynamoDB JSON sent over the wire
+    session_bytes  the size of listItems in the sessionAttributes JSON sent to and from Alexa
+    serialize      time for boto3 to turn listItems into DynamoDB JSON and back
+    lookup         time to fetch every step by its step number
+
+No DynamoDB calls are made; everything is computed locally.
+
+    python benchmarks/list_format.py --sizes 50,500,5000 --iterations 50
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import random
+import time
+
+from common import percentile
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+import events
+
+
+def item_size(value):
+    """The size DynamoDB bills for a value in DynamoDB JSON, using the rules from the DynamoDB developer
+    guide: strings are their UTF-8 length, binaries their length, numbers about one byte per two digits plus
+    one, and maps and lists 3 bytes plus 1 byte per element on top of their contents (and a map's keys)."""
+    (kind, inner), = value.items()
+    if kind == 'S':
+        return len(inner.encode('utf-8'))
+    if kind == 'B':
+        return len(inner)
+    if kind == 'N':
+        return (len(inner.lstrip('-').replace('.', '')) + 1) // 2 + 1
+    if kind == 'L':
+        return 3 + sum(1 + item_size(element) for element in inner)
+    if kind == 'M':
+        return 3 + sum(1 + len(key.encode('utf-8')) + item_size(element) for key, element in inner.items())
+    raise ValueError('Unsupported type', kind)
+
+
+def map_format(steps):
+    return {str(step): text for step, text in enumerate(steps, 1)}
+
+
+def time_it(function, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return percentile(samples, 50)
+
+
+def measure(list_items, lookup, size, iterations):
+    serializer = TypeSerializer()
+    deserializer = TypeDeserializer()
+    wire = serializer.serialize(list_items)
+    return {
+        'item_bytes': item_size(wire),
+        'wire_bytes': len(json.dumps(wire)),
+        'session_bytes': len(json.dumps(list_items)),
+        'serialize_ms': 1000 * time_it(lambda: deserializer.deserialize(serializer.serialize(list_items)),
+                                       iterations),
+        'lookup_ms': 1000 * time_it(lambda: [lookup(list_items, step) for step in range(1, size + 1)],
+                                    iterations)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='50,500,5000', help="comma separated numbers of steps")
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    fields = ('item_bytes', 'wire_bytes', 'session_bytes', 'serialize_ms', 'lookup_ms')
+    print("{:>6} {:<5} ".format('steps', 'form') + " ".join("{:>13}".format(f) for f in fields))
+    rng = random.Random(args.seed)
+    for size in [int(s) for s in args.sizes.split(',')]:
+        steps = [events.list_step(rng) for _ in range(size)]
+        old = measure(map_format(steps), lambda items, step: items[str(step)], size, args.iterations)
+        new = measure(steps, lambda items, step: items[step - 1], size, args.iterations)
+        for form, result in (('map', old), ('list', new)):
+            print("{:>6} {:<5} ".format(size, form) + " ".join(
+                "{:>13.3f}".format(result[f]) if f.endswith('_ms') else "{:>13d}".format(result[f])
+                for f in fields))
+        print("{:>6} {:<5} ".format(size, 'saved') + " ".join(
+            "{:>12.1f}%".format(100.0 * (old[f] - new[f]) / old[f]) for f in fields))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+"""
+Load test of the self-hosted endpoint (server.py).
+
+Starts the server on a free local port with a fresh SQLite database standing in for DynamoDB, drives it with
+simulated Alexa users over keep-alive connections for --seconds, and reports requests per second, latency and
+the status codes seen. Then it sends the server SIGTERM while the users are still talking to it and reports
+how the shutdown went: requests answered while draining, requests lost, and the server's exit status.
+
+Every connection carries its own --users-per-connection users, each building a list and playing through it
+over and over, as in handler_latency.py. --storage-latency adds that many seconds to every storage call, to
+stand in for a network round trip to DynamoDB; the server's threads overlap those waits.
+
+    python benchmarks/server_load.py --connections 32 --seconds 10
+    python benchmarks/server_load.py --storage-latency 0.005 --threads 128 --concurrency 64
+    python benchmarks/server_load.py --processes 4 --client-processes 4
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import concurrent.futures
+import http.client
+import itertools
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from common import ROOT, percentile
+
+import events
+
+# Errors that mean the server closed a kept-alive connection before reading the request on it. The request
+# is sent again on a new connection, as load balancers and HTTP clients do.
+CLOSED_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def start_server(args, port, directory):
+    env = dict(os.environ,
+               GENERALIST_STORAGE='sqlite',
+               GENERALIST_SQLITE_PATH=os.path.join(directory, 'generalist.db'),
+               GENERALIST_LOG_LEVEL='WARNING',
+               GENERALIST_METRICS='1' if args.metrics else '0',
+               GENERALIST_FAULT_LATENCY=str(args.storage_latency))
+    command = [sys.executable, os.path.join(ROOT, 'server.py'), '--host', '127.0.0.1', '--port', str(port),
+               '--threads', str(args.threads), '--concurrency', str(args.concurrency),
+               '--processes', str(args.processes)]
+    with open(os.path.join(directory, 'server.log'), 'w') as output:
+        server = subprocess.Popen(command, env=env, stdout=output, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/health')
+            if connection.getresponse().status == 200:
+                connection.close()
+                return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    sys.exit("server didn't come up, see {}".format(os.path.join(directory, 'server.log')))
+
+
+def user_requests(rng, list_sizes, plays):
+    """A user's requests, forever: build a list, play through it, then do the same with the next one."""
+    for n in itertools.count():
+        size = list_sizes[n % len(list_sizes)]
+        for request in events.user_script(rng, 'list number {}'.format(n), size, plays):
+            yield request
+
+
+class Client(object):
+    """One keep-alive connection and the simulated users whose requests go down it."""
+
+    def __init__(self, args, port, index, rng):
+        self.port = port
+        self.connection = None
+        self.users = [(events.SimulatedUser('amzn1.ask.account.load-{}-{}'.format(index, n)),
+                       user_requests(rng, args.list_sizes, args.plays))
+                      for n in range(args.users_per_connection)]
+        self.rng = rng
+
+    def send(self, body):
+        """POST body and return (status, response body). Raises OSError if the server can't be reached."""
+        for attempt in (1, 2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            try:
+                self.connection.request('POST', '/', body=body, headers={'Content-Type': 'application/json'})
+                response = self.connection.getresponse()
+                data = response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.connection.close()
+                    self.connection = None
+                return response.status, data
+            except CLOSED_CONNECTION_ERRORS:
+                self.connection.close()
+                self.connection = None
+                if attempt == 2:
+                    raise
+
+    def run(self, until, stop, results):
+        while time.monotonic() < until and not stop.is_set():
+            user, requests = self.rng.choice(self.users)
+            body = json.dumps(user.event(next(requests))).encode('utf-8')
+            start = time.perf_counter()
+            try:
+                status, data = self.send(body)
+            except OSError:
+                results['lost' if stop.is_set() else 'failed'] += 1
+                if stop.is_set():
+                    return
+                continue
+            results['latencies'].append(time.perf_counter() - start)
+            results[status] += 1
+            if stop.is_set():
+                results['draining'] += 1
+            user.receive(json.loads(data) if status == 200 else None)
+
+
+def drive(args, port, first, count, seconds, stop=None):
+    """Run count clients, numbered from first, for seconds. Returns their merged results."""
+    stop = stop or threading.Event()
+    until = time.monotonic() + seconds
+    rng = random.Random(args.seed + first)
+    results = [collections.defaultdict(int, latencies=[]) for _ in range(count)]
+    clients = [Client(args, port, first + n, random.Random(rng.random())) for n in range(count)]
+    threads = [threading.Thread(target=client.run, args=(until, stop, result))
+               for client, result in zip(clients, results)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    merged = collections.defaultdict(int, latencies=[])
+    for result in results:
+        for key, value in result.items():
+            merged[key] += value
+    return dict(merged)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=32, help="keep-alive connections in all")
+    parser.add_argument('--users-per-connection', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10.0, help="length of the measured run")
+    parser.add_argument('--list-sizes', default='5,25', type=lambda s: [int(n) for n in s.split(',')])
+    parser.add_argument('--plays', type=int, default=30, help="playback requests per list")
+    parser.add_argument('--storage-latency', type=float, default=0.0, help="seconds added to every storage call")
+    parser.add_argument('--threads', type=int, default=64, help="server threads per process")
+    parser.add_argument('--concurrency', type=int, default=16, help="server requests handled at once per process")
+    parser.add_argument('--processes', type=int, default=1, help="server processes")
+    parser.add_argument('--client-processes', type=int, default=1,
+                        help="processes the connections are spread over, so the clients aren't the bottleneck")
+    parser.add_argument('--metrics', action='store_true', help="keep the server's per-request metrics line on")
+    parser.add_argument('--seed', type=int, default=510)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='generalist-load-')
+    port = free_port()
+    server = start_server(args, port, directory)
+    try:
+        share = [args.connections // args.client_processes + (n < args.connections % args.client_processes)
+                 for n in range(args.client_processes)]
+        firsts = [sum(share[:n]) for n in range(len(share))]
+        start = time.perf_counter()
+        if args.client_processes == 1:
+            results = [drive(args, port, 0, args.connections, args.seconds)]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(args.client_processes) as pool:
+                results = list(pool.map(drive, [args] * len(share), [port] * len(share), firsts, share,
+                                        [args.seconds] * len(share)))
+        elapsed = time.perf_counter() - start
+        latencies = [latency for result in results for latency in result['latencies']]
+        statuses = collections.Counter()
+        for result in results:
+            statuses.update({key: value for key, value in result.items() if isinstance(key, int)})
+        failed = sum(result.get('failed', 0) for result in results)
+
+        print("{} connections, {} users, {} server process(es) x {} threads, concurrency {}, storage latency "
+              "{:.1f}ms".format(args.connections, args.connections * args.users_per_connection, args.processes,
+                                args.threads, args.concurrency, 1000 * args.storage_latency))
+        print("{} requests in {:.1f}s: {:.0f} req/s".format(len(latencies), elapsed, len(latencies) / elapsed))
+        print("latency p50={:.2f}ms p95={:.2f}ms p99={:.2f}ms max={:.2f}ms".format(
+            1000 * percentile(latencies, 50), 1000 * percentile(latencies, 95), 1000 * percentile(latencies, 99),
+            1000 * max(latencies)))
+        print("status " + " ".join("{}={}".format(status, n) for status, n in sorted(statuses.items())) +
+              " failed={}".format(failed))
+
+        # Shut the server down while requests are still coming in.
+        stop = threading.Event()
+        clients = threading.Thread(target=lambda: drain.update(drive(args, port, args.connections,
+                                                                     min(args.connections, 8), 30, stop)))
+        drain = {}
+        clients.start()
+        time.sleep(1.0)
+        signalled = time.perf_counter()
+        server.send_signal(signal.SIGTERM)
+        stop.set()
+        code = server.wait(timeout=60)
+        stopped = time.perf_counter() - signalled
+        clients.join()
+        print("shutdown: exit status {} after {:.2f}s, {} requests answered while draining, {} lost, "
+              "{} failed".format(code, stopped, drain.get('draining', 0), drain.get('lost', 0),
+                                 drain.get('failed', 0)))
+    finally:
+        if server.poll() is None:
+            server.kill()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
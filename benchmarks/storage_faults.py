@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""
+Run synthetic Alexa traffic against a storage backend that fails on purpose, with and without the resilience
+layer (resilience.py), and count what users would have heard.
+
+Storage is an in-memory SQLite database behind resilience.FaultInjectingStorage, which fails the given fraction
+of calls with a throttling error. For every fault rate and mode the report gives
+
+    answered  requests that got their normal response
+    fallback  requests answered with the spoken "try again shortly"
+    crashed   requests where lambda_handler raised, which Alexa reads out as a generic skill failure
+    p50/p95/max latency, the retries made and the number of times the circuit breaker opened
+
+    python benchmarks/storage_faults.py --rates 0,0.05,0.2,1 --users 10
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import contextlib
+import os
+import random
+import time
+
+from common import percentile
+
+import handler_latency
+
+import list_names
+import resilience
+import sqlite_storage
+import storage
+
+
+def run(args, rate, resilient):
+    faulty = resilience.FaultInjectingStorage(sqlite_storage.SQLiteStorage(path=':memory:'), rate=rate,
+                                              code='ProvisionedThroughputExceededException',
+                                              latency=args.latency, seed=args.seed)
+    wrapped = resilience.ResilientStorage(faulty, reset=args.breaker_reset) if resilient else faulty
+    storage.set_backend(storage.InstrumentedStorage(wrapped))
+    list_names.forget()
+
+    import main as skill
+
+    counts = collections.Counter()
+    latencies = []
+    rng = random.Random(args.seed)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for user, request in handler_latency.traffic(args, rng):
+            start = time.perf_counter()
+            try:
+                response = skill.lambda_handler(user.event(request), None)
+            except storage.StorageError:
+                counts['crashed'] += 1
+                # Alexa ends the session when the skill fails.
+                response = None
+            else:
+                if response is not None and response['response']['card']['title'].endswith('Try Again Shortly'):
+                    counts['fallback'] += 1
+                else:
+                    counts['answered'] += 1
+            latencies.append(time.perf_counter() - start)
+            user.receive(response)
+
+    return {'answered': counts['answered'],
+            'fallback': counts['fallback'],
+            'crashed': counts['crashed'],
+            'p50_ms': 1000 * percentile(latencies, 50),
+            'p95_ms': 1000 * percentile(latencies, 95),
+            'max_ms': 1000 * max(latencies),
+            'retries': wrapped.retries if resilient else 0,
+            'opens': wrapped.breaker.opens if resilient else 0,
+            'faults': faulty.faults}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rates', default='0,0.02,0.1,0.3,1', type=lambda s: [float(r) for r in s.split(',')],
+                        help="comma separated fractions of storage calls to fail")
+    parser.add_argument('--users', type=int, default=10, help="number of simulated users")
+    parser.add_argument('--list-sizes', default='5,25', type=lambda s: [int(n) for n in s.split(',')],
+                        help="comma separated list sizes; every user builds and plays one list of each")
+    parser.add_argument('--plays', type=int, default=20, help="playback requests per list")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every storage call")
+    parser.add_argument('--breaker-reset', type=float, default=resilience.BREAKER_RESET)
+    parser.add_argument('--seed', type=int, default=510)
+    args = parser.parse_args()
+
+    fields = ('answered', 'fallback', 'crashed', 'p50_ms', 'p95_ms', 'max_ms', 'retries', 'opens', 'faults')
+    print("{:>6} {:<10} ".format('rate', 'mode') + " ".join("{:>9}".format(f) for f in fields))
+    for rate in args.rates:
+        for resilient in (False, True):
+            result = run(args, rate, resilient)
+            print("{:>6.2f} {:<10} ".format(rate, 'resilient' if resilient else 'plain') + " ".join(
+                "{:>9.1f}".format(result[f]) if f.endswith('_ms') else "{:>9d}".format(result[f])
+                for f in fields))
+
+
+if __name__ == '__main__':
+    main()
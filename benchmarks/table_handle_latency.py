@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""
+Measure what a warm container pays per storage call when it builds a fresh boto3 resource and Table
+handle every time (what main.py used to do) versus reusing the cached handle from dynamodb_storage.table().
+
+Point it at DynamoDB Local (or a real table) with --endpoint. With --construct-only no requests are
+sent at all and only the handle construction overhead is timed, which is enough to see most of the gap.
+
+    python benchmarks/table_handle_latency.py --endpoint http://localhost:8000 --iterations 200
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from common import report
+
+import boto3
+
+import dynamodb_storage
+
+
+def time_calls(get_table, args):
+    key = {'userId': args.user_id}
+    samples = []
+    for _ in range(args.warmup + args.iterations):
+        start = time.perf_counter()
+        handle = get_table()
+        if not args.construct_only:
+            handle.get_item(Key=key)
+        samples.append(time.perf_counter() - start)
+    # Throw away the warm-up calls; we only care about what a warm container sees.
+    return samples[args.warmup:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint', default=dynamodb_storage.DB_URL, help="DynamoDB endpoint URL")
+    parser.add_argument('--table', default='StoredSession', help="table to read from")
+    parser.add_argument('--user-id', default='benchmark-user', help="userId key to look up")
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--construct-only', action='store_true',
+                        help="only time handle construction, do not call DynamoDB")
+    args = parser.parse_args()
+
+    dynamodb_storage.DB_URL = args.endpoint
+    dynamodb_storage.reset()
+
+    def fresh_table():
+        return boto3.resource('dynamodb', region_name=dynamodb_storage.DB_REGION,
+                              endpoint_url=args.endpoint).Table(args.table)
+
+    def cached_table():
+        return dynamodb_storage.table(args.table)
+
+    print("endpoint={} table={} construct_only={}".format(args.endpoint, args.table, args.construct_only))
+    before = time_calls(fresh_table, args)
+    after = time_calls(cached_table, args)
+    report('before', before)
+    report('after', after)
+    print("speedup (mean): {:.1f}x".format(sum(before) / max(sum(after), 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+"""
+Bulk import and export of GeneraList lists.
+
+Building a list by voice takes one "add" per step. This loads whole lists (recipes, checklists, runbooks) from
+a file instead, and writes them back out again. Three formats are understood:
+
+    jsonl     One list per line: {"userId": "...", "listName": "brownies", "steps": ["Preheat the oven", ...]}
+    csv       One step per row, with userId, listName and step columns. The rows of a list must be together.
+    markdown  A heading per list ("# brownies") followed by its steps as a bulleted or numbered list.
+
+--user-id sets the user of every list that doesn't name one (markdown never does). The input is parsed as a
+stream and handed to Storage.put_lists() as it goes; on DynamoDB that is BatchWriteItem in chunks of 25 with
+backoff on unprocessed items. Memory use stays the same however big the file is. Importing a list replaces
+any list of the same name. Names containing '#page#', or that are '#names', are refused, as storage keeps them
+for its own items. The imported names are added to each user's list name index every NAME_INDEX_CHUNK lists, so
+misheard names resolve to the new lists (see list_names.py).
+
+    python bulk_lists.py import recipes.jsonl
+    python bulk_lists.py import checklists.csv --user-id amzn1.ask.account.XYZ
+    python bulk_lists.py import runbooks.md --user-id amzn1.ask.account.XYZ
+    python bulk_lists.py export --user-id amzn1.ask.account.XYZ --format markdown > lists.md
+
+The backend is picked with GENERALIST_STORAGE, as for the skill itself.
+"""
+
+from __future__ import print_function
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import re
+import sys
+import time
+
+import list_names
+import storage
+
+__author__ = 'Mike Lane'
+__email__ = 'mikelane@gmail.com'
+
+EXTENSIONS = {
+    '.jsonl': 'jsonl',
+    '.json': 'jsonl',
+    '.csv': 'csv',
+    '.md': 'markdown',
+    '.markdown': 'markdown'
+}
+
+MARKDOWN_HEADING = re.compile(r'^#{1,6}\s+(.+?)\s*#*\s*$')
+MARKDOWN_STEP = re.compile(r'^\s*(?:[-*+]|\d+[.)])\s+(.+?)\s*$')
+
+# On DynamoDB a list's pages and the user's name index are items of the Lists table too, keyed on listName (see
+# dynamodb_storage.PAGE_SEPARATOR and NAME_INDEX_KEY). A list named like one of them would overwrite it. Speech
+# never produces a '#', so only imported lists can.
+RESERVED_NAME_PART = '#page#'
+RESERVED_NAME = '#names'
+
+# Lists written between updates of the users' name indexes. Only the names since the last update are kept, so
+# memory stays bounded however big the file is.
+NAME_INDEX_CHUNK = 1000
+
+
+# --------------- Readers ------------------
+#
+# Each reader takes an open file and yields (userId, listName, steps) for one list at a time.
+
+def read_jsonl(lines, user_id):
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError('line {}: {}'.format(number, e))
+        yield list_record(record.get('userId') or user_id, record.get('listName'), record.get('steps'),
+                          where='line {}'.format(number))
+
+
+def read_csv(lines, user_id):
+    rows = enumerate(csv.DictReader(lines), 2)
+    for (row_user_id, list_name), group in itertools.groupby(
+            rows, key=lambda row: (row[1].get('userId') or user_id, row[1].get('listName'))):
+        group = list(group)
+        yield list_record(row_user_id, list_name, [row['step'] for _, row in group if row.get('step')],
+                          where='line {}'.format(group[0][0]))
+
+
+def read_markdown(lines, user_id):
+    list_name, steps, where = None, [], None
+    for number, line in enumerate(lines, 1):
+        heading = MARKDOWN_HEADING.match(line)
+        if heading:
+            if list_name is not None:
+                yield list_record(user_id, list_name, steps, where)
+            list_name, steps, where = heading.group(1), [], 'line {}'.format(number)
+            continue
+        step = MARKDOWN_STEP.match(line)
+        if step and list_name is not None:
+            steps.append(step.group(1))
+    if list_name is not None:
+        yield list_record(user_id, list_name, steps, where)
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv, 'markdown': read_markdown}
+
+
+def list_record(user_id, list_name, steps, where):
+    """Check one list read from the input."""
+    if not user_id:
+        raise ValueError('{}: no userId, pass --user-id'.format(where))
+    if not list_name:
+        raise ValueError('{}: no listName'.format(where))
+    if RESERVED_NAME_PART in list_name or list_name == RESERVED_NAME:
+        raise ValueError('{}: listName {!r} is one storage uses for its own items'.format(where, list_name))
+    if not isinstance(steps, list) or not all(isinstance(step, str) for step in steps):
+        raise ValueError('{}: steps must be a list of strings'.format(where))
+    return user_id, list_name, [step.strip() for step in steps if step.strip()]
+
+
+def import_lists(records, counts):
+    """Turn (userId, listName, steps) records into the (header, list_items) pairs put_lists() takes, counting
+    lists and steps and collecting the names of each user's lists as they go past, until update_names() takes
+    them."""
+    for user_id, list_name, steps in records:
+        counts['users'].setdefault(user_id, set()).add(list_name)
+        counts['lists'] += 1
+        counts['steps'] += len(steps)
+        yield {'userId': user_id,
+               'listName': list_name,
+               'numberOfSteps': len(steps),
+               'currentStep': 0,
+               'pageSize': storage.LIST_PAGE_SIZE}, steps
+
+
+def update_names(counts):
+    """Add the names import_lists() collected to each user's name index, and forget them."""
+    for user_id, names in sorted(counts['users'].items()):
+        list_names.update(user_id=user_id, added=names)
+    counts['users'].clear()
+
+
+# --------------- Writers ------------------
+
+def export_lists(backend, user_ids):
+    """Yield (userId, listName, steps) for every list of the given users, one list at a time."""
+    for user_id in user_ids:
+        for summary in backend.query_lists(user_id=user_id):
+            header = backend.get_list_header(user_id=user_id, list_name=summary['listName'])
+            if header is None:
+                continue
+            steps = header.get('listItems')
+            if steps is None:
+                steps = []
+                for page in range(storage.page_of(header['numberOfSteps'], header['pageSize']) + 1):
+                    steps.extend(backend.get_list_page(user_id=user_id, list_name=header['listName'], page=page))
+            yield user_id, header['listName'], steps[:header['numberOfSteps']]
+
+
+def write_jsonl(out, records):
+    for user_id, list_name, steps in records:
+        out.write(json.dumps({'userId': user_id, 'listName': list_name, 'steps': steps}) + '\n')
+
+
+def write_csv(out, records):
+    writer = csv.writer(out)
+    writer.writerow(['userId', 'listName', 'step'])
+    for user_id, list_name, steps in records:
+        writer.writerows([user_id, list_name, step] for step in steps)
+
+
+def write_markdown(out, records):
+    for user_id, list_name, steps in records:
+        out.write('# {}\n\n'.format(list_name))
+        out.writelines('{}. {}\n'.format(number, step) for number, step in enumerate(steps, 1))
+        out.write('\n')
+
+
+WRITERS = {'jsonl': write_jsonl, 'csv': write_csv, 'markdown': write_markdown}
+
+
+# --------------- Command line ------------------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    importer = commands.add_parser('import', help="load lists from a file ('-' for stdin)")
+    importer.add_argument('path')
+    importer.add_argument('--format', choices=sorted(READERS), help="defaults to the file's extension")
+    importer.add_argument('--user-id', help="userId for lists that don't name one")
+
+    exporter = commands.add_parser('export', help="write the lists of one or more users to stdout")
+    exporter.add_argument('--user-id', action='append', required=True, help="may be given more than once")
+    exporter.add_argument('--format', choices=sorted(WRITERS), default='jsonl')
+    args = parser.parse_args()
+
+    backend = storage.create_backend()
+    storage.set_backend(backend)
+
+    if args.command == 'export':
+        WRITERS[args.format](sys.stdout, export_lists(backend, args.user_id))
+        return
+
+    file_format = args.format or EXTENSIONS.get(os.path.splitext(args.path)[1].lower())
+    if file_format is None:
+        parser.error("can't tell the format of {}, pass --format".format(args.path))
+
+    counts = {'lists': 0, 'steps': 0, 'users': {}}
+    start = time.perf_counter()
+    lines = sys.stdin if args.path == '-' else open(args.path, newline='', encoding='utf-8')
+    try:
+        with lines:
+            records = import_lists(READERS[file_format](lines, args.user_id), counts)
+            while True:
+                written = counts['lists']
+                # The names go into the indexes once their lists are written.
+                backend.put_lists(itertools.islice(records, NAME_INDEX_CHUNK))
+                if counts['lists'] == written:
+                    break
+                update_names(counts)
+    except ValueError as e:
+        # Lists before the bad one may have been written only in part. Importing replaces lists, so running
+        # the whole file again once it is fixed is safe.
+        sys.exit("{}: {}".format(args.path, e))
+    except storage.StorageError as e:
+        sys.exit("{}: storage error {} after {} lists".format(args.path, e.code, counts['lists']))
+    print("imported {lists} lists ({steps} steps) in {seconds:.1f}s".format(
+        seconds=time.perf_counter() - start, **counts), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
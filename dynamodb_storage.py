@@ -0,0 +1,805 @@
+#!/usr/bin/env python
+
+"""
+DynamoDB storage backend for GeneraList.
+
+Lambda keeps a container alive between invocations, so anything built at module level is reused by every
+warm request that lands on it. Building a boto3 resource is not free (session setup, loading the service
+model, endpoint resolution and, on the first call, a TLS handshake), so the DynamoDB client is created once,
+lazily, and then shared for the life of the container. Resources and Table handles aren't thread safe; each
+thread keeps its own on top of that client, which costs next to nothing.
+
+Every knob can be overridden with an environment variable on the Lambda function, which also makes it easy
+to point the skill at DynamoDB Local while developing.
+
+A list is a header item keyed by (userId, listName) plus one page item per page keyed by
+(userId, listName#page#00000). Page items point back at their list with pageOf and hold their steps in
+listItems, a DynamoDB list (L) in step order. A list costs 3 bytes plus 1 per element on top of the text,
+where the old {step: text} map (M) also paid for every step number as an attribute name.
+
+Lists written before the paged layout existed are a single item with every step in a listItems map; they are
+rewritten in the paged layout the first time they are read. Pages still holding a map are read as they are
+and rewritten as lists the next time they are written.
+
+Pages whose steps take more than GENERALIST_DB_COMPRESS_BYTES as JSON hold them zlib-compressed in packedItems, a
+binary (B) attribute, instead. DynamoDB bills reads and writes by item size, and step text compresses to well
+under half, so a long page costs fewer capacity units to write on every add and to read on every load. Either
+form is read.
+
+Each user also has one name index item, (userId, #names), that holds the index list_names.py resolves
+misheard list names with. Queries for a user's lists skip it along with the pages.
+
+Headers carry a version that every write bumps, and page items record the version that wrote them. Writes are
+conditional on the version the caller read, so a device holding a stale copy of a list or session gets a
+storage.ConflictError instead of silently overwriting what another device wrote. commit() makes a list write and
+a stored session write in one TransactWriteItems call, so a turn that changes both costs one round trip.
+
+Stored sessions are (userId, attributes, lastUsed), plus expiresAt with GENERALIST_SESSION_TTL_DAYS. Turn on Time
+to Live for expiresAt on the StoredSession table and DynamoDB deletes sessions nobody has used for that long, at no
+cost. Sessions partway through creating a list get no expiresAt; sweeper.py deletes them along with the list.
+"""
+
+from __future__ import print_function
+
+import concurrent.futures
+import functools
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import zlib
+
+import boto3
+import botocore.config
+import botocore.exceptions
+
+import resilience
+import storage
+
+__author__ = 'Mike Lane'
+__email__ = 'mikelane@gmail.com'
+
+DB_REGION = os.environ.get('GENERALIST_DB_REGION', 'us-east-1')
+DB_URL = os.environ.get('GENERALIST_DB_URL', "https://dynamodb.{}.amazonaws.com".format(DB_REGION))
+
+# Connection tuning. Alexa gives us roughly 8 seconds to answer, so fail fast and let the retry mode decide
+# whether another attempt fits rather than hanging on a single slow connection.
+DB_MAX_POOL_CONNECTIONS = int(os.environ.get('GENERALIST_DB_MAX_POOL_CONNECTIONS', 10))
+DB_CONNECT_TIMEOUT = float(os.environ.get('GENERALIST_DB_CONNECT_TIMEOUT', 1.0))
+DB_READ_TIMEOUT = float(os.environ.get('GENERALIST_DB_READ_TIMEOUT', 2.0))
+DB_RETRY_MODE = os.environ.get('GENERALIST_DB_RETRY_MODE', 'standard')
+# botocore takes max_attempts as the number of retries after the first attempt. resilience.py retries within
+# the request's time budget, so by default botocore doesn't retry on top of it.
+DB_MAX_ATTEMPTS = int(os.environ.get('GENERALIST_DB_MAX_ATTEMPTS', 0 if resilience.RESILIENCE else 3))
+
+# What DynamoDB is asked to report about the capacity each call consumes: TOTAL, INDEXES or NONE. It costs a few
+# bytes per response and feeds the ConsumedReadCapacity and ConsumedWriteCapacity metrics (see metrics.py).
+DB_CONSUMED_CAPACITY = os.environ.get('GENERALIST_DB_CONSUMED_CAPACITY', 'TOTAL')
+
+# Bulk writes. BatchWriteItem takes at most 25 items per call; whatever DynamoDB leaves unprocessed is sent
+# again after an exponential backoff with full jitter, up to BATCH_MAX_ATTEMPTS times.
+BATCH_WRITE_SIZE = 25
+BATCH_MAX_ATTEMPTS = int(os.environ.get('GENERALIST_BATCH_MAX_ATTEMPTS', 8))
+BATCH_BACKOFF_BASE = 0.05
+BATCH_BACKOFF_CAP = 5.0
+
+# Days a stored session is kept after it was last written, as an expiresAt attribute for DynamoDB's Time to Live
+# to act on. 0 writes no expiresAt.
+SESSION_TTL_DAYS = float(os.environ.get('GENERALIST_SESSION_TTL_DAYS', 0))
+TTL_ATTRIBUTE = 'expiresAt'
+
+# Writes that don't depend on each other, such as the pages of a list, go out concurrently on this many threads.
+DB_WRITE_THREADS = int(os.environ.get('GENERALIST_DB_WRITE_THREADS', 4))
+
+# TransactWriteItems takes at most this many items. Bigger commits are left to the caller to write one by one.
+TRANSACT_MAX_ITEMS = 100
+
+# Why a transaction was cancelled, as given in its CancellationReasons, and the error code it is reported as.
+# Conflicts between transactions and throttling are worth another try, a failed condition is not.
+CANCELLATION_CODES = (
+    ('ConditionalCheckFailed', 'ConditionalCheckFailedException'),
+    ('ThrottlingError', 'ThrottlingException'),
+    ('ProvisionedThroughputExceeded', 'ProvisionedThroughputExceededException'),
+    ('RequestLimitExceeded', 'RequestLimitExceeded'),
+    ('TransactionConflict', 'TransactionConflictException'),
+)
+
+# Items each Query call evaluates when reading list summaries. Page items are evaluated (and filtered out)
+# along with the headers, so this is well above the number of lists a caller usually wants at once.
+QUERY_PAGE_ITEMS = int(os.environ.get('GENERALIST_QUERY_PAGE_ITEMS', 100))
+
+# Operations whose consumed capacity counts as read capacity. Everything else writes.
+READ_OPERATIONS = frozenset(('GetItem', 'BatchGetItem', 'Query', 'Scan', 'TransactGetItems'))
+
+# Pages whose steps take more bytes than this as JSON are stored compressed, see pack_steps(). A little under a
+# write unit, leaving room for the keys, as pages that already fit in one save nothing. 0 compresses none.
+DB_COMPRESS_BYTES = int(os.environ.get('GENERALIST_DB_COMPRESS_BYTES', 768))
+DB_COMPRESS_LEVEL = 6
+
+# The first byte of packedItems says how the rest of it is encoded.
+PACKED_ZLIB = b'\x01'
+
+PAGE_SEPARATOR = '#page#'
+
+# listName of the item holding a user's list name index (see list_names.py). Speech never produces a '#'.
+NAME_INDEX_KEY = '#names'
+
+# A userId no real user has, read by warm() just to open a connection.
+WARMUP_USER_ID = 'generalist-warmup'
+
+# One low-level client per container, connection pool and all; botocore clients are thread safe. boto3 resources
+# and Table handles are not, so each thread that makes calls (server.py's workers, the write pool, the sweeper's
+# segments) gets a resource of its own on that client, and a Table handle per table name. reset() moves
+# _generation on, so every thread builds new ones at its next call.
+_client = None
+_resource_class = None
+_client_lock = threading.Lock()
+_local = threading.local()
+_generation = 0
+_write_pool = None
+
+# Capacity units consumed so far, as [read, write] per thread, see add_consumed_capacity(). Threads of the write
+# pool add to the totals of the thread that gave them the work (see concurrently()), so when server.py handles
+# several requests at once each request's capacity is still its own.
+_consumed = threading.local()
+_consumed_lock = threading.Lock()
+
+# The token and lastUsed time of the last commit on this thread, see commit().
+_last_commit = threading.local()
+
+
+def client_config():
+    """The botocore config used for every DynamoDB connection this container makes."""
+    return botocore.config.Config(
+        region_name=DB_REGION,
+        max_pool_connections=DB_MAX_POOL_CONNECTIONS,
+        connect_timeout=DB_CONNECT_TIMEOUT,
+        read_timeout=DB_READ_TIMEOUT,
+        retries={'mode': DB_RETRY_MODE, 'max_attempts': DB_MAX_ATTEMPTS},
+        tcp_keepalive=True
+    )
+
+
+def dynamodb():
+    """Return the calling thread's DynamoDB resource, building the container-wide client under it on first use."""
+    global _client, _resource_class
+    resource = getattr(_local, 'dynamodb', None)
+    if resource is not None and _local.generation == _generation:
+        return resource
+    with _client_lock:
+        if _client is None:
+            resource = boto3.session.Session().resource('dynamodb',
+                                                        region_name=DB_REGION,
+                                                        endpoint_url=DB_URL or None,
+                                                        config=client_config())
+            _client, _resource_class = resource.meta.client, type(resource)
+            if DB_CONSUMED_CAPACITY != 'NONE':
+                events = _client.meta.events
+                events.register('before-parameter-build.dynamodb', ask_for_consumed_capacity)
+                events.register('after-call.dynamodb', add_consumed_capacity)
+        else:
+            # Only a new object on the same client: no credentials to look up and no connections to open.
+            resource = _resource_class(client=_client)
+        _local.dynamodb, _local.tables, _local.generation = resource, {}, _generation
+    return resource
+
+
+def ask_for_consumed_capacity(params, model, **kwargs):
+    """botocore hook: have every call that can report the capacity it consumed do so."""
+    if model.input_shape is not None and 'ReturnConsumedCapacity' in model.input_shape.members:
+        params.setdefault('ReturnConsumedCapacity', DB_CONSUMED_CAPACITY)
+
+
+def add_consumed_capacity(parsed, model, **kwargs):
+    """botocore hook: add the capacity a call reported to the running totals of the calling thread. Batch and
+    transaction calls report a list, one entry per table."""
+    consumed = parsed.get('ConsumedCapacity')
+    if not consumed:
+        return
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    units = sum(float(entry.get('CapacityUnits', 0)) for entry in consumed)
+    totals = consumed_totals()
+    with _consumed_lock:
+        totals[0 if model.name in READ_OPERATIONS else 1] += units
+
+
+def consumed_totals():
+    """The [read, write] capacity totals of the calling thread."""
+    totals = getattr(_consumed, 'totals', None)
+    if totals is None:
+        totals = _consumed.totals = [0.0, 0.0]
+    return totals
+
+
+def table(name):
+    """Return the calling thread's cached Table handle for the table called name."""
+    resource = dynamodb()
+    try:
+        return _local.tables[name]
+    except KeyError:
+        _local.tables[name] = handle = resource.Table(name)
+        return handle
+
+
+def write_pool():
+    """Return the container-wide thread pool for concurrent writes, starting it on first use. Its threads make
+    their calls through resources of their own, see dynamodb()."""
+    global _write_pool
+    if _write_pool is None:
+        _write_pool = concurrent.futures.ThreadPoolExecutor(max_workers=DB_WRITE_THREADS,
+                                                            thread_name_prefix='generalist-write')
+    return _write_pool
+
+
+def concurrently(function, args):
+    """Call function on each of args on the write pool and return the results in order. The capacity the calls
+    consume counts towards the calling thread."""
+    totals = consumed_totals()
+
+    def call(arg):
+        _consumed.totals = totals
+        try:
+            return function(arg)
+        finally:
+            _consumed.totals = None
+
+    return list(write_pool().map(call, args))
+
+
+def transact_item(action, table_name, **kwargs):
+    """One element of TransactItems. kwargs are as the Table method of the same action takes them; the client
+    of the resource turns Python values into DynamoDB's typed form, as it does for the Table methods."""
+    kwargs['TableName'] = table_name
+    return {action: kwargs}
+
+
+def cancellation_code(error):
+    """The error code a cancelled transaction stands for, judged by why its items were cancelled."""
+    reasons = set(reason.get('Code') for reason in error.response.get('CancellationReasons', []))
+    for reason, code in CANCELLATION_CODES:
+        if reason in reasons:
+            return code
+    return error.response['Error']['Code']
+
+
+def reset():
+    """Forget the client, and every thread's resource and Table handles. The next call to table() builds fresh
+    ones."""
+    global _client, _resource_class, _generation
+    with _client_lock:
+        _client = _resource_class = None
+        _generation += 1
+
+
+def page_key(list_name, page):
+    """The sort key of one page of the list called list_name."""
+    return '{}{}{:05d}'.format(list_name, PAGE_SEPARATOR, int(page))
+
+
+class BatchWriter(object):
+    """Puts items into, or deletes them from, one table with BatchWriteItem, BATCH_WRITE_SIZE at a time. flush()
+    returns once every item put or deleted so far has been written. Putting or deleting an item whose key is
+    already waiting replaces the waiting request, because one BatchWriteItem call may not hold the same key
+    twice."""
+
+    def __init__(self, table_name, key_names=('userId', 'listName')):
+        self.table_name = table_name
+        self.key_names = key_names
+        # (key, request) pairs, oldest first.
+        self.buffer = []
+        self.items_written = 0
+        self.retries = 0
+
+    def put(self, item):
+        self.add(item, {'PutRequest': {'Item': item}})
+
+    def delete(self, key):
+        self.add(key, {'DeleteRequest': {'Key': key}})
+
+    def add(self, item, request):
+        key = tuple(item[name] for name in self.key_names)
+        self.buffer = [(k, r) for k, r in self.buffer if k != key]
+        self.buffer.append((key, request))
+        if len(self.buffer) >= BATCH_WRITE_SIZE:
+            self.send()
+
+    def flush(self):
+        while self.buffer:
+            self.send()
+
+    def send(self):
+        requests = [request for _, request in self.buffer[:BATCH_WRITE_SIZE]]
+        del self.buffer[:BATCH_WRITE_SIZE]
+        attempt = 0
+        while requests:
+            response = dynamodb().batch_write_item(RequestItems={self.table_name: requests})
+            unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            self.items_written += len(requests) - len(unprocessed)
+            requests = unprocessed
+            if requests:
+                attempt += 1
+                if attempt >= BATCH_MAX_ATTEMPTS:
+                    raise storage.StorageError('UnprocessedItems', response)
+                self.retries += 1
+                time.sleep(random.uniform(0, min(BATCH_BACKOFF_CAP, BATCH_BACKOFF_BASE * 2 ** attempt)))
+
+
+def pack_steps(list_items):
+    """The attribute a page's steps are stored in: {'listItems': [text, ...]}, or {'packedItems': bytes} if the
+    steps take more than DB_COMPRESS_BYTES and compressing them saves anything."""
+    if DB_COMPRESS_BYTES:
+        encoded = json.dumps(list_items, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if len(encoded) > DB_COMPRESS_BYTES:
+            packed = PACKED_ZLIB + zlib.compress(encoded, DB_COMPRESS_LEVEL)
+            if len(packed) < len(encoded):
+                return {'packedItems': packed}
+    return {'listItems': list_items}
+
+
+def unpack_steps(item):
+    """The steps of a page item as a list, whichever form they were stored in."""
+    if 'packedItems' in item:
+        packed = bytes(item['packedItems'])
+        if packed[:1] != PACKED_ZLIB:
+            raise storage.StorageError('UnknownEncoding', 'packedItems starts with {!r}'.format(packed[:1]))
+        return json.loads(zlib.decompress(packed[1:]).decode('utf-8'))
+    list_items = item.get('listItems', [])
+    if isinstance(list_items, dict):
+        return storage.steps_from_map(list_items)[1]
+    return list_items
+
+
+def condition_failed(error):
+    """True if a ClientError is a conditional write being refused."""
+    return error.response['Error']['Code'] == 'ConditionalCheckFailedException'
+
+
+def translate_errors(method):
+    """Turn botocore errors, including connection failures and timeouts, into storage.StorageError."""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except botocore.exceptions.ClientError as e:
+            raise storage.StorageError(e.response['Error']['Code'], e.response)
+        except botocore.exceptions.BotoCoreError as e:
+            raise storage.StorageError(type(e).__name__, str(e))
+    return wrapper
+
+
+class DynamoDBStorage(storage.Storage):
+    """The StoredSession and Lists tables in DynamoDB."""
+
+    def __init__(self, session_tablename=storage.SESSION_TABLENAME, lists_tablename=storage.LISTS_TABLENAME):
+        self.session_tablename = session_tablename
+        self.lists_tablename = lists_tablename
+
+    def warm(self):
+        # Any cheap call that the function's role is allowed to make will do to open the TLS connection.
+        try:
+            table(self.lists_tablename)
+            table(self.session_tablename).get_item(Key={'userId': WARMUP_USER_ID}, ProjectionExpression='userId')
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError):
+            return False
+        return True
+
+    def consumed_capacity(self):
+        totals = consumed_totals()
+        with _consumed_lock:
+            return totals[0], totals[1]
+
+    @translate_errors
+    def get_session(self, user_id):
+        response = table(self.session_tablename).get_item(Key={'userId': user_id})
+        return response['Item']['attributes'] if 'Item' in response else None
+
+    @translate_errors
+    def put_session(self, user_id, attributes, expected_version=0):
+        try:
+            table(self.session_tablename).put_item(Item=self.session_item(user_id, attributes),
+                                                   **self.session_condition(expected_version))
+        except botocore.exceptions.ClientError as e:
+            if condition_failed(e):
+                raise storage.ConflictError(e.response['Error']['Code'], e.response)
+            raise
+
+    @translate_errors
+    def list_exists(self, user_id, list_name):
+        response = table(self.lists_tablename).get_item(Key={'userId': user_id, 'listName': list_name},
+                                                        ProjectionExpression='listName')
+        return 'Item' in response
+
+    @translate_errors
+    def get_list_header(self, user_id, list_name):
+        response = table(self.lists_tablename).get_item(Key={'userId': user_id, 'listName': list_name})
+        if 'Item' not in response:
+            return None
+
+        item = response['Item']
+        header = storage.list_header(item)
+        if 'listItems' in item:
+            # A list from before the paged layout; migrate it while we have it in hand.
+            items_start, list_items = storage.steps_from_map(item['listItems'])
+            header['version'] = self.put_list(header=header, list_items=list_items, items_start=items_start)
+            header['listItems'] = list_items
+        return header
+
+    @translate_errors
+    def get_list_page(self, user_id, list_name, page):
+        response = table(self.lists_tablename).get_item(
+            Key={'userId': user_id, 'listName': page_key(list_name, page)},
+            ProjectionExpression='listItems, packedItems')
+        return unpack_steps(response.get('Item', {}))
+
+    @translate_errors
+    def put_list(self, header, list_items, items_start=1, first_step=1):
+        user_id = header['userId']
+        list_name = header['listName']
+        expected_version = int(header.get('version', 0))
+        version = expected_version + 1
+        pages = storage.split_pages(list_items, items_start, header['pageSize'], first_step)
+
+        lists_table = table(self.lists_tablename)
+        if expected_version == 0 and len(pages) > 1:
+            # A new list, or one being migrated from an old layout. Two devices creating a list of the same name
+            # at the same moment is the only race here, and the header write below still settles who wins.
+            with lists_table.batch_writer() as batch:
+                for page, page_items in pages.items():
+                    batch.put_item(Item=self.page_item(user_id, list_name, page, page_items, version))
+        elif len(pages) > 1:
+            # Pages don't depend on each other, only the header depends on all of them.
+            concurrently(lambda page: self.put_page(user_id, list_name, page, pages[page], expected_version), pages)
+        else:
+            for page, page_items in pages.items():
+                self.put_page(user_id, list_name, page, page_items, expected_version)
+
+        # The header goes last, so it never counts steps whose page hasn't been written.
+        try:
+            lists_table.put_item(Item=self.header_item(header, version), **self.version_condition(expected_version))
+        except botocore.exceptions.ClientError as e:
+            if condition_failed(e):
+                raise storage.ConflictError(e.response['Error']['Code'], e.response)
+            raise
+        return version
+
+    def put_page(self, user_id, list_name, page, page_items, expected_version):
+        """Write one page, unless a newer version of the list than expected_version already wrote it."""
+        item = self.page_item(user_id, list_name, page, page_items, expected_version + 1)
+        try:
+            table(self.lists_tablename).put_item(Item=item, **self.page_condition(expected_version))
+        except botocore.exceptions.ClientError as e:
+            if not condition_failed(e):
+                raise
+            # Either another device got there first, or an earlier write of this page never got as far as
+            # its header. Only the header can tell which.
+            header = table(self.lists_tablename).get_item(Key={'userId': user_id, 'listName': list_name},
+                                                         ProjectionExpression='version').get('Item', {})
+            if int(header.get('version', 0)) != expected_version:
+                raise storage.ConflictError(e.response['Error']['Code'], e.response)
+            table(self.lists_tablename).put_item(Item=item)
+
+    @translate_errors
+    def put_lists(self, lists):
+        writer = BatchWriter(self.lists_tablename)
+        headers = []
+        count = 0
+        for header, list_items in lists:
+            for page, page_items in storage.split_pages(list_items, 1, header['pageSize']).items():
+                writer.put(self.page_item(header['userId'], header['listName'], page, page_items, 1))
+            headers.append(self.header_item(header, 1))
+            count += 1
+            if len(headers) >= BATCH_WRITE_SIZE:
+                self.put_headers(writer, headers)
+                headers = []
+        self.put_headers(writer, headers)
+        return count
+
+    def put_headers(self, writer, headers):
+        """put_lists(): write the headers of lists whose pages are all in writer, then delete the pages of the
+        lists they replace that are past their new end."""
+        # Headers only go out once every one of their pages has been written.
+        writer.flush()
+        stored = self.stored_page_counts(headers)
+        for item in headers:
+            writer.put(item)
+        writer.flush()
+        for item in headers:
+            key = (item['userId'], item['listName'])
+            for page in range(storage.page_of(item['numberOfSteps'], item['pageSize']) + 1, stored.get(key, 0)):
+                writer.delete({'userId': item['userId'], 'listName': page_key(item['listName'], page)})
+        writer.flush()
+
+    def stored_page_counts(self, headers):
+        """The number of pages each of the lists with these headers has stored now, by (userId, listName), read
+        with one BatchGetItem. Lists that aren't stored, or are from before the paged layout, are left out."""
+        keys = {(item['userId'], item['listName']) for item in headers}
+        request = {self.lists_tablename: {
+            'Keys': [{'userId': user_id, 'listName': list_name} for user_id, list_name in sorted(keys)],
+            'ProjectionExpression': 'userId, listName, numberOfSteps, pageSize'
+        }} if keys else {}
+        counts = {}
+        attempt = 0
+        while request:
+            response = dynamodb().batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(self.lists_tablename, []):
+                if 'pageSize' in item:
+                    counts[(item['userId'], item['listName'])] = \
+                        storage.page_of(item['numberOfSteps'], item['pageSize']) + 1
+            request = response.get('UnprocessedKeys')
+            if request:
+                attempt += 1
+                if attempt >= BATCH_MAX_ATTEMPTS:
+                    raise storage.StorageError('UnprocessedKeys', response)
+                time.sleep(random.uniform(0, min(BATCH_BACKOFF_CAP, BATCH_BACKOFF_BASE * 2 ** attempt)))
+        return counts
+
+    @staticmethod
+    def header_item(header, version, now=None):
+        return {'userId': header['userId'],
+                'listName': header['listName'],
+                'numberOfSteps': header['numberOfSteps'],
+                'currentStep': header['currentStep'],
+                'pageSize': header['pageSize'],
+                'version': version,
+                'lastUsed': now or int(time.time())}
+
+    @staticmethod
+    def session_item(user_id, attributes, now=None):
+        now = now or int(time.time())
+        item = {'userId': user_id, 'attributes': attributes, 'lastUsed': now}
+        if SESSION_TTL_DAYS and attributes.get('currentTask') != 'CREATE' and not attributes.get('unsavedSteps'):
+            # Expiring on its own would leave behind the list the session was creating, see sweeper.py, or lose
+            # the steps of a list it holds back (main.DEFER_STEPS).
+            item[TTL_ATTRIBUTE] = now + int(SESSION_TTL_DAYS * 24 * 60 * 60)
+        return item
+
+    @staticmethod
+    def session_condition(expected_version):
+        """The condition for writing a stored session that is at expected_version."""
+        if expected_version:
+            return {'ConditionExpression': 'attributes.sessionVersion = :expected',
+                    'ExpressionAttributeValues': {':expected': expected_version}}
+        return {'ConditionExpression': 'attribute_not_exists(attributes.sessionVersion)'}
+
+    @staticmethod
+    def page_condition(expected_version):
+        """The condition for writing a page of a list that is at expected_version: no newer version wrote it."""
+        return {'ConditionExpression': 'attribute_not_exists(version) OR version <= :expected',
+                'ExpressionAttributeValues': {':expected': expected_version}}
+
+    @staticmethod
+    def version_condition(expected_version):
+        """The condition for writing a list header that is at expected_version."""
+        if expected_version:
+            return {'ConditionExpression': 'version = :expected',
+                    'ExpressionAttributeValues': {':expected': expected_version}}
+        return {'ConditionExpression': 'attribute_not_exists(version)'}
+
+    @staticmethod
+    def page_item(user_id, list_name, page, page_items, version):
+        item = {'userId': user_id,
+                'listName': page_key(list_name, page),
+                'pageOf': list_name,
+                'page': page,
+                'version': version}
+        item.update(pack_steps(page_items))
+        return item
+
+    @staticmethod
+    def cursor_update(fields, expected_version, now=None):
+        """The update and condition for setting fields of a list header, see update_list_cursor()."""
+        values = {':' + k: v for k, v in fields.items()}
+        values[':lastUsed'] = now or int(time.time())
+        if expected_version is None:
+            condition = 'attribute_exists(listName)'
+            if 'currentStep' in fields:
+                condition += ' AND numberOfSteps >= :currentStep'
+        elif expected_version:
+            condition = 'version = :expected'
+            values[':expected'] = expected_version
+        else:
+            condition = 'attribute_exists(listName) AND attribute_not_exists(version)'
+        return {'UpdateExpression': 'SET ' + ', '.join('{0} = :{0}'.format(k) for k in list(fields) + ['lastUsed']),
+                'ConditionExpression': condition,
+                'ExpressionAttributeValues': values}
+
+    @translate_errors
+    def update_list_cursor(self, user_id, list_name, fields, expected_version=None):
+        try:
+            response = table(self.lists_tablename).update_item(
+                Key={'userId': user_id,
+                     'listName': list_name},
+                ReturnValues='ALL_NEW',
+                **self.cursor_update(fields, expected_version)
+            )
+        except botocore.exceptions.ClientError as e:
+            if not condition_failed(e):
+                raise
+            if expected_version is None:
+                return None
+            raise storage.ConflictError(e.response['Error']['Code'], e.response)
+        return storage.list_header(response['Attributes'])
+
+    @translate_errors
+    def commit(self, writes):
+        # The same writes sent again, say by a retry after a timeout whose first try did get through, carry the
+        # same token and DynamoDB applies them only once. The writes hold their expected versions, so a token is
+        # never reused for a later change. DynamoDB refuses a token sent with different items, so a retry also
+        # reuses the lastUsed time of the first try.
+        token = hashlib.sha256(json.dumps(writes, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:36]
+        if getattr(_last_commit, 'token', None) != token:
+            _last_commit.token, _last_commit.now = token, int(time.time())
+        items = []
+        for method, kwargs in writes:
+            items.extend(getattr(self, 'transact_' + method)(now=_last_commit.now, **kwargs))
+        if len(items) > TRANSACT_MAX_ITEMS:
+            return False
+
+        try:
+            dynamodb().meta.client.transact_write_items(TransactItems=items, ClientRequestToken=token)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                raise
+            code = cancellation_code(e)
+            if code == 'ConditionalCheckFailedException':
+                raise storage.ConflictError(code, e.response)
+            raise storage.StorageError(code, e.response)
+        return True
+
+    def transact_put_session(self, user_id, attributes, expected_version=0, now=None):
+        return [transact_item('Put', self.session_tablename, Item=self.session_item(user_id, attributes, now),
+                              **self.session_condition(expected_version))]
+
+    def transact_update_list_cursor(self, user_id, list_name, fields, expected_version=None, now=None):
+        return [transact_item('Update', self.lists_tablename, Key={'userId': user_id, 'listName': list_name},
+                              **self.cursor_update(fields, expected_version, now))]
+
+    def transact_put_list(self, header, list_items, items_start=1, first_step=1, now=None):
+        # Inside a transaction a page can't be put again once the header shows a write that never finished
+        # (see put_page()), so such a commit is refused and the caller's one-by-one writes sort it out.
+        expected_version = int(header.get('version', 0))
+        pages = storage.split_pages(list_items, items_start, header['pageSize'], first_step)
+        items = [transact_item('Put', self.lists_tablename,
+                               Item=self.page_item(header['userId'], header['listName'], page, page_items,
+                                                   expected_version + 1),
+                               **self.page_condition(expected_version))
+                 for page, page_items in pages.items()]
+        items.append(transact_item('Put', self.lists_tablename,
+                                   Item=self.header_item(header, expected_version + 1, now),
+                                   **self.version_condition(expected_version)))
+        return items
+
+    @translate_errors
+    def delete_list(self, user_id, list_name):
+        lists_table = table(self.lists_tablename)
+        response = lists_table.delete_item(Key={'userId': user_id, 'listName': list_name},
+                                           ReturnValues='ALL_OLD')
+        if 'Attributes' not in response:
+            return False
+
+        header = storage.list_header(response['Attributes'])
+        if header['numberOfSteps'] and 'listItems' not in response['Attributes']:
+            with lists_table.batch_writer() as batch:
+                for page in range(storage.page_of(header['numberOfSteps'], header['pageSize']) + 1):
+                    batch.delete_item(Key={'userId': user_id, 'listName': page_key(list_name, page)})
+        return True
+
+    @translate_errors
+    def query_lists(self, user_id):
+        kwargs = {
+            'KeyConditionExpression': 'userId = :userId',
+            'FilterExpression': 'attribute_exists(numberOfSteps)',
+            'ProjectionExpression': 'userId, listName, numberOfSteps, currentStep, pageSize, version, lastUsed',
+            'ExpressionAttributeValues': {':userId': user_id}
+        }
+        headers = []
+        while True:
+            response = table(self.lists_tablename).query(**kwargs)
+            headers.extend(storage.list_header(item) for item in response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return headers
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    @translate_errors
+    def query_list_summaries(self, user_id, limit, start_after=None):
+        kwargs = {
+            'KeyConditionExpression': 'userId = :userId',
+            'FilterExpression': 'attribute_exists(numberOfSteps)',
+            'ProjectionExpression': 'listName, numberOfSteps, lastUsed',
+            'ExpressionAttributeValues': {':userId': user_id},
+            'Limit': QUERY_PAGE_ITEMS
+        }
+        if start_after is not None:
+            kwargs['ExclusiveStartKey'] = {'userId': user_id, 'listName': start_after}
+
+        summaries = []
+        while len(summaries) < limit:
+            response = table(self.lists_tablename).query(**kwargs)
+            summaries.extend(storage.list_summary(item) for item in response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                if len(summaries) <= limit:
+                    return summaries, None
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        summaries = summaries[:limit]
+        return summaries, summaries[-1]['listName']
+
+    @translate_errors
+    def get_name_index(self, user_id):
+        response = table(self.lists_tablename).get_item(Key={'userId': user_id, 'listName': NAME_INDEX_KEY},
+                                                        ProjectionExpression='nameIndex, version')
+        if 'Item' not in response:
+            return None
+        return {'nameIndex': response['Item']['nameIndex'], 'version': int(response['Item'].get('version', 0))}
+
+    @translate_errors
+    def put_name_index(self, user_id, name_index, expected_version=0):
+        try:
+            table(self.lists_tablename).put_item(Item={'userId': user_id,
+                                                       'listName': NAME_INDEX_KEY,
+                                                       'nameIndex': name_index,
+                                                       'version': expected_version + 1},
+                                                 **self.version_condition(expected_version))
+        except botocore.exceptions.ClientError as e:
+            if not condition_failed(e):
+                raise
+            raise storage.ConflictError(e.response['Error']['Code'], e.response)
+        return expected_version + 1
+
+    def scan_sessions(self, segment, total_segments):
+        kwargs = {
+            'Segment': segment,
+            'TotalSegments': total_segments,
+            'ProjectionExpression': 'userId, lastUsed, #attributes.currentTask, #attributes.currentList, '
+                                    '#attributes.unsavedSteps',
+            'ExpressionAttributeNames': {'#attributes': 'attributes'}
+        }
+        while True:
+            response = self.scan_page(self.session_tablename, kwargs)
+            for item in response['Items']:
+                attributes = item.get('attributes', {})
+                yield storage.session_summary(item['userId'], item.get('lastUsed'), attributes.get('currentTask'),
+                                              attributes.get('currentList'), attributes.get('unsavedSteps'))
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    @translate_errors
+    def scan_page(self, table_name, kwargs):
+        return table(table_name).scan(**kwargs)
+
+    @translate_errors
+    def date_session(self, user_id, last_used):
+        try:
+            table(self.session_tablename).update_item(
+                Key={'userId': user_id},
+                UpdateExpression='SET lastUsed = :lastUsed',
+                ConditionExpression='attribute_exists(userId) AND attribute_not_exists(lastUsed)',
+                ExpressionAttributeValues={':lastUsed': int(last_used)})
+        except botocore.exceptions.ClientError as e:
+            if not condition_failed(e):
+                raise
+
+    @translate_errors
+    def delete_sessions(self, user_ids):
+        writer = BatchWriter(self.session_tablename, key_names=('userId',))
+        for user_id in user_ids:
+            writer.delete({'userId': user_id})
+        writer.flush()
+
+    @translate_errors
+    def delete_lists(self, headers):
+        writer = BatchWriter(self.lists_tablename)
+        headers = list(headers)
+        # Headers first, as in delete_list(): a list whose pages outlive it is never seen again, while a header
+        # whose pages are gone would be read out as a list of empty steps.
+        for header in headers:
+            writer.delete({'userId': header['userId'], 'listName': header['listName']})
+        writer.flush()
+        for header in headers:
+            for page in range(storage.page_of(header['numberOfSteps'], header['pageSize']) + 1):
+                writer.delete({'userId': header['userId'], 'listName': page_key(header['listName'], page)})
+        writer.flush()
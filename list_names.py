@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+"""
+Fuzzy resolution of spoken list names.
+
+Alexa doesn't always hear a list name the way it was saved: "brownie recipes" for "brownie recipe", "bred"
+for "bread", "list two" for "list 2". A near miss used to mean "I couldn't find that list" and another turn.
+Each user now has a name index that is updated whenever a list is created, imported or deleted and stored as a
+single small record (see Storage.get_name_index()). When no list has exactly the spoken name, the handlers
+look the name up in the index and load the closest match instead.
+
+A name is matched three ways, best first:
+
+    normalised  lower case, punctuation, filler words ("the", "my", "list") and plural s dropped, numbers
+                as digits. Equal normalised names score 1.0.
+    phonetic    the Soundex code of each normalised word, so names that sound alike match. Scores 0.9.
+    trigrams    the Dice coefficient of the character trigrams of the normalised names, for everything
+                else ("choc chip cookies" for "chocolate chip cookies").
+
+The stored index holds one line per list with its normalised and phonetic keys already worked out, so only
+the trigram postings are built when it is loaded; a user with 100 lists has an index of a few KB. The loaded
+index is cached in-process for GENERALIST_NAME_INDEX_TTL seconds, so most misses cost no reads at all.
+"""
+
+from __future__ import print_function
+
+import collections
+import os
+import re
+import threading
+import time
+
+import log
+import storage
+
+__author__ = 'Mike Lane'
+__email__ = 'mikelane@gmail.com'
+
+# The lowest score a fuzzy match needs before the handlers use it.
+NAME_MATCH_THRESHOLD = float(os.environ.get('GENERALIST_NAME_MATCH_THRESHOLD', 0.6))
+
+# Seconds a loaded index is used before it is read again. Another container may have changed it since.
+NAME_INDEX_TTL = float(os.environ.get('GENERALIST_NAME_INDEX_TTL', 300))
+
+# Users whose index is kept in memory, least recently used dropped first.
+NAME_INDEX_CACHE_SIZE = 1000
+
+# Times update() makes its change before giving up, when each time another device or the sweeper changed the
+# stored index between the read and the write.
+NAME_INDEX_ATTEMPTS = 3
+
+SAME_NAME = 1.0
+SOUNDS_THE_SAME = 0.9
+
+FILLER_WORDS = frozenset(('a', 'an', 'the', 'my', 'our', 'list'))
+
+NUMBER_WORDS = {
+    'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5', 'six': '6', 'seven': '7',
+    'eight': '8', 'nine': '9', 'ten': '10', 'eleven': '11', 'twelve': '12', 'first': '1', 'second': '2',
+    'third': '3'
+}
+
+# Soundex digit for each letter. Vowels (and y) separate repeated codes; h and w don't.
+SOUNDEX_LETTERS = ('aeiouy', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r')
+SOUNDEX_CODES = dict((letter, str(code)) for code, letters in enumerate(SOUNDEX_LETTERS) for letter in letters)
+
+NOT_A_WORD = re.compile(r'[^a-z0-9 ]+')
+
+# user_id -> (time loaded, NameIndex)
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+# --------------- Keys ------------------
+
+def normalise(name):
+    """The words of a name that matter, in the form they are compared in."""
+    words = []
+    for word in NOT_A_WORD.sub(' ', name.lower().replace('&', ' and ')).split():
+        word = NUMBER_WORDS.get(word, word)
+        if word in FILLER_WORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        words.append(word)
+    return ' '.join(words)
+
+
+def soundex(word):
+    if word.isdigit():
+        return word
+    key, last = word[0], SOUNDEX_CODES.get(word[0], '')
+    for letter in word[1:]:
+        code = SOUNDEX_CODES.get(letter, '')
+        if code and code != last and code != '0':
+            key += code
+        if code:
+            last = code
+    return (key + '000')[:4]
+
+
+def phonetic(normalised):
+    return ' '.join(soundex(word) for word in normalised.split())
+
+
+def trigrams(normalised):
+    padded = ' {} '.format(normalised)
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+# --------------- Index ------------------
+
+def build(names):
+    """The stored form of the index of names: one line per name of its normalised key, its phonetic key and
+    the name itself, separated by tabs."""
+    lines = []
+    for name in sorted(set(indexed_name(name) for name in names)):
+        key = normalise(name)
+        lines.append('\t'.join((key, phonetic(key), name)))
+    return '\n'.join(lines)
+
+
+def indexed_name(name):
+    """name as the stored index holds it, with no tabs or line breaks."""
+    return name.replace('\t', ' ').replace('\n', ' ')
+
+
+def stored_names(stored):
+    """The names in the stored form of an index."""
+    return [line.split('\t', 2)[2] for line in stored.splitlines()]
+
+
+class NameIndex(object):
+    """A user's list names, loaded from the stored form made by build()."""
+
+    def __init__(self, stored):
+        self.by_key = {}
+        self.by_sound = {}
+        self.postings = collections.defaultdict(list)
+        self.grams = {}
+        for line in stored.splitlines():
+            key, sound, name = line.split('\t', 2)
+            if key:
+                # Names made only of filler words ("my list") have no key, and must not match each other.
+                self.by_key.setdefault(key, name)
+                self.by_sound.setdefault(sound, []).append(name)
+            self.grams[name] = grams = trigrams(key)
+            for gram in grams:
+                self.postings[gram].append(name)
+
+    def __len__(self):
+        return len(self.grams)
+
+    def match(self, spoken):
+        """Return (name, score) for the name closest to spoken, or (None, 0.0) if nothing is close at all."""
+        key = normalise(spoken)
+        if not key:
+            return None, 0.0
+        if key in self.by_key:
+            return self.by_key[key], SAME_NAME
+
+        grams = trigrams(key)
+        shared = collections.Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+
+        def dice(name):
+            return 2.0 * shared[name] / (len(grams) + len(self.grams[name]))
+
+        alike = self.by_sound.get(phonetic(key))
+        if alike:
+            return max(alike, key=dice), SOUNDS_THE_SAME
+        if not shared:
+            return None, 0.0
+        name = max(shared, key=dice)
+        return name, dice(name)
+
+
+# --------------- Lookups ------------------
+
+def best_match(user_id, spoken):
+    """Return (name, score) for the user's list whose name is closest to spoken, or (None, 0.0)."""
+    return load(user_id).match(spoken)
+
+
+def resolve(user_id, spoken, threshold=None):
+    """Return the name of the user's list that spoken most likely meant, or None if none is close enough."""
+    name, score = best_match(user_id, spoken)
+    if name is None or score < (NAME_MATCH_THRESHOLD if threshold is None else threshold):
+        return None
+    log.info('list_name_resolved', spoken=spoken, listName=name, score=round(score, 3))
+    return name
+
+
+def load(user_id):
+    """The user's NameIndex, from the cache if it is fresh enough. Users with lists from before name indexes
+    existed get theirs built now."""
+    now = time.time()
+    with _cache_lock:
+        cached = _cache.get(user_id)
+        if cached is not None and now - cached[0] < NAME_INDEX_TTL:
+            _cache.move_to_end(user_id)
+            return cached[1]
+
+    stored = storage.backend().get_name_index(user_id=user_id)
+    if stored is None:
+        return update(user_id)
+    return remember(user_id, NameIndex(stored['nameIndex']))
+
+
+def update(user_id, added=(), removed=()):
+    """Add the names of lists that were just created, and drop those of lists that were just deleted, in the
+    user's stored index, and return it. Only the index itself is read, so what this costs doesn't grow with the
+    lists. Users with no index yet get theirs built from the lists they have now, which already reflects the
+    change; that reads every item of their lists, pages and all, so it is only done once.
+
+    The index is written only if it is still at the version that was read. If another device or the sweeper
+    got there first, it is read again and the change made on that, up to NAME_INDEX_ATTEMPTS times, after
+    which the ConflictError is raised."""
+    for attempt in range(1, NAME_INDEX_ATTEMPTS + 1):
+        stored = storage.backend().get_name_index(user_id=user_id)
+        if stored is None:
+            names, version = [header['listName'] for header in storage.backend().query_lists(user_id=user_id)], 0
+        else:
+            names, version = set(stored_names(stored['nameIndex'])), stored['version']
+            names.difference_update(indexed_name(name) for name in removed)
+            names.update(indexed_name(name) for name in added)
+        name_index = build(names)
+        try:
+            storage.backend().put_name_index(user_id=user_id, name_index=name_index, expected_version=version)
+        except storage.ConflictError:
+            log.info('name_index_conflict', userId=user_id, attempt=attempt)
+            if attempt == NAME_INDEX_ATTEMPTS:
+                raise
+            continue
+        return remember(user_id, NameIndex(name_index))
+
+
+def remember(user_id, index):
+    with _cache_lock:
+        _cache[user_id] = (time.time(), index)
+        _cache.move_to_end(user_id)
+        while len(_cache) > NAME_INDEX_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
+
+
+def forget():
+    """Drop every cached index."""
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""
+Structured logging for GeneraList.
+
+Every log line is one JSON object, which CloudWatch Logs Insights and most log pipelines can query directly:
+
+    {"level": "INFO", "event": "load_list", "requestId": "...", "session": {"currentList": "brownies", ...}}
+
+Levels are set with GENERALIST_LOG_LEVEL (DEBUG, INFO, WARNING, ERROR). GENERALIST_LOG_SAMPLE_RATE keeps the
+DEBUG and INFO lines of only that fraction of requests; warnings and errors are always logged.
+
+Nothing is formatted unless the line is actually going to be written: fields are passed as they are and only
+turned into JSON after the level and sample checks pass, and a field can be a callable that is only called
+then. Session attributes, or anything else holding listItems, are never dumped whole, see summarize().
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+__author__ = 'Mike Lane'
+__email__ = 'mikelane@gmail.com'
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+LOG_LEVEL = {v: k for k, v in LEVEL_NAMES.items()}[os.environ.get('GENERALIST_LOG_LEVEL', 'INFO').upper()]
+LOG_SAMPLE_RATE = float(os.environ.get('GENERALIST_LOG_SAMPLE_RATE', 1.0))
+
+# The current request of each thread: fields added to every line of it (context), and whether its DEBUG/INFO
+# lines are being kept (sampled). Per thread, since server.py handles several requests at once.
+_request = threading.local()
+
+
+def begin_request(**fields):
+    """Start logging for a new request: decide whether it is sampled and remember fields (e.g. requestId) to
+    add to each of its lines."""
+    _request.sampled = LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE
+    _request.context = fields
+
+
+def context():
+    """The fields added to every line of the current request."""
+    return getattr(_request, 'context', {})
+
+
+def enabled(level):
+    """True if a line at level would be written right now."""
+    return level >= LOG_LEVEL and (getattr(_request, 'sampled', True) or level >= WARNING)
+
+
+def summarize(session_attributes):
+    """What the logs need to know about session attributes, without the steps of the list."""
+    if not session_attributes:
+        return session_attributes
+    summary = {k: v for k, v in session_attributes.items() if k != 'listItems'}
+    if 'listItems' in session_attributes:
+        summary['itemCount'] = len(session_attributes['listItems'])
+    return summary
+
+
+def emit(level, event, fields, always=False):
+    if not always and not enabled(level):
+        return
+    record = {'level': LEVEL_NAMES[level], 'event': event, 'time': round(time.time(), 3)}
+    record.update(context())
+    for key, value in fields.items():
+        if callable(value):
+            value = value()
+        if isinstance(value, dict) and 'listItems' in value:
+            value = summarize(value)
+        record[key] = value
+    sys.stdout.write(json.dumps(record, default=str) + '\n')
+
+
+def debug(event, **fields):
+    emit(DEBUG, event, fields)
+
+
+def info(event, **fields):
+    emit(INFO, event, fields)
+
+
+def warning(event, **fields):
+    emit(WARNING, event, fields)
+
+
+def error(event, **fields):
+    emit(ERROR, event, fields)
+
+
+def always(event, **fields):
+    """Log at INFO whatever the level and sampling, for lines that were asked for on purpose (see profiling.py)."""
+    emit(INFO, event, fields, always=True)
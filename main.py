@@ -14,9 +14,18 @@ interact with other web services.
 
 from __future__ import print_function
 
-import boto3
-import botocore
-import botocore.exceptions
+import copy
+import os
+import threading
+import time
+
+import list_names
+import log
+import metrics
+import profiling
+import resilience
+import router
+import storage
 
 __author__ = 'Mike Lane'
 __email__ = 'mikelane@gmail.com'
@@ -25,25 +34,99 @@ __email__ = 'mikelane@gmail.com'
 APP_ID = 'amzn1.ask.skill.e208302c-710b-4f30-9344-d0ae6ca3b774'
 SKILL_NAME = 'GeneralList'
 SKILL_INVOKE = 'generalist'
-DB_REGION = 'us-east-1'
-DB_URL = "https://dynamodb.{}.amazonaws.com".format(DB_REGION)
+
+# Build the storage backend (for DynamoDB: import boto3, build the client and open a connection) during the
+# Lambda init phase instead of on the first user's request. On by default when running inside Lambda.
+PREINIT = os.environ.get('GENERALIST_PREINIT', '1' if 'AWS_LAMBDA_FUNCTION_NAME' in os.environ else '0') == '1'
+
+# Treat the session attributes Alexa sends with every request as the source of truth while a session is live,
+# and only write them (and the playback position of the list) at checkpoints: whenever a request does more
+# than move through the list, when the session ends, and every CHECKPOINT_TURNS turns. See flush_writes().
+SESSION_FIRST = os.environ.get('GENERALIST_SESSION_FIRST', '0') == '1'
+CHECKPOINT_TURNS = int(os.environ.get('GENERALIST_CHECKPOINT_TURNS', 10))
+
+# Steps of the current list the session attributes hold during playback: a window around the current step, cut
+# from the page it is on and refilled from the Lists table when playback leaves it. 0 holds the whole page. While
+# a list is being created or edited the session always holds its last page whole, since pages are written whole.
+SESSION_WINDOW = int(os.environ.get('GENERALIST_SESSION_WINDOW', 0))
+
+# While a list is being created or edited, keep the steps added since its last full page in the stored session,
+# which every 'add' writes anyway, and only write them to the Lists table when their page fills, the list is saved
+# or the session ends or moves to another list. unsavedSteps in the session counts them. See save_unsaved_steps().
+DEFER_STEPS = os.environ.get('GENERALIST_DEFER_STEPS', '0') == '1'
+
+# Write the list the session is on and the session itself in one atomic storage call (TransactWriteItems on
+# DynamoDB) instead of one after the other. A transaction costs twice the write capacity of plain writes, but
+# saves a round trip on most turns and can't leave the list written without the session.
+TRANSACTIONS = os.environ.get('GENERALIST_TRANSACTIONS', '1') == '1'
+
+# How many lists "what lists do I have" reads out before asking whether to go on.
+LISTS_SPOKEN_PER_TURN = int(os.environ.get('GENERALIST_LISTS_SPOKEN_PER_TURN', 5))
+
+# Alexa's limit on the length of outputSpeech, and on the content of a card.
+SPEECH_MAX_CHARACTERS = 8000
+
+# How much "read my list" reads out in one turn, in characters of speech.
+READ_CHARACTERS = min(int(os.environ.get('GENERALIST_READ_CHARACTERS', SPEECH_MAX_CHARACTERS)), SPEECH_MAX_CHARACTERS)
+
+CARD_TITLE_PREFIX = 'SessionSpeechlet - '
+READ_MORE_PROMPT = " Say: 'more' to keep going."
+READ_END_PHRASE = " That's the end of your list."
 
 # Global session information
 stored_session = {
     'current_list': None,
     'current_step': None
 }
-SESSION_TABLENAME = 'StoredSession'
-LISTS_TABLENAME = 'Lists'
+
+# Fields of a Lists item that only track playback. Changing them alone is done with an UpdateItem.
+LIST_CURSOR_FIELDS = ('currentStep',)
+
+# Session attributes holding the page of steps being worked on: the steps in order, and the number of the
+# first one. They are not part of the Lists header.
+LIST_WINDOW_FIELDS = ('listItems', 'listItemsStart')
+
+# Session attributes that another device's stored session can take from this one without losing anything the
+# other device did, see merge_session().
+SESSION_MERGE_FIELDS = LIST_CURSOR_FIELDS + ('numberOfSteps', 'listVersion')
+
+
+class PendingWrites(threading.local):
+    """A dict of its own in every thread, so that server.py can handle several requests at once."""
+
+    def __init__(self):
+        self.__dict__.update({
+            'current': None,  # the session of the request being handled
+            'baseline': {},  # session attributes as they were when the request started
+            'session': None,  # the session to write to StoredSession, if it was marked
+            'lists': {},  # listName -> Lists item to write
+            'pages': {},  # (listName, page) -> steps of the pages read, see read_list_page()
+            'lost': []  # (listName, steps) added this request that another device's change kept out
+        })
+
+    def __getitem__(self, key):
+        return self.__dict__[key]
+
+    def __setitem__(self, key, value):
+        self.__dict__[key] = value
+
+
+# Writes requested while handling the current Alexa request. Handlers call update_session() and update_list()
+# as often as they like; flush_writes() puts each modified record exactly once when the request is done.
+pending_writes = PendingWrites()
 
 
 # --------------- Main handler ------------------
 
+@profiling.profiled
 def lambda_handler(event, context):
     """Handles the Launch|Intent|SessionEnded request event
     Returns a JSON response to Alexa with:
     outputSpeech, reprompt, card, shouldEndSession"""
 
+    if is_warmup_event(event):
+        return warm_up()
+
     if (event['session']['application']['applicationId']
             != 'amzn1.ask.skill.e208302c-710b-4f30-9344-d0ae6ca3b774'):
         if APP_ID != '':
@@ -52,15 +135,49 @@ def lambda_handler(event, context):
                                  event['session']['application']['applicationId'],
                                  APP_ID)
 
-    if event['session']['new']:
-        on_session_started({'requestId': event['request']['requestId']}, event['session'])
+    log.begin_request(requestId=event['request']['requestId'])
+    resilience.begin_request(context=context)
+
+    measured = metrics.begin_request()
+    try:
+        response = dispatch_request(event)
+    except Exception:
+        metrics.end_request(measured, event=event, response=None, failed=True)
+        raise
+    metrics.end_request(measured, event=event, response=response)
+    return response
 
-    if event['request']['type'] == 'LaunchRequest':
-        return on_launch(event['request'], event['session'])
-    elif event['request']['type'] == 'IntentRequest':
-        return on_intent(event['request'], event['session'])
-    elif event['request']['type'] == 'SessionEndedRequest':
-        return on_session_ended(event['request'], event['session'])
+
+def dispatch_request(event):
+    """Handle the request in event and write what it changed. If storage can't be reached, answer with
+    build_unavailable_response() instead."""
+    started = False
+    try:
+        if event['session']['new']:
+            on_session_started({'requestId': event['request']['requestId']}, event['session'])
+
+        begin_request(session=event['session'])
+        started = True
+
+        response = None
+        if event['request']['type'] == 'LaunchRequest':
+            response = on_launch(event['request'], event['session'])
+        elif event['request']['type'] == 'IntentRequest':
+            response = on_intent(event['request'], event['session'])
+        elif event['request']['type'] == 'SessionEndedRequest':
+            response = on_session_ended(event['request'], event['session'])
+
+        # Handlers only mark records as modified, this is where they actually get written.
+        flush_writes(checkpoint=event['request']['type'] == 'SessionEndedRequest' or ends_session(response))
+        if pending_writes['lost'] and response is not None:
+            tell_lost_steps(response)
+    except storage.UnavailableError as e:
+        log.warning('storage_unavailable_response', code=e.code, requestType=event['request']['type'])
+        metrics.count('StorageUnavailable')
+        if event['request']['type'] == 'SessionEndedRequest':
+            return None
+        return build_unavailable_response(session_attributes=pending_writes['baseline'] if started else None)
+    return response
 
 
 # --------------- Helpers that build all of the responses ----------------------
@@ -73,8 +190,8 @@ def build_speechlet_response(title, output, reprompt_text, should_end_session):
         },
         'card': {
             'type': 'Simple',
-            'title': 'SessionSpeechlet - ' + title,
-            'content': 'SessionSpeechlet - ' + output
+            'title': CARD_TITLE_PREFIX + title,
+            'content': CARD_TITLE_PREFIX + output
         },
         'reprompt': {
             'outputSpeech': {
@@ -94,6 +211,36 @@ def build_response(session_attributes, speechlet_response):
     }
 
 
+def build_unavailable_response(session_attributes):
+    """What the user hears when storage can't be reached in time (see resilience.py). session_attributes are the
+    attributes as they were when the request came in, so nothing the failed request half did is carried
+    forward, and the session stays open so that nothing earlier turns left unsaved is lost either. If the
+    stored session couldn't even be loaded (session_attributes is None), there is nothing to go on with and
+    the session ends."""
+    speech_output = "Sorry, I can't get to your lists right now. Please try again shortly."
+    reprompt_text = "Please say that again." if session_attributes is not None else ""
+    return build_response(session_attributes=session_attributes if session_attributes is not None else {},
+                          speechlet_response=build_speechlet_response(title="Try Again Shortly",
+                                                                      output=speech_output,
+                                                                      reprompt_text=reprompt_text,
+                                                                      should_end_session=session_attributes is None))
+
+
+def tell_lost_steps(response):
+    """Say in place of the handler's answer that steps it said were added were not, because another device
+    changed the list at the same time (see reapply_list_change())."""
+    list_name, steps = pending_writes['lost'][0]
+    speech_output = "Sorry, your list {} was changed on another device just now, so I couldn't add {}. " \
+                    "Please add {} again.".format(list_name, ", ".join(steps), "it" if len(steps) == 1 else "them")
+    response['response']['outputSpeech']['text'] = speech_output
+    response['response']['card']['content'] = CARD_TITLE_PREFIX + speech_output
+
+
+def ends_session(response):
+    """True if response closes the session. Alexa sends no SessionEndedRequest after that."""
+    return response is not None and response['response'].get('shouldEndSession') is True
+
+
 # --------------- Functions that control the skill's behavior ------------------
 
 def get_welcome_response(session):
@@ -101,7 +248,7 @@ def get_welcome_response(session):
     session_attributes = session.get('attributes', {})
     card_title = 'Welcome to GeneraList'
 
-    print("***GET_WELCOME_RESPONSE, session: {}".format(session_attributes))
+    log.debug('get_welcome_response', session=session_attributes)
 
     if session_attributes['currentList'] != "NONE":
         speech_output = "Welcome back. Go to the next item in your {} list by saying " \
@@ -128,11 +275,11 @@ def get_help_response(session):
     card_title = "Welcome to GeneraList"
     reprompt_text = ""
 
-    print("***GET HELP RESPONSE, session: {}".format(session_attributes))
+    log.debug('get_help_response', session=session_attributes)
 
     if session_attributes['currentTask'] == 'PLAY':
         speech_output = "You currently have a list playback session in progress. To hear the next item " \
-                        "in your list, say: 'next'. "
+                        "in your list, say: 'next'. To hear the rest of it, say: 'read my list'. "
         if session_attributes['currentStep'] > 1:
             speech_output += "To go back to the previous item in your list, say 'previous'. "
         speech_output += "Or you can say: 'stop', 'cancel', 'load', or 'create'."
@@ -158,7 +305,7 @@ def handle_save_intent(session):
     should_end_session = True
     session_attributes = session.get('attributes', {})
 
-    print("***HANDLE SAVE INTENT, session: {}".format(session_attributes))
+    log.debug('handle_save_intent', session=session_attributes)
 
     # If the session is in create or edit mode, update the list, and set the stored status accordingly
     if session_attributes['currentTask'] in ['CREATE', 'EDIT']:
@@ -192,7 +339,7 @@ def handle_session_stop_request(session):
     should_end_session = True
     session_attributes = session.get('attributes', {})
 
-    print("***HANDLE SESSION STOP REQUEST, session: {}".format(session_attributes))
+    log.debug('handle_session_stop_request', session=session_attributes)
 
     # If the session is in create or edit mode, update the list, and set the stored status accordingly
     if session_attributes['currentTask'] in ['CREATE', 'EDIT']:
@@ -226,7 +373,7 @@ def handle_session_cancel_request(session):
     card_title = 'Canceled'
     session_attributes = session.get('attributes', {})
 
-    print("***HANDLE SESSION CANCEL REQUEST, session: {}".format(session_attributes))
+    log.debug('handle_session_cancel_request', session=session_attributes)
 
     speech_output = ""
     reprompt_text = ""
@@ -234,15 +381,17 @@ def handle_session_cancel_request(session):
 
     # If in create mode, but NOT edit mode, delete the list.
     if session_attributes['currentTask'] == 'CREATE':
-        lists_table = boto3.resource('dynamodb').Table(LISTS_TABLENAME)
         try:
-            lists_table.delete_item(
-                Key={'userId': session['user']['userId'],
-                     'listName': session_attributes['listName']}
-            )
-        except botocore.exceptions.ClientError as e:
-            print("ERROR: {}".format(e.response))
+            deleted = storage.backend().delete_list(user_id=session['user']['userId'],
+                                                    list_name=session_attributes['currentList'])
+        except storage.StorageError as e:
+            log.error('storage_error', where='handle_session_cancel_request', response=e.response)
             raise
+        if deleted:
+            update_list_names(user_id=session['user']['userId'], removed=[session_attributes['currentList']])
+        session['attributes'].pop('unsavedSteps', None)
+    else:
+        save_unsaved_steps(session=session)
 
     # Clear out the stored session
     session['attributes']['currentTask'] = "NONE"
@@ -263,8 +412,7 @@ def create_list(intent, session):
     with a message that tells the user to modify a list instead."""
     card_title = intent['name']
 
-    print("***CREATE LIST session: {}".format(session['attributes']))
-    print("***CREATE LIST intent: {}".format(intent['slots']))
+    log.debug('create_list', session=session['attributes'], slots=intent['slots'])
 
     if 'value' in intent['slots']['listName']:
         # First make sure we're not creating a list with the same name we're on
@@ -281,23 +429,23 @@ def create_list(intent, session):
         # Next try and load the list with the desired list name from the db
         # If the list exists, force the user to delete it before they can create a new one with the same name
         else:
-            table = boto3.resource('dynamodb').Table(LISTS_TABLENAME)
             try:
-                response = table.get_item(Key={
-                    'userId': session['user']['userId'],
-                    'listName': intent['slots']['listName']['value']
-                })
-            except botocore.exceptions.ClientError as e:
-                print("ERROR: create_list database failure: {}".format(e.response))
+                exists = storage.backend().list_exists(user_id=session['user']['userId'],
+                                             list_name=intent['slots']['listName']['value'])
+            except storage.StorageError as e:
+                log.error('storage_error', where='create_list', response=e.response)
                 raise
-            print("***CREATE LIST db response: {}".format(response))
-            if 'Item' not in response:
+            if not exists:
                 # Otherwise, set the session attributes accordingly and create the list
+                save_unsaved_steps(session=session)
                 session['attributes']['currentList'] = intent['slots']['listName']['value']
                 session['attributes']['currentTask'] = 'CREATE'
                 session['attributes']['currentStep'] = 0
                 session['attributes']['numberOfSteps'] = 0
-                session['attributes']['listItems'] = {}
+                session['attributes']['pageSize'] = storage.LIST_PAGE_SIZE
+                session['attributes']['listVersion'] = 0
+                session['attributes']['listItems'] = []
+                session['attributes']['listItemsStart'] = 1
                 update_session(session=session)
                 speech_output = "Creating a list named '{}'. " \
                                 "Now say something like: " \
@@ -321,8 +469,6 @@ def create_list(intent, session):
                         "example say, 'Create brownie recipe.'"
         should_end_session = False
 
-    print("***END OF CREATE, session: {}".format(session['attributes']))
-
     return build_response(session_attributes=session['attributes'],
                           speechlet_response=build_speechlet_response(title=card_title,
                                                                       output=speech_output,
@@ -334,8 +480,7 @@ def edit_list(intent, session):
     """Edit a list (currently only supports adding to the list)."""
     card_title = "Edit the List"
 
-    print("***END LIST, session: {}".format(session.get('attributes', {})))
-    print("***END LIST, intent: {}".format(intent['slots']))
+    log.debug('edit_list', session=session.get('attributes', {}), slots=intent['slots'])
 
     # Update the session and current list in case this gets called during the middle of a session
     update_session(session=session)
@@ -345,22 +490,22 @@ def edit_list(intent, session):
     if 'value' in intent['slots']['listName'] and \
                     intent['slots']['listName']['value'] != session['attributes']['currentList']:
         # Try to get the desired list from the database
-        table = boto3.resource('dynamodb').Table(LISTS_TABLENAME)
         try:
-            response = table.get_item(Key={
-                'userId': session['user']['userId'],
-                'listName': intent['slots']['listName']['value']
-            })
-        except botocore.exceptions.ClientError as e:
-            print("ERROR: edit_list database get_item failed: {}".format(e.response))
+            header = find_list_header(user_id=session['user']['userId'],
+                                      list_name=intent['slots']['listName']['value'])
+        except storage.StorageError as e:
+            log.error('storage_error', where='edit_list', response=e.response)
             raise
         else:
-            if 'Item' in response:  # Found the desired list, switch over to that one and go into edit mode
+            if header is not None:  # Found the desired list, switch over to that one and go into edit mode
                 session['attributes']['currentTask'] = 'EDIT'
-                session['attributes']['currentList'] = response['Item']['listName']
-                session['attributes']['currentStep'] = response['Item']['numberOfSteps']
-                session['attributes']['listItems'] = response['Item']['listItems']
-                session['attributes']['numberOfSteps'] = response['Item']['numberOfSteps']
+                session['attributes']['currentList'] = header['listName']
+                session['attributes']['currentStep'] = header['numberOfSteps']
+                session['attributes']['numberOfSteps'] = header['numberOfSteps']
+                session['attributes']['pageSize'] = header['pageSize']
+                session['attributes']['listVersion'] = header['version']
+                # New items go on the end, so only the last page is needed.
+                load_list_page(session=session, step=header['numberOfSteps'], list_items=header.get('listItems'))
                 update_session(session=session)
                 speech_output = "Editing list {}. Say: 'add' and the next item.".format(
                     session['attributes']['currentList'])
@@ -401,8 +546,7 @@ def add_item(intent, session):
     card_title = intent['name']
     session_attributes = session.get('attributes', {})
 
-    print("***ADD ITEM. Session: {}".format(session_attributes))
-    print("***ADD ITEM. Intent: {}".format(intent['slots']))
+    log.debug('add_item', session=session_attributes, slots=intent['slots'])
 
     if session_attributes['currentTask'] not in ['CREATE', 'EDIT']:
         # If not in create or edit mode, we can't add an item.
@@ -419,11 +563,24 @@ def add_item(intent, session):
         # If we are in create or edit mode. Add items to the session_attributes
         should_end_session = False
         session['attributes']['currentStep'] = curr_step = session_attributes['currentStep'] + 1
+        page_size = session['attributes']['pageSize']
+        if storage.page_of(curr_step, page_size) != storage.page_of(curr_step - 1, page_size):
+            # This item starts a new page
+            session['attributes']['listItems'] = []
+            session['attributes']['listItemsStart'] = curr_step
+        elif not holds_last_page(session['attributes']):
+            # Pages are written whole, so the session needs the rest of the page this item lands on. It may
+            # only hold part of it if editing started from a playback window.
+            load_list_page(session=session, step=curr_step)
         session['attributes']['numberOfSteps'] = curr_step
-        session['attributes']['listItems'][str(curr_step)] = intent['slots']['Item']['value']
+        # The previous step is the last one of the list, so it is also the last one the session holds.
+        session['attributes']['listItems'].append(intent['slots']['Item']['value'])
 
-        # Add it to the database
-        update_list(session=session)
+        # Add it to the database. A page that fills up is written whole, steps held back or not.
+        if DEFER_STEPS and curr_step % page_size:
+            session['attributes']['unsavedSteps'] = session['attributes'].get('unsavedSteps', 0) + 1
+        else:
+            update_list(session=session)
         update_session(session=session)
 
         speech_output = "Adding '{}'. ".format(intent['slots']['Item']['value'])
@@ -459,8 +616,7 @@ def delete_list(intent, session):
     should_end_session = True
     reprompt_text = ""
 
-    print("***DELETE LIST, session: {}".format(session.get('attributes', {})))
-    print("***DELETE LIST, intent: {}".format(intent['slots']))
+    log.debug('delete_list', session=session.get('attributes', {}), slots=intent['slots'])
 
     if 'value' in intent['slots']['listName']:
         listName = intent['slots']['listName']['value']
@@ -472,26 +628,46 @@ def delete_list(intent, session):
         speech_output = "I'm not sure what list to delete. Say: 'delete' and then a list name."
         reprompt_text = "I need to know which list to delete. Say: 'delete' and then a list name."
 
+    # A list whose steps are all still held in the session has no row yet (see DEFER_STEPS). Clearing the session
+    # deletes it, and no other list should be taken for it.
+    held = listName == session['attributes']['currentList'] and session['attributes'].get('unsavedSteps', 0) > 0
+    try:
+        deleted = storage.backend().delete_list(user_id=userId, list_name=listName) or held
+        match, score = None, 0.0
+        if not deleted:
+            # Deleting is for good, so a misheard name is only acted on when it differs from a list's name in
+            # nothing that is said aloud (case, plurals, "my"...). Anything less certain is offered instead.
+            match, score = list_names.best_match(user_id=userId, spoken=listName)
+            if score >= list_names.SAME_NAME:
+                deleted = storage.backend().delete_list(user_id=userId, list_name=match)
+                if deleted:
+                    listName = match
+                    speech_output = "I deleted your list, {}.".format(listName)
+                else:
+                    # The index still had a list that is gone, deleted on another device say. It is dropped
+                    # from the index, and the user is told there is no such list rather than offered it.
+                    update_list_names(user_id=userId, removed=[match])
+                    match, score = None, 0.0
+    except storage.StorageError as e:
+        log.error('storage_error', where='delete_list', response=e.response)
+        raise
+
     if listName == session['attributes']['currentList']:
         session['attributes']['currentList'] = 'NONE'
         session['attributes']['currentStep'] = 0
         session['attributes']['currentTask'] = 'None'
         session['attributes']['numberOfSteps'] = 0
-        session['attributes']['listItems'] = {}
-
-    table = boto3.resource('dynamodb').Table(LISTS_TABLENAME)
-    try:
-        response = table.delete_item(
-            Key={
-                'userId': userId,
-                'listName': listName, },
-            ReturnValues='ALL_OLD'
-        )
-    except botocore.exceptions.ClientError as e:
-        print('ERROR reading from database: {}'.format(e.response))
-        raise
-
-    if 'attributes' not in response:
+        session['attributes']['listVersion'] = 0
+        session['attributes']['listItems'] = []
+        session['attributes']['listItemsStart'] = 1
+        session['attributes'].pop('unsavedSteps', None)
+
+    if deleted:
+        update_list_names(user_id=userId, removed=[listName])
+    elif score >= list_names.NAME_MATCH_THRESHOLD:
+        speech_output = "I couldn't find a list named {}. Did you mean {}? To delete it, say: " \
+                        "'delete {}'.".format(listName, match, match)
+    else:
         speech_output = "I couldn't find a list named {} to delete".format(listName)
 
     update_session(session=session)
@@ -515,38 +691,41 @@ def load_list(intent, session):
     session_attributes = session.get('attributes', {})
     should_end_session = False  # Let the user work with the list right away
 
-    print("***LOAD LIST, session: {}".format(session_attributes))
-    print("***LOAD LIST, intent: {}".format(intent['slots']))
+    log.debug('load_list', session=session_attributes, slots=intent['slots'])
 
     if 'value' in intent['slots']['listName']:
+        # Whichever list ends up loaded, the session is leaving create or edit mode.
+        save_unsaved_steps(session=session)
         # If trying to load a new list
         if session_attributes['currentList'] != intent['slots']['listName']['value']:
-            lists_table = boto3.resource('dynamodb').Table(LISTS_TABLENAME)
             try:
-                response = lists_table.get_item(Key={
-                    'userId': session['user']['userId'],
-                    'listName': intent['slots']['listName']['value']
-                })
-            except botocore.exceptions.ClientError as e:
-                print("ERROR in LoadList: {}".format(e.response))
+                header = find_list_header(user_id=session['user']['userId'],
+                                          list_name=intent['slots']['listName']['value'])
+                if header is not None:
+                    session['attributes']['currentList'] = header['listName']
+                    session['attributes']['currentStep'] = header['currentStep']
+                    session['attributes']['currentTask'] = 'PLAY'
+                    session['attributes']['numberOfSteps'] = header['numberOfSteps']
+                    session['attributes']['pageSize'] = header['pageSize']
+                    session['attributes']['listVersion'] = header['version']
+                    # Fetch the page holding the step that 'next' will play.
+                    load_list_page(session=session,
+                                   step=min(header['currentStep'] + 1, header['numberOfSteps']),
+                                   list_items=header.get('listItems'))
+            except storage.StorageError as e:
+                log.error('storage_error', where='load_list', response=e.response)
                 speech_output = "There was a problem loading the list from the database."
                 reprompt_text = ""
                 should_end_session = True
             else:
-                try:
-                    session['attributes']['currentList'] = response['Item']['listName']
-                    session['attributes']['currentStep'] = response['Item']['currentStep']
-                    session['attributes']['currentTask'] = 'PLAY'
-                    session['attributes']['listItems'] = response['Item']['listItems']
-                    session['attributes']['numberOfSteps'] = response['Item']['numberOfSteps']
-
+                if header is not None:
                     update_session(session=session)
 
                     speech_output = "I loaded your list: {}. " \
                                     "You can play your list by saying: " \
-                                    "'tell generalist next'.".format(intent['slots']['listName']['value'])
+                                    "'tell generalist next'.".format(header['listName'])
                     reprompt_text = "To start playback, say: 'next'."
-                except KeyError:  # List not found
+                else:  # List not found
                     speech_output = "I wasn't able to find the list {} " \
                                     "in the database".format(intent['slots']['listName']['value'])
                     reprompt_text = ""
@@ -577,7 +756,7 @@ def get_next_item_from_list(session):
     card_title = "Get Next Item"
     reprompt_text = ""
 
-    print("***GET NEXT ITEM FROM LIST, session: {}".format(session.get('attributes', {})))
+    log.debug('get_next_item_from_list', session=session.get('attributes', {}))
 
     # No list is currently loaded
     if 'currentList' not in session['attributes'] or session['attributes']['currentList'] == "NONE":
@@ -591,7 +770,7 @@ def get_next_item_from_list(session):
         should_end_session = True
     else:  # Able to continue to the next item in the list
         session['attributes']['currentStep'] = curr_step = session['attributes']['currentStep'] + 1
-        next_item = session['attributes']['listItems'][str(curr_step)]
+        next_item = get_list_step(session=session, step=curr_step)
         speech_output = "{}".format(next_item)
         should_end_session = False  # Make it easy to get the next step right away
         update_session(session=session)
@@ -610,7 +789,7 @@ def handle_start_over_request(session):
     should_end_session = True
     reprompt_text = ""
 
-    print("***HANDLE START OVER REQUEST, session: {}".format(session.get('attributes', {})))
+    log.debug('handle_start_over_request', session=session.get('attributes', {}))
 
     if session['attributes']['currentList'] == "NONE":
         speech_output = "You must load a list before I can restart."
@@ -637,7 +816,7 @@ def peek_at_next_item_from_list(session):
     card_title = "Peek at Next Item"
     reprompt_text = ""
 
-    print("***PEEK AT NEXT, session: {}".format(session.get('attributes', {})))
+    log.debug('peek_at_next_item_from_list', session=session.get('attributes', {}))
 
     # No list is currently loaded
     if 'currentList' not in session['attributes'] or session['attributes']['currentList'] == "NONE":
@@ -651,7 +830,7 @@ def peek_at_next_item_from_list(session):
         should_end_session = True
     else:  # Able to peek at the next item in the list
         curr_step = session['attributes']['currentStep'] + 1
-        next_item = session['attributes']['listItems'][str(curr_step)]
+        next_item = get_list_step(session=session, step=curr_step)
         speech_output = "{}".format(next_item)
         should_end_session = False  # Make it easy to get the next step right away
 
@@ -669,7 +848,7 @@ def get_prev_item_from_list(session):
     card_title = "Get Previous Item"
     reprompt_text = ""
 
-    print("***GET PREV ITEM, session: {}".format(session.get('attributes', {})))
+    log.debug('get_prev_item_from_list', session=session.get('attributes', {}))
 
     # No list is currently loaded
     if 'currentList' not in session['attributes'] or session['attributes']['currentList'] == "NONE":
@@ -688,7 +867,7 @@ def get_prev_item_from_list(session):
         should_end_session = True
     else:  # Able to continue to the next item in the list
         session['attributes']['currentStep'] = curr_step = session['attributes']['currentStep'] - 1
-        next_item = session['attributes']['listItems'][str(curr_step)]
+        next_item = get_list_step(session=session, step=curr_step)
         speech_output = "{}".format(next_item)
         should_end_session = False  # Make it easy to get the next step right away
         update_session(session=session)
@@ -708,7 +887,7 @@ def review_previous_item_from_list(session):
     card_title = "Review Previous Item"
     reprompt_text = ""
 
-    print("***REVIEW PREVIOUS ITEM, session: {}".format(session.get('attributes', {})))
+    log.debug('review_previous_item_from_list', session=session.get('attributes', {}))
 
     # No list is currently loaded
     if 'currentList' not in session['attributes'] or session['attributes']['currentList'] == "NONE":
@@ -719,12 +898,12 @@ def review_previous_item_from_list(session):
     elif session['attributes']['currentStep'] == 0:
         speech_output = ""
         should_end_session = True
-    elif session['attributes']['currentStep'] == 0:
+    elif session['attributes']['currentStep'] < 2:
         speech_output = "You're at the beginning of your list."
         should_end_session = True
     else:
         curr_step = session['attributes']['currentStep'] - 1
-        next_item = session['attributes']['listItems'][str(curr_step)]
+        next_item = get_list_step(session=session, step=curr_step)
         speech_output = "{}".format(next_item)
         should_end_session = False  # Make it easy to get the next step right away
 
@@ -735,141 +914,848 @@ def review_previous_item_from_list(session):
                                                                       should_end_session=should_end_session))
 
 
+def read_list(intent, session):
+    """Read out the steps of the current list after the current step, as many as fit in one response, or the
+    number asked for ('read the next five') if that is fewer. The cursor moves past them with one write, and
+    'more' reads the next lot."""
+    session_attributes = session.setdefault('attributes', {})
+    session_attributes['readCount'] = spoken_count(intent.get('slots', {}).get('Count'))
+    session_attributes.pop('listsAfter', None)
+    return read_list_steps(session=session)
+
+
+def spoken_count(slot):
+    """The number said for an AMAZON.NUMBER slot, or 0 (as many as fit) if there is none or it isn't positive."""
+    try:
+        return max(0, int(slot['value']))
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
+def spoken_step(text):
+    """A step as a sentence of its own, so that steps read one after another don't run together."""
+    text = text.strip()
+    return text if text[-1:] in ('.', '!', '?') else text + '.'
+
+
+def read_list_steps(session):
+    card_title = "Read List"
+    session_attributes = session['attributes']
+    reprompt_text = ""
+    should_end_session = True
+
+    log.debug('read_list_steps', session=session_attributes)
+
+    if session_attributes.get('currentList', 'NONE') == 'NONE':
+        session_attributes.pop('readCount', None)
+        speech_output = "You need to load a list before I can read it to you. Say: 'load' and the name of a list."
+    elif session_attributes['currentStep'] >= session_attributes['numberOfSteps']:
+        session_attributes.pop('readCount', None)
+        speech_output = "You've reached the end of your list. Start over by saying: 'start over'."
+    else:
+        number_of_steps = int(session_attributes['numberOfSteps'])
+        first = int(session_attributes['currentStep']) + 1
+        last = min(number_of_steps, first + (session_attributes.get('readCount') or number_of_steps) - 1)
+        budget = READ_CHARACTERS - len(CARD_TITLE_PREFIX) - max(len(READ_MORE_PROMPT), len(READ_END_PHRASE))
+
+        # Steps are read one page of the list at a time, so this costs one storage read per page crossed.
+        spoken = []
+        length = -1
+        for step in range(first, last + 1):
+            text = spoken_step(get_list_step(session=session, step=step))
+            if spoken and length + 1 + len(text) > budget:
+                break
+            spoken.append(text[:budget])
+            length += 1 + len(spoken[-1])
+
+        session_attributes['currentStep'] = first + len(spoken) - 1
+        speech_output = " ".join(spoken)
+        if session_attributes['currentStep'] < number_of_steps:
+            speech_output += READ_MORE_PROMPT
+            reprompt_text = "To hear more of your list, say: 'more'."
+            should_end_session = False
+        else:
+            session_attributes.pop('readCount', None)
+            speech_output += READ_END_PHRASE
+        update_session(session=session)
+        update_list(session=session)
+
+    return build_response(session_attributes=session_attributes,
+                          speechlet_response=build_speechlet_response(title=card_title,
+                                                                      output=speech_output,
+                                                                      reprompt_text=reprompt_text,
+                                                                      should_end_session=should_end_session))
+
+
+def more(session):
+    """'More' carries on with whatever was being read out: the steps of the current list (read_list()) or the
+    user's lists (list_lists())."""
+    if session.get('attributes', {}).get('readCount') is not None:
+        return read_list_steps(session=session)
+    return more_lists(session=session)
+
+
+def list_lists(session):
+    """Read out the names of the user's lists, a few at a time. Only the name, the number of steps and when
+    the list was last used are read from the database, and only as many lists as are spoken. The name of the
+    last list spoken is kept in the session so that 'more' can carry on from there."""
+    return read_list_summaries(session=session, start_after=None)
+
+
+def more_lists(session):
+    """Carry on reading out the user's lists from where list_lists() stopped."""
+    if not session.get('attributes', {}).get('listsAfter'):
+        speech_output = "There's nothing more to read. To hear your lists, say: 'what lists do I have'."
+        return build_response(session_attributes=session.get('attributes', {}),
+                              speechlet_response=build_speechlet_response(title="More",
+                                                                          output=speech_output,
+                                                                          reprompt_text="",
+                                                                          should_end_session=True))
+    return read_list_summaries(session=session, start_after=session['attributes']['listsAfter'])
+
+
+def read_list_summaries(session, start_after):
+    card_title = "Your Lists"
+    session_attributes = session.setdefault('attributes', {})
+    should_end_session = True
+    reprompt_text = ""
+
+    log.debug('read_list_summaries', session=session_attributes, start_after=start_after)
+
+    try:
+        summaries, lists_after = storage.backend().query_list_summaries(user_id=session['user']['userId'],
+                                                                        limit=LISTS_SPOKEN_PER_TURN,
+                                                                        start_after=start_after)
+    except storage.StorageError as e:
+        log.error('storage_error', where='read_list_summaries', response=e.response)
+        speech_output = "There was a problem reading your lists from the database."
+    else:
+        # Only the spoken position changes; this is not worth a write to StoredSession.
+        session_attributes['listsAfter'] = lists_after
+        session_attributes.pop('readCount', None)
+        spoken = ["{}, {} {}{}".format(summary['listName'], summary['numberOfSteps'],
+                                       'item' if summary['numberOfSteps'] == 1 else 'items',
+                                       last_used_phrase(summary['lastUsed'])) for summary in summaries]
+        if not spoken and start_after is None:
+            speech_output = "You don't have any lists yet. To make one, say: 'create' and the name of the list."
+        elif not spoken:
+            speech_output = "That's all of your lists."
+        else:
+            speech_output = "{}: {}.".format("Your lists are" if start_after is None else "Next", ". ".join(spoken))
+        if lists_after is not None:
+            speech_output += " Say: 'more' to hear more."
+            reprompt_text = "To hear more of your lists, say: 'more'."
+            should_end_session = False
+
+    return build_response(session_attributes=session_attributes,
+                          speechlet_response=build_speechlet_response(title=card_title,
+                                                                      output=speech_output,
+                                                                      reprompt_text=reprompt_text,
+                                                                      should_end_session=should_end_session))
+
+
+def last_used_phrase(last_used):
+    """', used today', ', used 3 days ago' and so on, or nothing for lists saved before this was recorded."""
+    if not last_used:
+        return ""
+    days = int((time.time() - int(last_used)) // 86400)
+    if days < 1:
+        return ", used today"
+    if days < 2:
+        return ", used yesterday"
+    return ", used {} days ago".format(days)
+
+
 # --------------- Session Persistence ------------------
 
 def load_session(session):
     """Use the current session's userId to load the stored session information"""
     userId = session['user']['userId']
 
-    print("***LOAD SESSION, session: {}".format(session.get('attributes')))
-
-    stored_session_table = boto3.resource('dynamodb').Table(SESSION_TABLENAME)
-
     try:
-        response = stored_session_table.get_item(Key={'userId': userId})
-    except botocore.exceptions.ClientError as e:
-        print("ERROR: {}".format(e.response))
-        return
+        stored_attributes = storage.backend().get_session(user_id=userId)
+    except storage.StorageError as e:
+        log.error('storage_error', where='load_session', response=e.response)
+        raise
 
-    try:
-        session['attributes'] = response['Item']['attributes']
-    except KeyError:
+    if stored_attributes is not None:
+        session['attributes'] = stored_attributes
+    else:
         if 'attributes' not in session:
             session['attributes'] = {}
         session['attributes']['currentList'] = "NONE"
         session['attributes']['currentTask'] = "NONE"
         session['attributes']['currentStep'] = 0
-    print("userId: {}\n"
-          "Loaded: session_attributes = {}".format(userId, session['attributes']))
+    log.debug('load_session', found=stored_attributes is not None, session=session['attributes'])
 
 
 def update_session(session):
-    """Store the requested information in the StoredSession table."""
+    """Mark the session as modified. It is written to the StoredSession table by flush_writes()."""
+    pending_writes['session'] = session
+
+
+def update_list(session):
+    """Mark the current list as modified. It is written to the Lists table by flush_writes().
+
+    The item is captured now rather than at flush time because a handler may switch to another list
+    after saving this one (see edit_list)."""
+    item = list_item(user_id=session['user']['userId'], session_attributes=session.get('attributes', {}))
+    pending_writes['lists'][item['listName']] = item
+    # The write covers any steps earlier adds held back, see flush_writes().
+    session.get('attributes', {}).pop('unsavedSteps', None)
+
+
+def save_unsaved_steps(session):
+    """Mark the list the session is on, and the session, for writing if earlier adds left steps of the list in
+    the stored session only (see DEFER_STEPS). Handlers call this before the session moves off the list other
+    than by saving it."""
+    if session.get('attributes', {}).get('unsavedSteps'):
+        update_list(session=session)
+        update_session(session=session)
+
+
+def list_item(user_id, session_attributes):
+    """Build the Lists header for the list currently held in the session attributes, along with the steps the
+    session holds for it."""
+    return {'userId': user_id,
+            'listName': session_attributes['currentList'],
+            'numberOfSteps': session_attributes['numberOfSteps'],
+            'currentStep': session_attributes['currentStep'],
+            'pageSize': session_attributes.get('pageSize', storage.LIST_PAGE_SIZE),
+            'version': session_attributes.get('listVersion', 0),
+            'listItems': session_attributes['listItems'],
+            'listItemsStart': session_attributes.get('listItemsStart', 1)
+            }
+
+
+def list_is_stored(session_attributes):
+    """True if the list held in the session attributes is already in the Lists table. A list that was just
+    created has no row until its first item is added, or with DEFER_STEPS until its first page fills or it is
+    saved; it is counted as stored from its first item all the same, so that writing it puts the steps the
+    session holds back (see flush_writes())."""
+    task = session_attributes.get('currentTask')
+    return task in ['PLAY', 'EDIT'] or (task == 'CREATE' and session_attributes.get('numberOfSteps', 0) > 0)
+
+
+def find_list_header(user_id, list_name):
+    """Read the header of the list called list_name. If the user has no list by exactly that name, read the
+    one whose name is closest to it instead, if any is close enough (see list_names.py)."""
+    header = storage.backend().get_list_header(user_id=user_id, list_name=list_name)
+    if header is None:
+        match = list_names.resolve(user_id=user_id, spoken=list_name)
+        if match is not None and match != list_name:
+            header = storage.backend().get_list_header(user_id=user_id, list_name=match)
+    return header
+
+
+def update_list_names(user_id, added=(), removed=()):
+    """Add or remove names in the user's list name index after lists were created or deleted. The lists
+    themselves are already stored, so a failure here only leaves misheard names resolving as they did before."""
+    try:
+        list_names.update(user_id=user_id, added=added, removed=removed)
+    except storage.StorageError as e:
+        log.error('storage_error', where='update_list_names', response=e.response)
+
+
+def load_list_page(session, step, list_items=None):
+    """Replace the steps held in the session with the page of the current list that holds step, or during
+    playback with the SESSION_WINDOW steps of it around step. Pass list_items (every step of the list, in order)
+    if the whole list is already at hand, otherwise the page is read from the Lists table."""
+    session_attributes = session['attributes']
+    if step < 1:
+        session_attributes['listItems'] = []
+        session_attributes['listItemsStart'] = 1
+        return
+
+    page_size = int(session_attributes.get('pageSize', storage.LIST_PAGE_SIZE))
+    page = storage.page_of(step, page_size)
+    if list_items is None:
+        list_items = read_list_page(session=session, page=page)
+    else:
+        list_items = list_items[page * page_size:(page + 1) * page_size]
+
+    start = page * page_size + 1
+    # A page can hold steps past the end of the list, left by a write whose header was refused (see put_list()).
+    list_items = list_items[:max(0, int(session_attributes.get('numberOfSteps', 0)) - start + 1)]
+    if 0 < SESSION_WINDOW < len(list_items) and session_attributes.get('currentTask') not in ['CREATE', 'EDIT']:
+        # Mostly ahead of step, as playback mostly goes forward, and never past either end of the page. Only
+        # the playback position is ever written from such a window, see flush_writes().
+        first = max(start, min(int(step) - SESSION_WINDOW // 4, start + len(list_items) - SESSION_WINDOW))
+        list_items = list_items[first - start:first - start + SESSION_WINDOW]
+        start = first
+    # A copy, as steps are appended to the session's and the page may be read again.
+    session_attributes['listItems'] = list(list_items)
+    session_attributes['listItemsStart'] = start
+
+
+def read_list_page(session, page):
+    """Read a page of the current list from the Lists table, or from the pages already read for this request."""
+    key = (session['attributes']['currentList'], page)
+    if key not in pending_writes['pages']:
+        try:
+            pending_writes['pages'][key] = storage.backend().get_list_page(
+                user_id=session['user']['userId'], list_name=key[0], page=page)
+        except storage.StorageError as e:
+            log.error('storage_error', where='load_list_page', response=e.response)
+            raise
+    return pending_writes['pages'][key]
+
+
+def holds_last_page(session_attributes):
+    """True if the session holds the last page of the current list whole, up to its last step."""
+    number_of_steps = int(session_attributes.get('numberOfSteps', 0))
+    if number_of_steps == 0:
+        return True
+    page_size = int(session_attributes.get('pageSize', storage.LIST_PAGE_SIZE))
+    page_start = storage.page_of(number_of_steps, page_size) * page_size + 1
+    return (int(session_attributes.get('listItemsStart', 1)) == page_start and
+            window_index(session_attributes, number_of_steps) is not None)
+
+
+def window_index(session_attributes, step):
+    """The index of step number step in the session's listItems, or None if the session doesn't hold it."""
+    index = int(step) - int(session_attributes.get('listItemsStart', 1))
+    if 0 <= index < len(session_attributes.get('listItems', ())):
+        return index
+    return None
+
+
+def get_list_step(session, step):
+    """Return the text of step number step of the current list, reading its page if the session doesn't
+    already hold it."""
+    index = window_index(session['attributes'], step)
+    if index is None:
+        load_list_page(session=session, step=step)
+        index = window_index(session['attributes'], step)
+        if index is None:
+            raise KeyError(step)
+    return session['attributes']['listItems'][index]
+
+
+def begin_request(session):
+    """Forget writes left over from the previous request on this container and remember the session
+    attributes as they are now, so flush_writes() can tell what actually changed."""
+    pending_writes['current'] = session
+    pending_writes['baseline'] = copy.deepcopy(session.get('attributes', {}))
+    pending_writes['session'] = None
+    pending_writes['lists'] = {}
+    pending_writes['pages'] = {}
+    pending_writes['lost'] = []
+
+    # Sessions saved before listItems became a list hold a {step: text} map. The new form is written back
+    # with the rest of the session the next time it is stored.
+    session_attributes = session.get('attributes', {})
+    if isinstance(session_attributes.get('listItems'), dict):
+        session_attributes['listItemsStart'], session_attributes['listItems'] = \
+            storage.steps_from_map(session_attributes['listItems'])
+
+    # Sessions saved before lists were paged hold every step of their list. Write it out in the paged
+    # layout once; from then on the session only holds one page at a time.
+    if 'pageSize' not in session_attributes and list_is_stored(session_attributes):
+        session_attributes['pageSize'] = storage.LIST_PAGE_SIZE
+        update_list(session=session)
+        update_session(session=session)
+
+
+def flush_writes(checkpoint=False):
+    """Write every record marked during this request once, skipping the ones that did not change.
+    checkpoint is True when the session is ending; in session-first mode that forces out anything left
+    unsaved by earlier turns (see defer_writes())."""
+    baseline = pending_writes['baseline']
+    unsaved_list = None
+    if SESSION_FIRST:
+        if defer_writes(checkpoint=checkpoint):
+            return
+        unsaved_list = take_unsaved_turns()
+
+    lists = pending_writes['lists']
+    pending_writes['lists'] = {}
+
+    # (item, first_step) for every list to write; first_step is None when only the playback position moved.
+    list_writes = []
+    for list_name, item in lists.items():
+        stored = None
+        # Steps the stored list doesn't have yet, although the baseline counts them (see DEFER_STEPS).
+        held_back = 0
+        if list_is_stored(baseline) and baseline.get('currentList') == list_name and 'pageSize' in baseline:
+            stored = list_item(user_id=item['userId'], session_attributes=baseline)
+            held_back = baseline.get('unsavedSteps', 0)
+
+        # Steps are only ever appended, so the header says everything about what changed. The steps held in
+        # the session are just the page being worked on and are not compared.
+        header_fields = [k for k in item if k not in LIST_WINDOW_FIELDS]
+        if stored is not None and not held_back and all(item[k] == stored[k] for k in header_fields) and \
+                list_name != unsaved_list:
+            log.debug('flush_writes_skipped', table='list', listName=list_name)
+        elif stored is not None and not held_back and \
+                all(item[k] == stored[k] for k in header_fields if k not in LIST_CURSOR_FIELDS):
+            # Only the playback position moved, so don't pay for rewriting any steps. This is the only write
+            # playback makes, so the part of a page a SESSION_WINDOW holds is never written as if it were whole.
+            list_writes.append((item, None))
+        else:
+            list_writes.append((item, stored['numberOfSteps'] - held_back + 1 if stored is not None else 1))
+
+    # Writing the list the session is on always changes the session (see adopt_list_header()), so the two can
+    # go out together.
+    session = pending_writes['current']
+    current_list = session.get('attributes', {}).get('currentList') if session is not None else None
+    for item, first_step in list_writes:
+        if first_step is not None and not holds_steps(item, first_step):
+            # A header counting steps that no page holds would break the list for every device. Whatever
+            # counted them, pick up the list as it is stored instead.
+            log.error('list_steps_missing', listName=item['listName'], firstStep=first_step,
+                      numberOfSteps=item['numberOfSteps'], listItemsStart=item['listItemsStart'])
+            reload_list_header(list_name=item['listName'])
+            continue
+        if TRANSACTIONS and item['listName'] == current_list and commit_list_and_session(item, first_step):
+            pending_writes['session'] = None
+            continue
+        if first_step is None:
+            put_list_cursor(item=item)
+        else:
+            put_list(item=item, first_step=first_step)
+
+    # Writing a list can change the session (see adopt_list_header()), so the session goes last.
+    session = pending_writes['session']
+    pending_writes['session'] = None
+    if session is not None:
+        if session.get('attributes', {}) == baseline:
+            log.debug('flush_writes_skipped', table='session')
+        else:
+            put_session(session=session)
+
+
+def holds_steps(item, first_step):
+    """True if a list built by list_item() holds every step that writing it from first_step on puts: the whole
+    page first_step is on, up to the last step of the list."""
+    page_size = int(item['pageSize'])
+    page_start = storage.page_of(first_step, page_size) * page_size + 1
+    items_start = int(item['listItemsStart'])
+    return items_start <= page_start and items_start + len(item['listItems']) > int(item['numberOfSteps'])
+
+
+def defer_writes(checkpoint):
+    """Session-first mode: if this request only moved through the list, leave its writes to a later checkpoint
+    and return True. Alexa hands the session attributes back on the next turn, and unsavedTurns in them counts
+    the turns whose writes are still owed."""
+    session_attributes = pending_writes['current'].get('attributes', {})
+    baseline = pending_writes['baseline']
+    unsaved = session_attributes.get('unsavedTurns', 0)
+
+    changed = set(k for k in set(session_attributes) | set(baseline)
+                  if session_attributes.get(k) != baseline.get(k))
+    if checkpoint or unsaved + 1 >= CHECKPOINT_TURNS or \
+            not changed <= set(LIST_CURSOR_FIELDS + LIST_WINDOW_FIELDS + ('unsavedTurns',)):
+        return False
+
+    if pending_writes['session'] is not None or pending_writes['lists']:
+        session_attributes['unsavedTurns'] = unsaved + 1
+        log.debug('flush_writes_deferred', unsavedTurns=unsaved + 1)
+    pending_writes['session'] = None
+    pending_writes['lists'] = {}
+    return True
+
+
+def take_unsaved_turns():
+    """Session-first mode, at a checkpoint: mark the session and its list for writing if earlier turns left
+    them unsaved, and return the name of the list whose playback position must be written even though this
+    request didn't move it (None if there is none)."""
+    session = pending_writes['current']
     session_attributes = session.get('attributes', {})
+    baseline = pending_writes['baseline']
+    if not session_attributes.pop('unsavedTurns', 0):
+        return None
 
-    print("***UPDATE SESSION, session: {}".format(session_attributes))
+    update_session(session=session)
+    # The position that was left unsaved belongs to the list the session was on when this request started.
+    list_name = baseline.get('currentList')
+    if not list_is_stored(baseline):
+        return None
+    if list_name not in pending_writes['lists']:
+        source = session_attributes if session_attributes.get('currentList') == list_name else baseline
+        pending_writes['lists'][list_name] = list_item(user_id=session['user']['userId'], session_attributes=source)
+    return list_name
+
+
+def commit_list_and_session(item, first_step):
+    """Write a list built by list_item() and the session that is on it in one storage call, with the session
+    as adopt_list_header() would leave it. Either both are written or neither is. Returns False, having written
+    nothing, if the backend can't do that or either record was changed by another device; the caller then
+    writes them one at a time, which sorts out the conflict as put_list() and put_session() always do."""
+    session = pending_writes['current']
+    session_attributes = session['attributes']
+    saved = {k: session_attributes[k] for k in ('listVersion', 'sessionVersion') if k in session_attributes}
+    expected_version = session_attributes.get('sessionVersion', 0)
+    # Only writing the steps moves the list to a new version, see update_list_cursor().
+    session_attributes['listVersion'] = item['version'] + 1 if first_step is not None else item['version']
+    session_attributes['sessionVersion'] = expected_version + 1
+
+    if first_step is None:
+        list_write = ('update_list_cursor', {'user_id': item['userId'],
+                                             'list_name': item['listName'],
+                                             'fields': {k: item[k] for k in LIST_CURSOR_FIELDS},
+                                             'expected_version': item['version']})
+    else:
+        list_write = ('put_list', {'header': {k: v for k, v in item.items() if k not in LIST_WINDOW_FIELDS},
+                                   'list_items': item['listItems'],
+                                   'items_start': item['listItemsStart'],
+                                   'first_step': first_step})
+    log.debug('commit_list_and_session', listName=item['listName'], firstStep=first_step)
 
-    stored_session_table = boto3.resource('dynamodb').Table(SESSION_TABLENAME)
+    committed = False
     try:
-        stored_session_table.put_item(
-            Item={
-                'userId': session['user']['userId'],
-                'attributes': session_attributes
-            }
-        )
-    except botocore.exceptions.ClientError as e:
-        print('ERROR: {}'.format(e.response))
+        committed = storage.backend().commit(writes=[list_write, ('put_session', {
+            'user_id': session['user']['userId'],
+            'attributes': session_attributes,
+            'expected_version': expected_version})])
+    except storage.ConflictError:
+        log.info('commit_conflict', listName=item['listName'], version=item['version'])
+    except storage.StorageError as e:
+        log.error('storage_error', where='commit_list_and_session', response=e.response)
         raise
+    finally:
+        if not committed:
+            session_attributes.pop('listVersion', None)
+            session_attributes.update(saved)
+    if not committed:
+        return False
+
+    if item['version'] == 0:
+        update_list_names(user_id=item['userId'], added=[item['listName']])
+    return True
+
+
+def put_session(session):
+    """Store the requested information in the StoredSession table. The write only goes through if the stored
+    session is still the one this session was loaded from; if another device stored it since, see
+    merge_session()."""
+    session_attributes = session.get('attributes', {})
+    expected_version = session_attributes.get('sessionVersion', 0)
+    session_attributes['sessionVersion'] = expected_version + 1
 
+    log.debug('put_session', session=session_attributes)
+
+    try:
+        storage.backend().put_session(user_id=session['user']['userId'], attributes=session_attributes,
+                                      expected_version=expected_version)
+    except storage.ConflictError:
+        session_attributes['sessionVersion'] = expected_version
+        merge_session(session=session)
+    except storage.StorageError as e:
+        session_attributes['sessionVersion'] = expected_version
+        log.error('storage_error', where='put_session', response=e.response)
+        raise
 
-def update_list(session):
-    """Store the current session information into the list."""
-    session_attributes = session.get('attributes', {})
 
-    print("***UPDATE LIST: session: {}".format(session_attributes))
+def merge_session(session):
+    """Another device stored the session since this one loaded it. If all this request did was move through
+    the list the stored session is on, move the stored session too and carry on from it. Anything else
+    would undo what the other device did, so the stored session is left as it is, see keep_session_writable()."""
+    session_attributes = session['attributes']
+    baseline = pending_writes['baseline']
+    changed = [k for k in set(session_attributes) | set(baseline)
+               if k not in LIST_WINDOW_FIELDS + ('sessionVersion', 'unsavedTurns') and
+               session_attributes.get(k) != baseline.get(k)]
 
-    lists_table = boto3.resource('dynamodb').Table(LISTS_TABLENAME)
+    try:
+        stored = storage.backend().get_session(user_id=session['user']['userId'])
+        # Steps held back by DEFER_STEPS are only in the session that added them, and its numberOfSteps counts
+        # them. Neither side can take the other's count without the steps.
+        if stored is None or stored.get('currentList') != session_attributes.get('currentList') or \
+                not set(changed) <= set(SESSION_MERGE_FIELDS) or \
+                stored.get('unsavedSteps') or session_attributes.get('unsavedSteps'):
+            log.warning('session_conflict', changed=changed, merged=False)
+            keep_session_writable(session=session, stored=stored or {})
+            return
+
+        merged = {k: v for k, v in stored.items() if k not in LIST_WINDOW_FIELDS}
+        merged.update((k, session_attributes[k]) for k in LIST_WINDOW_FIELDS + LIST_CURSOR_FIELDS
+                      if k in session_attributes)
+        for k in ('numberOfSteps', 'listVersion'):
+            merged[k] = max(stored.get(k, 0), session_attributes.get(k, 0))
+        expected_version = stored.get('sessionVersion', 0)
+        merged['sessionVersion'] = expected_version + 1
+        storage.backend().put_session(user_id=session['user']['userId'], attributes=merged,
+                                      expected_version=expected_version)
+    except storage.ConflictError:
+        log.warning('session_conflict', changed=changed, merged=False)
+        return
+    except storage.StorageError as e:
+        log.error('storage_error', where='merge_session', response=e.response)
+        raise
 
+    log.info('session_conflict', changed=changed, merged=True)
+    # The response holds this same dict, so the device carries on from the merged session. It carries on with
+    # what it was doing, though: a device adding to the list must not be put into the other one's playback.
+    current_task = session_attributes.get('currentTask')
+    session_attributes.clear()
+    session_attributes.update(merged)
+    if current_task is not None:
+        session_attributes['currentTask'] = current_task
+
+
+def keep_session_writable(session, stored):
+    """The change merge_session() couldn't merge stays out of the stored session, but the session takes on the
+    stored session's version, or every later write of this Alexa session would be refused as well. Steps held
+    back by DEFER_STEPS have no other copy, so a session holding some is stored over the other device's now,
+    unless that one holds steps of its own."""
+    session_attributes = session['attributes']
+    expected_version = stored.get('sessionVersion', 0)
+    session_attributes['sessionVersion'] = expected_version
+    if not session_attributes.get('unsavedSteps') or stored.get('unsavedSteps'):
+        return
+
+    session_attributes['sessionVersion'] = expected_version + 1
     try:
-        lists_table.put_item(
-            Item={'userId': session['user']['userId'],
-                  'listName': session_attributes['currentList'],
-                  'numberOfSteps': session_attributes['numberOfSteps'],
-                  'currentStep': session_attributes['currentStep'],
-                  'listItems': session_attributes['listItems']
-                  }
-        )
-    except botocore.exceptions.ClientError as e:
-        print('ERROR: {}'.format(e.response))
+        storage.backend().put_session(user_id=session['user']['userId'], attributes=session_attributes,
+                                      expected_version=expected_version)
+    except storage.ConflictError:
+        # Stored again in the meantime. The next write goes through merge_session() once more.
+        session_attributes['sessionVersion'] = expected_version
+        return
+    log.info('session_unsaved_steps_kept', unsavedSteps=session_attributes['unsavedSteps'])
+
+
+def put_list(item, first_step=1):
+    """Store a list built by list_item() in the Lists table. Only the pages holding first_step and later are
+    written, along with the header. If another device changed the list since this session read it, nothing
+    is written and the session picks up the list as it is now, see reload_list_header()."""
+    log.debug('put_list', list=item, firstStep=first_step)
+
+    header = {k: v for k, v in item.items() if k not in LIST_WINDOW_FIELDS}
+    try:
+        version = storage.backend().put_list(header=header, list_items=item['listItems'],
+                                             items_start=item['listItemsStart'], first_step=first_step)
+    except storage.ConflictError:
+        log.warning('list_conflict', listName=item['listName'], version=item['version'])
+        reapply_list_change(item=item, first_step=first_step)
+        return
+    except storage.StorageError as e:
+        log.error('storage_error', where='put_list', response=e.response)
         raise
 
+    header['version'] = version
+    adopt_list_header(list_name=item['listName'], header=header)
+    if item['version'] == 0:
+        update_list_names(user_id=item['userId'], added=[item['listName']])
+
+
+def put_list_cursor(item):
+    """Update only the playback position of a list that is already stored. The cost of this write does not
+    depend on how many steps the list has."""
+    cursor = {k: item[k] for k in LIST_CURSOR_FIELDS}
+
+    log.debug('put_list_cursor', listName=item['listName'], cursor=cursor)
+
+    try:
+        try:
+            header = storage.backend().update_list_cursor(user_id=item['userId'], list_name=item['listName'],
+                                                          fields=cursor, expected_version=item['version'])
+        except storage.ConflictError:
+            # Another device wrote the list since this session read it. The playback position is all this
+            # write changes, so it is merged into the stored header in one more write, without reading the
+            # list. This never resurrects a list that was deleted from another device as a cursor-only stub.
+            log.info('list_cursor_conflict', listName=item['listName'], version=item['version'])
+            header = storage.backend().update_list_cursor(user_id=item['userId'], list_name=item['listName'],
+                                                          fields=cursor)
+    except storage.StorageError as e:
+        log.error('storage_error', where='put_list_cursor', response=e.response)
+        raise
+
+    if header is None:
+        log.warning('put_list_cursor_missing_list', listName=item['listName'])
+    else:
+        adopt_list_header(list_name=item['listName'], header=header)
+
+
+def adopt_list_header(list_name, header):
+    """Bring the session up to date with a list header that was just written, if the session is still on that
+    list. The header may count steps that another device added."""
+    session = pending_writes['current']
+    session_attributes = session.get('attributes', {}) if session is not None else {}
+    if session_attributes.get('currentList') != list_name:
+        return
+    session_attributes['listVersion'] = header['version']
+    session_attributes['numberOfSteps'] = max(session_attributes['numberOfSteps'], header['numberOfSteps'])
+    update_session(session=session)
+
+
+def reapply_list_change(item, first_step):
+    """put_list() was refused because another device changed the list since this session read it. If this
+    session was adding to the list, the steps it added from first_step on are added again after the list's last
+    step as it is now, and written with one more versioned write. If that is refused as well, or the session
+    wasn't adding, it picks up the list as it is stored, and steps it loses are told to the user (see
+    tell_lost_steps())."""
+    session = pending_writes['current']
+    session_attributes = session.get('attributes', {}) if session is not None else {}
+    baseline = pending_writes['baseline']
+    items_start = int(item['listItemsStart'])
+    added = item['listItems'][first_step - items_start:int(item['numberOfSteps']) - items_start + 1]
+    # Steps from first_step on are the ones this session added only if it was adding to the list when the
+    # request came in; saving it, say, has moved it to PLAY since. Rewriting a list in the paged layout for the
+    # first time (see begin_request()) writes every step, so the session must have been paged too.
+    if baseline.get('currentList') != item['listName'] or baseline.get('currentTask') not in ['CREATE', 'EDIT'] or \
+            'pageSize' not in baseline or not added:
+        reload_list_header(list_name=item['listName'])
+        return
+    if not reload_list_header(list_name=item['listName']):
+        # Deleted from another device, steps and all.
+        pending_writes['lost'].append((item['listName'], added))
+        return
+
+    # The stored list's last page, whatever step the session is on.
+    current_step = session_attributes['currentStep']
+    if session_attributes['currentTask'] not in ['CREATE', 'EDIT']:
+        load_list_page(session=session, step=session_attributes['numberOfSteps'])
+    first_step = session_attributes['numberOfSteps'] + 1
+    session_attributes['listItems'].extend(added)
+    session_attributes['numberOfSteps'] += len(added)
+    session_attributes['currentStep'] = session_attributes['numberOfSteps']
+    retry = list_item(user_id=session['user']['userId'], session_attributes=session_attributes)
+    header = {k: v for k, v in retry.items() if k not in LIST_WINDOW_FIELDS}
+    try:
+        version = storage.backend().put_list(header=header, list_items=retry['listItems'],
+                                             items_start=retry['listItemsStart'], first_step=first_step)
+    except storage.ConflictError:
+        log.warning('list_steps_lost', listName=item['listName'], steps=len(added))
+        pending_writes['lost'].append((item['listName'], added))
+        reload_list_header(list_name=item['listName'])
+        return
+    except storage.StorageError as e:
+        log.error('storage_error', where='reapply_list_change', response=e.response)
+        raise
+    log.info('list_steps_reapplied', listName=item['listName'], steps=len(added), firstStep=first_step)
+
+    if session_attributes['currentTask'] in ['CREATE', 'EDIT']:
+        # The session goes on holding only the page its last step is on, as after any add.
+        page_size = int(session_attributes.get('pageSize', storage.LIST_PAGE_SIZE))
+        page_start = storage.page_of(session_attributes['numberOfSteps'], page_size) * page_size + 1
+        del session_attributes['listItems'][:page_start - session_attributes['listItemsStart']]
+        session_attributes['listItemsStart'] = page_start
+    else:
+        session_attributes['currentStep'] = current_step
+        pending_writes['pages'] = {}
+        load_list_page(session=session, step=min(current_step + 1, session_attributes['numberOfSteps']))
+    header['version'] = version
+    adopt_list_header(list_name=item['listName'], header=header)
+
+
+def reload_list_header(list_name):
+    """Another device changed the list the session is on, and this session's change to it was refused. Pick up
+    the list as it is now, so whatever the user does next builds on it. Returns False if the list is gone or the
+    session is no longer on it."""
+    session = pending_writes['current']
+    session_attributes = session.get('attributes', {}) if session is not None else {}
+    if session_attributes.get('currentList') != list_name:
+        return False
+
+    try:
+        header = storage.backend().get_list_header(user_id=session['user']['userId'], list_name=list_name)
+    except storage.StorageError as e:
+        log.error('storage_error', where='reload_list_header', response=e.response)
+        raise
+    if header is None:
+        return False
+
+    session_attributes['numberOfSteps'] = header['numberOfSteps']
+    session_attributes['listVersion'] = header['version']
+    # Pages read earlier in this request may be from before the other device's change.
+    pending_writes['pages'] = {}
+    if session_attributes['currentTask'] in ['CREATE', 'EDIT']:
+        # Steps this session held back went with the rest of the change that was refused.
+        session_attributes.pop('unsavedSteps', None)
+        session_attributes['currentStep'] = header['numberOfSteps']
+        load_list_page(session=session, step=header['numberOfSteps'], list_items=header.get('listItems'))
+    else:
+        session_attributes['currentStep'] = min(session_attributes['currentStep'], header['numberOfSteps'])
+        load_list_page(session=session, step=min(session_attributes['currentStep'] + 1, header['numberOfSteps']),
+                       list_items=header.get('listItems'))
+    update_session(session=session)
+    return True
+
 
 # --------------- Events ------------------
 
 def on_session_started(session_started_request, session):
     """ Called when the session starts """
-    print('on_session_started requestId={}, sessionId={}'.format(session_started_request['requestId'],
-                                                                 session['sessionId']))
+    log.info('on_session_started', sessionId=session['sessionId'])
     load_session(session=session)
 
 
 def on_launch(launch_request, session):
     """ Called when the user launches the skill without specifying what they want"""
-    print('on_launch requestId={}, sessionId={}'.format(launch_request['requestId'], session['sessionId']))
+    log.info('on_launch', sessionId=session['sessionId'])
     # Dispatch to your skill's launch
-    print("***ON_LAUNCH session: {}".format(session.get('attributes', {})))
     return get_welcome_response(session=session)
 
 
 def on_intent(intent_request, session):
     """ Called when the user specifies an intent for this skill """
-    print('on_intent requestId={}, sessionId={}'.format(intent_request['requestId'], session['sessionId']))
-
-    session_attributes = session.get('attributes', {})
-
-    print("***ON INTENT, session: {}".format(session_attributes))
-    print("***ON INTENT, intent_request: {}".format(session_attributes))
-
     intent = intent_request['intent']
     intent_name = intent_request['intent']['name']
 
+    log.info('on_intent', sessionId=session['sessionId'], intent=intent_name)
+    log.debug('on_intent_session', session=session.get('attributes', {}))
+
     # Dispatch to your skill's intent handlers
-    if intent_name == 'LoadListIntent':
-        return load_list(intent, session)
-    elif intent_name == 'CreateListIntent':
-        return create_list(intent, session)
-    elif intent_name == 'EditListIntent':
-        return edit_list(intent, session)
-    elif intent_name == 'AddItemIntent':
-        return add_item(intent, session)
-    elif intent_name == 'SaveIntent':
-        return handle_save_intent(session)
-    elif intent_name == 'AMAZON.NextIntent':
-        return get_next_item_from_list(session)
-    elif intent_name == 'AMAZON.PreviousIntent':
-        return get_prev_item_from_list(session)
-    elif intent_name == 'PeekIntent':
-        return peek_at_next_item_from_list(session)
-    elif intent_name == 'ReviewIntent':
-        return review_previous_item_from_list(session)
-    elif intent_name == 'AMAZON.HelpIntent':
-        return get_help_response(session)
-    elif intent_name == 'AMAZON.StopIntent':
-        return handle_session_stop_request(session)
-    elif intent_name == 'AMAZON.CancelIntent':
-        return handle_session_cancel_request(session)
-    elif intent_name == 'AMAZON.StartOverIntent':
-        return handle_start_over_request(session)
-    elif intent_name == 'DeleteIntent':
-        return delete_list(intent, session)
-    else:
-        raise ValueError('Invalid intent')
+    return intents.dispatch(intent, session)
 
 
 def on_session_ended(session_ended_request, session):
     """ Called when the user ends the session.
     Is not called when the skill returns should_end_session=true"""
-    print('on_session_ended requestId={}, sessionId={}'.format(session_ended_request['requestId'],
-                                                               session['sessionId']))
+    log.info('on_session_ended', sessionId=session['sessionId'], reason=session_ended_request.get('reason'))
     update_list(session=session)
     update_session(session=session)
+
+
+# --------------- Intent routing ------------------
+
+class FlushWritesMiddleware(object):
+    """Write the records an intent handler marked as soon as it returns, so the writes count towards that
+    intent in the timing middleware. lambda_handler's own flush_writes() then has nothing left to do."""
+
+    def after(self, call, response):
+        flush_writes(checkpoint=ends_session(response))
+
+
+intents = router.Router()
+intents.add('LoadListIntent', load_list)
+intents.add('CreateListIntent', create_list)
+intents.add('EditListIntent', edit_list)
+intents.add('AddItemIntent', add_item)
+intents.add('SaveIntent', handle_save_intent, session_only=True)
+intents.add('AMAZON.NextIntent', get_next_item_from_list, session_only=True)
+intents.add('AMAZON.PreviousIntent', get_prev_item_from_list, session_only=True)
+intents.add('PeekIntent', peek_at_next_item_from_list, session_only=True)
+intents.add('ReviewIntent', review_previous_item_from_list, session_only=True)
+intents.add('AMAZON.HelpIntent', get_help_response, session_only=True)
+intents.add('AMAZON.StopIntent', handle_session_stop_request, session_only=True)
+intents.add('AMAZON.CancelIntent', handle_session_cancel_request, session_only=True)
+intents.add('AMAZON.StartOverIntent', handle_start_over_request, session_only=True)
+intents.add('DeleteIntent', delete_list)
+intents.add('ListListsIntent', list_lists, session_only=True)
+intents.add('ReadListIntent', read_list)
+intents.add('AMAZON.MoreIntent', more, session_only=True)
+
+intents.use(router.TimingMiddleware())
+intents.use(FlushWritesMiddleware())
+
+
+# --------------- Cold start ------------------
+
+def is_warmup_event(event):
+    """Scheduled EventBridge pings (or any event with "warmup": true) keep the container and its connections
+    warm. They are not Alexa requests and have no session."""
+    return event.get('source') == 'aws.events' or event.get('warmup') is True
+
+
+def warm_up():
+    """Make sure the storage backend is built and connected, and report whether that worked."""
+    warmed = storage.backend().warm()
+    log.info('warm_up', warmed=warmed)
+    return {'warmed': warmed}
+
+
+if PREINIT:
+    warm_up()
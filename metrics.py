@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""
+Per-request metrics for GeneraList.
+
+lambda_handler writes one line per request in CloudWatch's embedded metric format (EMF): a JSON object whose
+_aws member tells CloudWatch Logs which of the other members are metrics, so they are extracted from the log
+line itself. Nothing is sent anywhere; the line goes to stdout with the rest of the logs, and any other log
+pipeline can read the same members as plain JSON.
+
+    {"_aws": {"Timestamp": 1700000000000, "CloudWatchMetrics": [{"Namespace": "GeneraList",
+              "Dimensions": [["Intent"]], "Metrics": [{"Name": "Latency", "Unit": "Milliseconds"}, ...]}]},
+     "Intent": "AMAZON.NextIntent", "requestId": "...", "Latency": 1.7, "StorageCalls": 1, ...}
+
+The metrics, by intent (or request type for launch and session end):
+
+    Latency                 time spent in lambda_handler
+    StorageCalls            calls to the storage backend, and StorageTime spent in them
+    StorageBytesWritten     the JSON size of what was written to storage
+    RequestBytes            the JSON size of the Alexa request, and ResponseBytes of the response
+    SessionAttributesBytes  the JSON size of the sessionAttributes in the response
+    ConsumedReadCapacity    read and write capacity units DynamoDB reported for this request's calls
+    ConsumedWriteCapacity   (see dynamodb_storage.DB_CONSUMED_CAPACITY)
+    Errors                  1 if lambda_handler raised
+    StorageUnavailable      1 if storage couldn't be reached and the user was asked to try again
+
+Storage figures are the difference between the backend's running counters before and after the request. Only
+StorageBytesWritten costs anything per storage call, and writes are only sized while metrics are on. The counters
+are kept per thread, so the figures stay right when server.py handles several requests at once. Set
+GENERALIST_METRICS=0 to write no metrics at all.
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import sys
+import threading
+import time
+
+import storage
+
+__author__ = 'Mike Lane'
+__email__ = 'mikelane@gmail.com'
+
+METRICS = os.environ.get('GENERALIST_METRICS', '1') == '1'
+METRICS_NAMESPACE = os.environ.get('GENERALIST_METRICS_NAMESPACE', 'GeneraList')
+
+# Every metric in the record with its CloudWatch unit, in the order they are written.
+UNITS = (
+    ('Latency', 'Milliseconds'),
+    ('StorageCalls', 'Count'),
+    ('StorageTime', 'Milliseconds'),
+    ('StorageBytesWritten', 'Bytes'),
+    ('RequestBytes', 'Bytes'),
+    ('ResponseBytes', 'Bytes'),
+    ('SessionAttributesBytes', 'Bytes'),
+    ('ConsumedReadCapacity', 'Count'),
+    ('ConsumedWriteCapacity', 'Count'),
+    ('Errors', 'Count'),
+    ('StorageUnavailable', 'Count')
+)
+
+# The _aws member is the same for every record apart from its timestamp, so it is only turned into JSON once.
+METRIC_DEFINITIONS = json.dumps([{'Namespace': METRICS_NAMESPACE,
+                                  'Dimensions': [['Intent']],
+                                  'Metrics': [{'Name': name, 'Unit': unit} for name, unit in UNITS]}])
+
+# Counts the handlers add to the record of each thread's current request, see count().
+_request = threading.local()
+
+
+def counters():
+    """(time, storage calls, storage seconds, bytes written, read capacity, write capacity) so far."""
+    backend = storage.backend()
+    read, write = backend.consumed_capacity()
+    if isinstance(backend, storage.InstrumentedStorage):
+        return time.perf_counter(), backend.calls, backend.seconds, backend.bytes_written, read, write
+    return time.perf_counter(), 0, 0.0, 0, read, write
+
+
+def begin_request():
+    """Start measuring a request. Returns what end_request() needs, or None if metrics are off."""
+    if not METRICS:
+        return None
+    _request.counts = {}
+    return counters()
+
+
+def count(name, value=1):
+    """Add value to the metric called name in the current request's record."""
+    counts = getattr(_request, 'counts', None)
+    if counts is not None:
+        counts[name] = counts.get(name, 0) + value
+
+
+def size(value):
+    """The length of value as compact JSON."""
+    return len(json.dumps(value, separators=(',', ':'), default=str)) if value is not None else 0
+
+
+def response_sizes(response):
+    """(size of the response, size of its sessionAttributes). The session attributes are most of the response,
+    so they are only turned into JSON once."""
+    if not response or 'sessionAttributes' not in response:
+        return size(response), 0
+    attributes = size(response['sessionAttributes'])
+    rest = {k: v for k, v in response.items() if k != 'sessionAttributes'}
+    return size(rest) + len('"sessionAttributes":,') + attributes, attributes
+
+
+def end_request(started, event, response, failed=False):
+    """Write the metrics record of a request begun with begin_request()."""
+    if started is None:
+        return
+    finished = counters()
+    request = event['request']
+    response_bytes, attributes_bytes = response_sizes(response)
+    record = {
+        'Intent': request['intent']['name'] if request['type'] == 'IntentRequest' else request['type'],
+        'requestId': request['requestId'],
+        'Latency': round(1000 * (finished[0] - started[0]), 3),
+        'StorageCalls': finished[1] - started[1],
+        'StorageTime': round(1000 * (finished[2] - started[2]), 3),
+        'StorageBytesWritten': finished[3] - started[3],
+        'RequestBytes': size(event),
+        'ResponseBytes': response_bytes,
+        'SessionAttributesBytes': attributes_bytes,
+        'ConsumedReadCapacity': round(finished[4] - started[4], 2),
+        'ConsumedWriteCapacity': round(finished[5] - started[5], 2),
+        'Errors': int(failed),
+        'StorageUnavailable': 0
+    }
+    record.update(getattr(_request, 'counts', {}))
+    sys.stdout.write('{"_aws": {"Timestamp": ' + str(int(time.time() * 1000)) + ', "CloudWatchMetrics": ' +
+                     METRIC_DEFINITIONS + '}, ' + json.dumps(record, default=str)[1:] + '\n')
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+"""
+Opt-in profiling of single invocations of GeneraList.
+
+When one household's lists make the skill slow, the only place to see why is production. lambda_handler is
+wrapped with profiled(), which runs a chosen invocation under cProfile and tracemalloc and logs what they found
+as one "profile" line:
+
+    functions    the GENERALIST_PROFILE_TOP functions with the most cumulative time, each as
+                 [function, calls, own ms, cumulative ms, [the callers it spent most time under]]
+    allocations  the lines that allocated the most memory still held at the end of the invocation, each as
+                 [line, KiB, blocks], plus peakKiB, the most memory traced at any one time
+
+An invocation is profiled if
+
+    its user is in the GENERALIST_PROFILE_RATE fraction of users picked by a hash of their userId. The same
+    users are picked on every container, so a slow user keeps being profiled until the rate is turned down
+    the hash of its userId is listed in GENERALIST_PROFILE_USERS (see userHash below)
+    the event has "profile": true, for test events and replayed requests
+
+Lines carry userHash, the start of the SHA-256 of the userId, rather than the userId itself;
+"python profiling.py <userId>" prints it. With GENERALIST_PROFILE_DIR (say /tmp) the full cProfile stats and
+tracemalloc snapshot are also written there as <requestId>.prof and <requestId>.tracemalloc, for pstats,
+snakeviz or tracemalloc.Snapshot.load(). Profiling slows the invocation it covers several times over; every
+other invocation only pays for the sampling check.
+
+One invocation is profiled at a time per process. When server.py handles several requests at once, a sampled one
+that arrives while another is profiled runs unprofiled (profile_skipped), and the allocations of the one that is
+profiled include those of the requests handled alongside it.
+"""
+
+from __future__ import print_function
+
+import cProfile
+import functools
+import hashlib
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+import log
+
+__author__ = 'Mike Lane'
+__email__ = 'mikelane@gmail.com'
+
+PROFILE_RATE = float(os.environ.get('GENERALIST_PROFILE_RATE', 0))
+PROFILE_USERS = frozenset(h.strip() for h in os.environ.get('GENERALIST_PROFILE_USERS', '').split(',') if h.strip())
+PROFILE_DIR = os.environ.get('GENERALIST_PROFILE_DIR', '')
+PROFILE_TOP = int(os.environ.get('GENERALIST_PROFILE_TOP', 20))
+PROFILE_MEMORY = os.environ.get('GENERALIST_PROFILE_MEMORY', '1') == '1'
+
+# Events with this key set to true are always profiled.
+PROFILE_EVENT_FLAG = 'profile'
+
+# Hex digits of the userId hash that make up userHash.
+USER_HASH_DIGITS = 12
+
+# Callers listed for each function in the log line.
+PROFILE_CALLERS = 3
+
+NOT_A_FILE_NAME = re.compile(r'[^A-Za-z0-9._-]+')
+
+# Held while an invocation is profiled. tracemalloc traces the whole process, and from Python 3.12 only one
+# cProfile profiler can be enabled at a time, so when server.py handles several requests at once only one of them
+# is profiled and the others run as they would unsampled.
+_profiling = threading.Lock()
+
+
+# --------------- Sampling ------------------
+
+def user_hash(user_id):
+    return hashlib.sha256(user_id.encode('utf-8')).hexdigest()[:USER_HASH_DIGITS]
+
+
+def sampled(event):
+    """True if the invocation handling event should be profiled."""
+    if not isinstance(event, dict):
+        return False
+    if event.get(PROFILE_EVENT_FLAG) is True:
+        return True
+    if not PROFILE_RATE and not PROFILE_USERS:
+        return False
+    try:
+        hashed = user_hash(event['session']['user']['userId'])
+    except (KeyError, TypeError):
+        return False
+    # userHash read as a fraction between 0 and 1.
+    return hashed in PROFILE_USERS or int(hashed, 16) < PROFILE_RATE * 16 ** USER_HASH_DIGITS
+
+
+def profiled(handler):
+    """Wrap a Lambda handler so that sampled invocations are profiled (see run())."""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if not sampled(event):
+            return handler(event, context)
+        if not _profiling.acquire(blocking=False):
+            log.info('profile_skipped', reason='another invocation is being profiled')
+            return handler(event, context)
+        try:
+            return run(handler, event, context)
+        finally:
+            _profiling.release()
+    return wrapper
+
+
+# --------------- Profiling ------------------
+
+def run(handler, event, context):
+    """Call handler(event, context) under cProfile and, with GENERALIST_PROFILE_MEMORY, tracemalloc, then log
+    what they found. The handler's response or exception is passed on as it is."""
+    profiler = cProfile.Profile()
+    tracing = PROFILE_MEMORY and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Something other than this module is profiling the process.
+        if tracing:
+            tracemalloc.stop()
+        log.info('profile_skipped', reason=str(e))
+        return handler(event, context)
+    started = time.perf_counter()
+    failed = True
+    try:
+        response = handler(event, context)
+        failed = False
+        return response
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        try:
+            report(event, profiler, tracing, elapsed, failed)
+        except Exception as e:
+            # A profile is never worth failing the request for.
+            log.error('profile_failed', error=repr(e))
+        finally:
+            if tracing:
+                tracemalloc.stop()
+
+
+def report(event, profiler, tracing, elapsed, failed):
+    fields = {'ms': round(1000 * elapsed, 3), 'failed': failed}
+    try:
+        fields['userHash'] = user_hash(event['session']['user']['userId'])
+    except (KeyError, TypeError):
+        pass
+
+    # Memory first, before reading the profile allocates anything.
+    snapshot = None
+    if tracing:
+        fields['peakKiB'] = round(tracemalloc.get_traced_memory()[1] / 1024.0, 1)
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, module.__file__) for module in (tracemalloc, cProfile, pstats)] +
+            [tracemalloc.Filter(False, __file__)])
+        fields['allocations'] = [[label(stat.traceback[0].filename, stat.traceback[0].lineno),
+                                  round(stat.size / 1024.0, 1), stat.count]
+                                 for stat in snapshot.statistics('lineno')[:PROFILE_TOP]]
+
+    stats = pstats.Stats(profiler)
+    fields['calls'] = stats.total_calls
+    fields['functions'] = top_functions(stats)
+
+    if PROFILE_DIR:
+        name = NOT_A_FILE_NAME.sub('_', str(log.context().get('requestId') or int(time.time() * 1000)))
+        path = os.path.join(PROFILE_DIR, name)
+        stats.dump_stats(path + '.prof')
+        fields['files'] = [path + '.prof']
+        if snapshot is not None:
+            snapshot.dump(path + '.tracemalloc')
+            fields['files'].append(path + '.tracemalloc')
+
+    log.always('profile', **fields)
+
+
+def label(filename, lineno, function=None):
+    """A short name for a place in the code: file:line, or file:line(function)."""
+    name = '{}:{}'.format(os.path.basename(filename), lineno)
+    return '{}({})'.format(name, function) if function else name
+
+
+def function_label(function):
+    filename, lineno, name = function
+    if filename == '~':
+        # Built-ins have no file, and their name already says what they are.
+        return name
+    return label(filename, lineno, name)
+
+
+def top_functions(stats):
+    """The PROFILE_TOP functions with the most cumulative time, each with the callers it spent most time under."""
+    top = []
+    for function, (_, calls, own, cumulative, callers) in sorted(stats.stats.items(), key=lambda s: -s[1][3]):
+        if function[0] == __file__ or function[2] == "<method 'disable' of '_lsprof.Profiler' objects>":
+            continue
+        heaviest = sorted(callers.items(), key=lambda c: -c[1][3])[:PROFILE_CALLERS]
+        top.append([function_label(function), calls, round(1000 * own, 3), round(1000 * cumulative, 3),
+                    [function_label(caller) for caller, _ in heaviest]])
+        if len(top) >= PROFILE_TOP:
+            break
+    return top
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit('usage: python profiling.py <userId>')
+    print(user_hash(sys.argv[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+
+"""
+Keeping the skill answering when storage is slow, throttled or down.
+
+Alexa gives a skill about 8 seconds to answer. A throttled DynamoDB call used to come back as an exception,
+and the user heard "There was a problem with the requested skill's response". ResilientStorage wraps the
+backend and puts every call through three layers:
+
+    circuit breaker  After BREAKER_FAILURES calls in a row fail even with retries, calls fail straight away for
+                     BREAKER_RESET seconds instead of each waiting out its own retries. Then one trial call
+                     is let through; if it works the breaker closes again.
+    rate limiter     A token bucket shared by every call this process makes. A spell of throttling halves its
+                     rate, once a second at most, and every second without one doubles it back, so a hot
+                     container backs off as a whole instead of every request hammering the table.
+    retries          Transient errors (throttling, 5xx, timeouts) are retried with full-jitter exponential
+                     backoff, but never past the time budget of the request being handled. A write that isn't
+                     idempotent is only retried when the error says it wasn't made.
+
+A call that still fails raises storage.UnavailableError. lambda_handler answers that with a spoken "try again
+shortly" and the user's session is kept as it was. Conflicts and other errors the backend answered with are
+passed on untouched.
+
+FaultInjectingStorage is a stand-in backend for trying all of this out locally: it wraps another backend and
+fails a given fraction of calls, or every call for a while, with a given error code. Set GENERALIST_FAULT_RATE
+to put it under the skill, or see benchmarks/storage_faults.py.
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import threading
+import time
+
+import log
+import storage
+
+__author__ = 'Mike Lane'
+__email__ = 'mikelane@gmail.com'
+
+RESILIENCE = os.environ.get('GENERALIST_RESILIENCE', '1') == '1'
+
+# Seconds a request may spend on storage, retries included. Alexa waits about 8 seconds for a response.
+REQUEST_BUDGET = float(os.environ.get('GENERALIST_REQUEST_BUDGET', 6.0))
+
+RETRY_MAX_ATTEMPTS = int(os.environ.get('GENERALIST_RETRY_MAX_ATTEMPTS', 4))
+RETRY_BACKOFF_BASE = 0.025
+RETRY_BACKOFF_CAP = 1.0
+
+# Storage calls per second this process may make, and how many it may make at once after a quiet spell.
+# 0 turns the rate limiter off. The DynamoDB default is well above what one Lambda container asks for, so it
+# only holds a container back once throttling has brought its rate down. SQLite is never throttled.
+RATE_LIMIT = float(os.environ.get('GENERALIST_RATE_LIMIT', 1000 if storage.STORAGE_BACKEND == 'dynamodb' else 0))
+RATE_BURST = float(os.environ.get('GENERALIST_RATE_BURST', 100))
+RATE_FLOOR = 1.0
+# Seconds between changes of the rate. Throttles within a window of the last halving are the same spell of
+# throttling and don't halve it again, and a window without one doubles it back.
+RATE_WINDOW = 1.0
+
+BREAKER_FAILURES = int(os.environ.get('GENERALIST_BREAKER_FAILURES', 5))
+BREAKER_RESET = float(os.environ.get('GENERALIST_BREAKER_RESET', 10.0))
+
+FAULT_RATE = float(os.environ.get('GENERALIST_FAULT_RATE', 0))
+FAULT_CODE = os.environ.get('GENERALIST_FAULT_CODE', 'ProvisionedThroughputExceededException')
+FAULT_LATENCY = float(os.environ.get('GENERALIST_FAULT_LATENCY', 0))
+
+THROTTLE_CODES = frozenset((
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded'
+))
+
+# StorageError codes worth trying again: throttling, server errors, a transaction that ran into another one and
+# the botocore connection errors.
+RETRYABLE_CODES = THROTTLE_CODES | frozenset((
+    'TransactionConflictException',
+    'InternalServerError',
+    'ServiceUnavailable',
+    'EndpointConnectionError',
+    'ConnectTimeoutError',
+    'ReadTimeoutError',
+    'ConnectionClosedError'
+))
+
+# Errors that mean the call was never carried out: it was turned away, or never reached the backend.
+NOT_MADE_CODES = THROTTLE_CODES | frozenset((
+    'TransactionConflictException',
+    'EndpointConnectionError',
+    'ConnectTimeoutError'
+))
+
+# Calls that can be made again without harm when an earlier try got through but its answer was lost: reads, writes
+# that set what they set whatever was there, and commit(), whose transaction carries a client request token. Any
+# other write is retried only after an error in NOT_MADE_CODES. Made twice, a delete_list() would answer that there
+# was no such list, and a versioned write would fail its own version check.
+IDEMPOTENT_CALLS = frozenset((
+    'get_session',
+    'list_exists',
+    'get_list_header',
+    'get_list_page',
+    'query_lists',
+    'query_list_summaries',
+    'get_name_index',
+    'date_session',
+    'commit'
+))
+
+# The deadline of the request each thread is handling.
+_request = threading.local()
+
+
+# --------------- Request budget ------------------
+
+def begin_request(context=None):
+    """Start the storage time budget of a new request. With a Lambda context the budget also stops short of
+    the function's own timeout."""
+    budget = REQUEST_BUDGET
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        budget = min(budget, context.get_remaining_time_in_millis() / 1000.0 - 0.5)
+    _request.deadline = time.monotonic() + budget
+
+
+def remaining():
+    """Seconds left in the current request's budget (infinite outside a request, e.g. in bulk_lists.py)."""
+    deadline = getattr(_request, 'deadline', None)
+    return float('inf') if deadline is None else deadline - time.monotonic()
+
+
+def backoff(attempt):
+    return random.uniform(0, min(RETRY_BACKOFF_CAP, RETRY_BACKOFF_BASE * 2 ** attempt))
+
+
+# --------------- Rate limiter ------------------
+
+class TokenBucket(object):
+    """A token bucket whose rate adapts: halved on throttling, at most once every RATE_WINDOW seconds, and
+    doubled by a call that goes through once a whole window has passed since the rate last changed, never above
+    the configured rate."""
+
+    def __init__(self, rate, burst):
+        self.max_rate = self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.changed = float('-inf')
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Wait for a token, but only as long as the request's budget allows."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            if wait > remaining():
+                raise storage.UnavailableError('RateLimited', {'rate': self.rate})
+            time.sleep(wait)
+
+    def throttled(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.changed >= RATE_WINDOW:
+                self.rate = max(RATE_FLOOR, self.rate / 2)
+                self.changed = now
+
+    def succeeded(self):
+        if self.rate < self.max_rate:
+            with self.lock:
+                now = time.monotonic()
+                if now - self.changed >= RATE_WINDOW:
+                    self.rate = min(self.max_rate, self.rate * 2)
+                    self.changed = now
+
+
+# --------------- Circuit breaker ------------------
+
+class CircuitBreaker(object):
+    """Closed: calls go through. Open: calls fail at once. Half-open: one trial call decides which."""
+
+    def __init__(self, failures, reset):
+        self.max_failures = failures
+        self.reset = reset
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.opens = 0
+        self.lock = threading.Lock()
+
+    def before(self):
+        """Raise UnavailableError if the call may not go ahead. Returns True if it goes ahead as the trial
+        call, which then has to end in succeeded() or failed()."""
+        with self.lock:
+            if self.opened is None:
+                return False
+            if self.trial or time.monotonic() - self.opened < self.reset:
+                raise storage.UnavailableError('CircuitOpen', {'failures': self.failures})
+            self.trial = True
+            return True
+
+    def succeeded(self):
+        if self.failures or self.opened is not None:
+            with self.lock:
+                if self.opened is not None:
+                    log.info('circuit_closed')
+                self.failures = 0
+                self.opened = None
+                self.trial = False
+
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or (self.opened is None and self.failures >= self.max_failures):
+                self.opened = time.monotonic()
+                self.trial = False
+                self.opens += 1
+                log.warning('circuit_open', failures=self.failures, resetSeconds=self.reset)
+
+
+# --------------- Storage wrappers ------------------
+
+class ResilientStorage(storage.Storage):
+    """Wraps another backend with the circuit breaker, rate limiter and retries described above."""
+
+    def __init__(self, inner, rate=RATE_LIMIT, burst=RATE_BURST, failures=BREAKER_FAILURES, reset=BREAKER_RESET):
+        self.inner = inner
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.breaker = CircuitBreaker(failures, reset)
+        self.retries = 0
+
+    def call(self, name, **kwargs):
+        attempt = 0
+        trial = False
+        while True:
+            # Checked on every attempt, so a call that is retrying stops as soon as the breaker opens, and before
+            # the rate limiter, so a call the breaker turns away doesn't wait for a token first.
+            if not trial:
+                trial = self.breaker.before()
+            if self.bucket is not None:
+                try:
+                    self.bucket.take()
+                except storage.UnavailableError:
+                    if trial:
+                        self.breaker.failed()
+                    raise
+            try:
+                result = getattr(self.inner, name)(**kwargs)
+            except storage.StorageError as e:
+                if e.code not in RETRYABLE_CODES:
+                    # The backend answered, it just said no.
+                    self.breaker.succeeded()
+                    raise
+                if e.code in THROTTLE_CODES and self.bucket is not None:
+                    self.bucket.throttled()
+                attempt += 1
+                delay = backoff(attempt)
+                retry = name in IDEMPOTENT_CALLS or e.code in NOT_MADE_CODES
+                if not retry or attempt >= RETRY_MAX_ATTEMPTS or delay >= remaining():
+                    self.breaker.failed()
+                    log.warning('storage_unavailable', call=name, code=e.code, attempts=attempt)
+                    raise storage.UnavailableError(e.code, e.response)
+                self.retries += 1
+                log.info('storage_retry', call=name, code=e.code, attempt=attempt, delayMs=round(1000 * delay, 1))
+                time.sleep(delay)
+            else:
+                self.breaker.succeeded()
+                if self.bucket is not None:
+                    self.bucket.succeeded()
+                return result
+
+    def get_session(self, user_id):
+        return self.call('get_session', user_id=user_id)
+
+    def put_session(self, user_id, attributes, expected_version=0):
+        return self.call('put_session', user_id=user_id, attributes=attributes, expected_version=expected_version)
+
+    def list_exists(self, user_id, list_name):
+        return self.call('list_exists', user_id=user_id, list_name=list_name)
+
+    def get_list_header(self, user_id, list_name):
+        return self.call('get_list_header', user_id=user_id, list_name=list_name)
+
+    def get_list_page(self, user_id, list_name, page):
+        return self.call('get_list_page', user_id=user_id, list_name=list_name, page=page)
+
+    def put_list(self, header, list_items, items_start=1, first_step=1):
+        return self.call('put_list', header=header, list_items=list_items, items_start=items_start,
+                         first_step=first_step)
+
+    def put_lists(self, lists):
+        # lists is usually a generator that can only be read once, and the backend retries its own batches.
+        return self.inner.put_lists(lists=lists)
+
+    def update_list_cursor(self, user_id, list_name, fields, expected_version=None):
+        return self.call('update_list_cursor', user_id=user_id, list_name=list_name, fields=fields,
+                         expected_version=expected_version)
+
+    def commit(self, writes):
+        return self.call('commit', writes=writes)
+
+    def delete_list(self, user_id, list_name):
+        return self.call('delete_list', user_id=user_id, list_name=list_name)
+
+    def query_lists(self, user_id):
+        return self.call('query_lists', user_id=user_id)
+
+    def query_list_summaries(self, user_id, limit, start_after=None):
+        return self.call('query_list_summaries', user_id=user_id, limit=limit, start_after=start_after)
+
+    def get_name_index(self, user_id):
+        return self.call('get_name_index', user_id=user_id)
+
+    def put_name_index(self, user_id, name_index, expected_version=0):
+        return self.call('put_name_index', user_id=user_id, name_index=name_index, expected_version=expected_version)
+
+    def scan_sessions(self, segment, total_segments):
+        # A generator; each page of the scan is a call of its own inside the backend.
+        return self.inner.scan_sessions(segment=segment, total_segments=total_segments)
+
+    def date_session(self, user_id, last_used):
+        return self.call('date_session', user_id=user_id, last_used=last_used)
+
+    def delete_sessions(self, user_ids):
+        # The backend retries its own batches, as for put_lists().
+        return self.inner.delete_sessions(user_ids=user_ids)
+
+    def delete_lists(self, headers):
+        return self.inner.delete_lists(headers=headers)
+
+    def consumed_capacity(self):
+        return self.inner.consumed_capacity()
+
+    def warm(self):
+        return self.inner.warm()
+
+
+class FaultInjectingStorage(storage.Storage):
+    """A stand-in for a misbehaving backend. Every call waits latency seconds, then fails with a StorageError
+    carrying code with probability rate, or always while an outage set with fail_for() lasts."""
+
+    def __init__(self, inner, rate=FAULT_RATE, code=FAULT_CODE, latency=FAULT_LATENCY, seed=None):
+        self.inner = inner
+        self.rate = rate
+        self.code = code
+        self.latency = latency
+        self.outage_until = 0.0
+        self.faults = 0
+        self.rng = random.Random(seed)
+
+    def fail_for(self, seconds):
+        """Fail every call for the next seconds."""
+        self.outage_until = time.monotonic() + seconds
+
+    def call(self, name, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        if time.monotonic() < self.outage_until or self.rng.random() < self.rate:
+            self.faults += 1
+            raise storage.StorageError(self.code, {'Error': {'Code': self.code, 'Message': 'Injected fault'}})
+        return getattr(self.inner, name)(**kwargs)
+
+    def get_session(self, user_id):
+        return self.call('get_session', user_id=user_id)
+
+    def put_session(self, user_id, attributes, expected_version=0):
+        return self.call('put_session', user_id=user_id, attributes=attributes, expected_version=expected_version)
+
+    def list_exists(self, user_id, list_name):
+        return self.call('list_exists', user_id=user_id, list_name=list_name)
+
+    def get_list_header(self, user_id, list_name):
+        return self.call('get_list_header', user_id=user_id, list_name=list_name)
+
+    def get_list_page(self, user_id, list_name, page):
+        return self.call('get_list_page', user_id=user_id, list_name=list_name, page=page)
+
+    def put_list(self, header, list_items, items_start=1, first_step=1):
+        return self.call('put_list', header=header, list_items=list_items, items_start=items_start,
+                         first_step=first_step)
+
+    def put_lists(self, lists):
+        return self.call('put_lists', lists=lists)
+
+    def update_list_cursor(self, user_id, list_name, fields, expected_version=None):
+        return self.call('update_list_cursor', user_id=user_id, list_name=list_name, fields=fields,
+                         expected_version=expected_version)
+
+    def commit(self, writes):
+        return self.call('commit', writes=writes)
+
+    def delete_list(self, user_id, list_name):
+        return self.call('delete_list', user_id=user_id, list_name=list_name)
+
+    def query_lists(self, user_id):
+        return self.call('query_lists', user_id=user_id)
+
+    def query_list_summaries(self, user_id, limit, start_after=None):
+        return self.call('query_list_summaries', user_id=user_id, limit=limit, start_after=start_after)
+
+    def get_name_index(self, user_id):
+        return self.call('get_name_index', user_id=user_id)
+
+    def put_name_index(self, user_id, name_index, expected_version=0):
+        return self.call('put_name_index', user_id=user_id, name_index=name_index, expected_version=expected_version)
+
+    def scan_sessions(self, segment, total_segments):
+        return self.call('scan_sessions', segment=segment, total_segments=total_segments)
+
+    def date_session(self, user_id, last_used):
+        return self.call('date_session', user_id=user_id, last_used=last_used)
+
+    def delete_sessions(self, user_ids):
+        return self.call('delete_sessions', user_ids=user_ids)
+
+    def delete_lists(self, headers):
+        return self.call('delete_lists', headers=headers)
+
+    def consumed_capacity(self):
+        return self.inner.consumed_capacity()
+
+    def warm(self):
+        return self.inner.warm()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""
+Intent routing for GeneraList.
+
+A Router maps intent names to handlers and runs a chain of middleware around every dispatch. Middleware is
+any object with some of these methods (all optional):
+
+    before(call)            Called before the handler. Returning a response skips the handler.
+    after(call, response)   Called after the handler. Returning a response replaces the handler's.
+    error(call, exc)        Called when the handler (or a later middleware) raised. Returning a response
+                            recovers from the error; returning None lets it propagate.
+
+before runs in the order the middleware was added, after and error in the reverse order. call is a dict with
+the intent name, the intent, the session and the perf_counter time the dispatch started; middleware may
+keep its own state in it too.
+"""
+
+from __future__ import print_function
+
+import threading
+import time
+
+import log
+import storage
+
+__author__ = 'Mike Lane'
+__email__ = 'mikelane@gmail.com'
+
+
+class Router(object):
+    """A table of intent handlers plus the middleware to run around them."""
+
+    def __init__(self):
+        self.handlers = {}
+        self.middleware = []
+
+    def add(self, intent_name, handler, session_only=False):
+        """Route intent_name to handler(intent, session), or to handler(session) if session_only."""
+        if session_only:
+            self.handlers[intent_name] = lambda intent, session: handler(session)
+        else:
+            self.handlers[intent_name] = handler
+
+    def use(self, middleware):
+        """Add middleware to the end of the chain."""
+        self.middleware.append(middleware)
+
+    def dispatch(self, intent, session):
+        """Run the handler for intent through the middleware chain and return its response."""
+        try:
+            handler = self.handlers[intent['name']]
+        except KeyError:
+            raise ValueError('Invalid intent', intent['name'])
+
+        call = {'intent_name': intent['name'], 'intent': intent, 'session': session, 'started': time.perf_counter()}
+        entered = []
+        try:
+            response = None
+            for middleware in self.middleware:
+                entered.append(middleware)
+                if hasattr(middleware, 'before'):
+                    response = middleware.before(call)
+                    if response is not None:
+                        break
+            if response is None:
+                response = handler(intent, session)
+            for middleware in reversed(entered):
+                if hasattr(middleware, 'after'):
+                    response = middleware.after(call, response) or response
+            return response
+        except Exception as exc:
+            for middleware in reversed(entered):
+                if hasattr(middleware, 'error'):
+                    recovered = middleware.error(call, exc)
+                    if recovered is not None:
+                        return recovered
+            raise
+
+
+class TimingMiddleware(object):
+    """Measure the wall time and storage calls of every intent. Each dispatch is logged at DEBUG, and running
+    totals per intent are kept in totals for anything that wants to report on them."""
+
+    def __init__(self):
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def storage_counters():
+        backend = storage.backend()
+        if isinstance(backend, storage.InstrumentedStorage):
+            return backend.calls, backend.seconds
+        return 0, 0.0
+
+    def before(self, call):
+        call['storage_before'] = self.storage_counters()
+
+    def after(self, call, response):
+        self.record(call, failed=False)
+
+    def error(self, call, exc):
+        self.record(call, failed=True)
+
+    def record(self, call, failed):
+        elapsed = time.perf_counter() - call['started']
+        calls, seconds = self.storage_counters()
+        calls -= call['storage_before'][0]
+        seconds -= call['storage_before'][1]
+
+        with self.lock:
+            totals = self.totals.setdefault(call['intent_name'], {'count': 0, 'errors': 0, 'seconds': 0.0,
+                                                                  'maxSeconds': 0.0, 'storageCalls': 0,
+                                                                  'storageSeconds': 0.0})
+            totals['count'] += 1
+            totals['errors'] += failed
+            totals['seconds'] += elapsed
+            totals['maxSeconds'] = max(totals['maxSeconds'], elapsed)
+            totals['storageCalls'] += calls
+            totals['storageSeconds'] += seconds
+
+        log.debug('intent_timing', intent=call['intent_name'], failed=failed, ms=round(1000 * elapsed, 3),
+                  storageCalls=calls, storageMs=round(1000 * seconds, 3))
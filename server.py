@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+
+"""
+Self-hosted HTTP endpoint for GeneraList.
+
+Serves the skill from our own machines, behind our own load balancer, instead of from Lambda:
+
+    GENERALIST_STORAGE=sqlite python server.py --port 8080
+
+POST the JSON body Alexa sends to any path and lambda_handler's response comes back as JSON. GET /health answers
+200 while the server takes requests and 503 once it is shutting down, for the load balancer's health checks. The
+server speaks plain HTTP: TLS, and checking the signature Alexa puts on each request, are left to the load
+balancer or proxy in front of it.
+
+    GENERALIST_SERVER_THREADS      connections served at once, a thread each. Connections are kept alive (HTTP/1.1)
+                                   for up to GENERALIST_SERVER_KEEPALIVE idle seconds. Further connections wait in
+                                   the listen backlog until a thread is free
+    GENERALIST_SERVER_CONCURRENCY  requests handled at once. A request that finds them all taken waits up to
+                                   GENERALIST_SERVER_QUEUE_TIMEOUT seconds, then gets a 503 with Retry-After
+    GENERALIST_SERVER_PROCESSES    processes sharing the listening socket, each with the threads above. One Python
+                                   process runs on one core at a time, so use about one per core
+
+Requests spend most of their time waiting on storage, which the threads of a process overlap. Everything a request
+keeps while it is handled (main.pending_writes, the log context, the metrics and storage counters) is per thread.
+
+SIGTERM or SIGINT shut the server down gracefully: it stops accepting connections, fails its health check, closes
+idle connections and lets the requests in progress finish, answering them with "Connection: close". It exits when
+they are done, or after GENERALIST_SERVER_DRAIN_TIMEOUT seconds.
+"""
+
+from __future__ import print_function
+
+import argparse
+import decimal
+import http.server
+import json
+import os
+import signal
+import socket
+import threading
+import time
+
+import log
+import main as skill
+
+__author__ = 'Mike Lane'
+__email__ = 'mikelane@gmail.com'
+
+SERVER_HOST = os.environ.get('GENERALIST_SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.environ.get('GENERALIST_SERVER_PORT', 8080))
+SERVER_THREADS = int(os.environ.get('GENERALIST_SERVER_THREADS', 64))
+SERVER_CONCURRENCY = int(os.environ.get('GENERALIST_SERVER_CONCURRENCY', 16))
+SERVER_QUEUE_TIMEOUT = float(os.environ.get('GENERALIST_SERVER_QUEUE_TIMEOUT', 1.0))
+SERVER_PROCESSES = int(os.environ.get('GENERALIST_SERVER_PROCESSES', 1))
+
+# Longer than the load balancer's own idle timeout (60 seconds on an ALB), so that it is always the one to close
+# an idle connection and never sends a request down one this end has just closed.
+SERVER_KEEPALIVE = float(os.environ.get('GENERALIST_SERVER_KEEPALIVE', 75))
+SERVER_DRAIN_TIMEOUT = float(os.environ.get('GENERALIST_SERVER_DRAIN_TIMEOUT', 20))
+
+# Alexa requests are a few KiB, most of it the session attributes.
+SERVER_MAX_BODY = int(os.environ.get('GENERALIST_SERVER_MAX_BODY', 1024 * 1024))
+
+# Limits on the request headers, as http.server has them.
+MAX_HEADER_LINE = 65536
+MAX_HEADERS = 100
+
+# Connections the kernel holds while every thread is busy.
+LISTEN_BACKLOG = 1024
+
+# How often threads waiting for a connection check whether the server is shutting down.
+ACCEPT_POLL_SECONDS = 0.5
+
+HEALTH_PATH = '/health'
+
+# The answer to a request lambda_handler has no response for (a SessionEndedRequest).
+EMPTY_RESPONSE = {'version': '1.0', 'response': {}}
+
+# States of a connection, see SkillServer.connections.
+IDLE = 'idle'
+BUSY = 'busy'
+CLOSED = 'closed'
+
+
+def json_default(value):
+    """DynamoDB hands numbers back as Decimal."""
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+# --------------- Requests ------------------
+
+class SkillRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handles the requests of one connection, one after another, until either end closes it."""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'GeneraList'
+    timeout = SERVER_KEEPALIVE
+    disable_nagle_algorithm = True
+    # Buffered, so that the headers and body of a response go out in one send.
+    wbufsize = -1
+
+    def parse_request(self):
+        """BaseHTTPRequestHandler.parse_request(), cut down to what a load balancer sends. Headers are read into a
+        plain dict with lower case names rather than an email.message.Message, which took half of the server's
+        own time per request."""
+        self.command = None
+        self.request_version = 'HTTP/1.1'
+        self.close_connection = True
+        # The request line has arrived, so this connection is no longer idle.
+        if not self.server.begin_request(self.connection):
+            # Closed for shutdown just as the request line came in; the client sends it again elsewhere.
+            return False
+
+        words = self.raw_requestline.decode('iso-8859-1').split()
+        if len(words) != 3 or words[2] not in ('HTTP/1.0', 'HTTP/1.1'):
+            self.send_error(400, 'Bad request line')
+            return False
+        self.command, self.path, self.request_version = words
+
+        self.headers = {}
+        while True:
+            line = self.rfile.readline(MAX_HEADER_LINE + 1)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(line) > MAX_HEADER_LINE or len(self.headers) >= MAX_HEADERS:
+                self.send_error(431)
+                return False
+            name, colon, value = line.decode('iso-8859-1').partition(':')
+            if not colon:
+                self.send_error(400, 'Bad header line')
+                return False
+            self.headers[name.strip().lower()] = value.strip()
+
+        connection = self.headers.get('connection', '').lower()
+        self.close_connection = connection == 'close' or (self.request_version == 'HTTP/1.0' and
+                                                          connection != 'keep-alive')
+        if self.headers.get('expect', '').lower() == '100-continue':
+            self.send_response_only(100)
+            self.end_headers()
+            self.wfile.flush()
+        return True
+
+    def handle_one_request(self):
+        try:
+            http.server.BaseHTTPRequestHandler.handle_one_request(self)
+        finally:
+            if not self.server.end_request(self.connection):
+                self.close_connection = True
+
+    def do_GET(self):
+        if self.path != HEALTH_PATH:
+            self.send_json(404, {'error': 'not found'})
+        elif self.server.draining:
+            self.send_json(503, {'status': 'draining'})
+        else:
+            self.send_json(200, {'status': 'ok'})
+
+    def do_POST(self):
+        log.begin_request()
+        try:
+            length = int(self.headers['content-length'])
+        except (KeyError, ValueError):
+            # Chunked bodies aren't taken either.
+            self.close_connection = True
+            return self.send_json(411, {'error': 'Content-Length required'})
+        if length > SERVER_MAX_BODY:
+            # The body is left unread, so the connection can't be used again.
+            self.close_connection = True
+            return self.send_json(413, {'error': 'request too large'})
+
+        try:
+            event = json.loads(self.rfile.read(length))
+        except ValueError:
+            return self.send_json(400, {'error': 'request is not JSON'})
+        if not isinstance(event, dict):
+            return self.send_json(400, {'error': 'request is not a JSON object'})
+
+        if not self.server.slots.acquire(timeout=SERVER_QUEUE_TIMEOUT):
+            log.warning('server_busy', concurrency=self.server.concurrency)
+            return self.send_json(503, {'error': 'busy'}, retry_after=1)
+        try:
+            response = skill.lambda_handler(event, None)
+        except Exception as e:
+            log.error('request_failed', error=repr(e))
+            return self.send_json(500, {'error': 'internal error'})
+        finally:
+            self.server.slots.release()
+        self.send_json(200, EMPTY_RESPONSE if response is None else response)
+
+    def send_json(self, status, body, retry_after=None):
+        payload = json.dumps(body, separators=(',', ':'), default=json_default).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(payload)))
+        if retry_after is not None:
+            self.send_header('Retry-After', str(retry_after))
+        if self.close_connection or self.server.draining:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_request(self, code='-', size='-'):
+        # One line per request is already written by metrics.py.
+        pass
+
+    def log_error(self, message, *args):
+        # Mostly idle connections timing out, and malformed requests that were answered with an error.
+        log.debug('http_error', client=self.client_address[0], message=message % args)
+
+
+# --------------- Server ------------------
+
+class SkillServer(object):
+    """A fixed pool of threads, each taking connections from the listening socket and serving one at a time."""
+
+    def __init__(self, listener, threads=SERVER_THREADS, concurrency=SERVER_CONCURRENCY):
+        self.listener = listener
+        self.threads = threads
+        self.concurrency = concurrency
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.draining = False
+        self.stopping = threading.Event()
+        # Open connections, each IDLE between requests, BUSY from request line to response, and CLOSED once
+        # shutdown has closed it while it was idle.
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def serve(self, drain_timeout=SERVER_DRAIN_TIMEOUT):
+        """Serve until SIGTERM or SIGINT, then shut down gracefully."""
+        self.listener.settimeout(ACCEPT_POLL_SECONDS)
+        workers = [threading.Thread(target=self.work, name='generalist-http-{}'.format(n), daemon=True)
+                   for n in range(self.threads)]
+        for worker in workers:
+            worker.start()
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: self.stopping.set())
+        log.info('server_started', address=self.listener.getsockname(), pid=os.getpid(), threads=self.threads,
+                 concurrency=self.concurrency)
+        while not self.stopping.wait(1.0):
+            pass
+        drained = self.shut_down(drain_timeout)
+        log.info('server_stopped', pid=os.getpid(), drained=drained)
+        return drained
+
+    def work(self):
+        while not self.draining:
+            try:
+                connection, address = self.listener.accept()
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if self.draining:
+                    break
+                # Out of file descriptors, most likely. The connection stays in the backlog for another thread.
+                log.error('accept_failed', error=repr(e))
+                time.sleep(ACCEPT_POLL_SECONDS)
+                continue
+            self.serve_connection(connection, address)
+
+    def serve_connection(self, connection, address):
+        with self.lock:
+            self.connections[connection] = IDLE
+        try:
+            SkillRequestHandler(connection, address, self)
+        except OSError as e:
+            # Reset by the client, or timed out in the middle of a request.
+            log.debug('connection_failed', error=repr(e))
+        finally:
+            with self.lock:
+                del self.connections[connection]
+            try:
+                connection.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+            connection.close()
+
+    def begin_request(self, connection):
+        """Mark connection busy. False if shutdown has already closed it."""
+        with self.lock:
+            if self.connections.get(connection) == CLOSED:
+                return False
+            self.connections[connection] = BUSY
+            return True
+
+    def end_request(self, connection):
+        """Mark connection idle again. False if it is to be closed instead, as the server is shutting down."""
+        with self.lock:
+            if self.connections.get(connection) == BUSY:
+                self.connections[connection] = IDLE
+            return not self.draining
+
+    def shut_down(self, timeout):
+        """Stop taking connections, close the idle ones and wait up to timeout seconds for the requests in
+        progress. Returns True if they all finished."""
+        with self.lock:
+            self.draining = True
+            for connection, state in self.connections.items():
+                if state == IDLE:
+                    self.connections[connection] = CLOSED
+                    try:
+                        connection.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+        deadline = time.monotonic() + timeout
+        while self.connections and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.listener.close()
+        return not self.connections
+
+
+def listen(host, port):
+    listener = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(LISTEN_BACKLOG)
+    return listener
+
+
+def serve_processes(listener, processes, threads, concurrency):
+    """Fork processes children that all serve listener, and pass SIGTERM and SIGINT on to them. If one exits
+    by itself the others are stopped too, so that whatever supervises the server restarts it whole."""
+    children = set()
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                skill.warm_up()
+                status = 0 if SkillServer(listener, threads, concurrency).serve() else 1
+            finally:
+                os._exit(status)
+        children.add(pid)
+
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for child in list(children):
+            try:
+                os.kill(child, signal.SIGTERM)
+            except OSError:
+                pass
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, stop)
+    status = 0
+    while children:
+        pid, code = os.wait()
+        children.discard(pid)
+        if code:
+            status = 1
+        if not stopping:
+            log.error('server_process_exited', pid=pid, status=code)
+            stop(None, None)
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS)
+    parser.add_argument('--concurrency', type=int, default=SERVER_CONCURRENCY)
+    parser.add_argument('--processes', type=int, default=SERVER_PROCESSES)
+    args = parser.parse_args()
+
+    listener = listen(args.host, args.port)
+    if args.processes > 1:
+        raise SystemExit(serve_processes(listener, args.processes, args.threads, args.concurrency))
+    skill.warm_up()
+    raise SystemExit(0 if SkillServer(listener, args.threads, args.concurrency).serve() else 1)
+
+
+if __name__ == '__main__':
+    main()
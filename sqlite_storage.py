@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+
+"""
+SQLite storage backend for GeneraList.
+
+Lets the skill run on our own hardware, or completely offline, with a local database file instead of
+DynamoDB. The database runs in WAL mode so readers never wait on the writer, every statement is a constant
+string with bound parameters so sqlite3's statement cache prepares it once per connection, and each
+multi-row write (a list header plus its pages, or everything handed to commit()) is a single transaction.
+Each page's steps are a JSON array in step order; pages written as a {step: text} object by older versions
+are still read.
+
+Versions are checked inside the same transaction as the write, so a stale writer gets a storage.ConflictError
+and leaves no trace.
+
+Each thread gets its own connection. GENERALIST_SQLITE_PATH picks the database file; ':memory:' gives a
+private in-memory database shared by the threads of this process, which is handy for tests and benchmarks. Its
+writes are taken one at a time.
+"""
+
+from __future__ import print_function
+
+import contextlib
+import functools
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import storage
+
+__author__ = 'Mike Lane'
+__email__ = 'mikelane@gmail.com'
+
+SQLITE_PATH = os.environ.get('GENERALIST_SQLITE_PATH', 'generalist.db')
+SQLITE_TIMEOUT = float(os.environ.get('GENERALIST_SQLITE_TIMEOUT', 5.0))
+
+# Lists written per transaction by put_lists().
+SQLITE_BULK_LISTS = 500
+
+# Sessions read per query by scan_sessions().
+SQLITE_SCAN_ROWS = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stored_session (
+    user_id TEXT PRIMARY KEY,
+    attributes TEXT NOT NULL,
+    last_used INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS lists (
+    user_id TEXT NOT NULL,
+    list_name TEXT NOT NULL,
+    number_of_steps INTEGER NOT NULL,
+    current_step INTEGER NOT NULL,
+    page_size INTEGER NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    last_used INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, list_name)
+);
+CREATE TABLE IF NOT EXISTS list_pages (
+    user_id TEXT NOT NULL,
+    list_name TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    list_items TEXT NOT NULL,
+    PRIMARY KEY (user_id, list_name, page)
+);
+CREATE TABLE IF NOT EXISTS list_names (
+    user_id TEXT PRIMARY KEY,
+    name_index TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Columns added to existing tables since the first release, and how to add them to an older database.
+ADDED_COLUMNS = (
+    ('lists', 'version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('lists', 'last_used', 'INTEGER NOT NULL DEFAULT 0'),
+    ('stored_session', 'last_used', 'INTEGER NOT NULL DEFAULT 0'),
+    ('list_names', 'version', 'INTEGER NOT NULL DEFAULT 0')
+)
+
+# Header fields that update_list_cursor() may set, and their columns.
+CURSOR_COLUMNS = {
+    'currentStep': 'current_step',
+    'numberOfSteps': 'number_of_steps'
+}
+
+_memory_databases = itertools.count()
+
+
+# The method that makes each kind of write inside a commit()'s transaction.
+COMMIT_WRITERS = {
+    'put_session': 'write_session',
+    'put_list': 'write_list',
+    'update_list_cursor': 'write_cursor'
+}
+
+
+def translate_errors(method):
+    """Turn sqlite3 errors into storage.StorageError."""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except sqlite3.Error as e:
+            raise storage.StorageError(type(e).__name__, str(e))
+    return wrapper
+
+
+class SQLiteStorage(storage.Storage):
+    """Sessions and lists in a local SQLite database."""
+
+    def __init__(self, path=None):
+        path = path or SQLITE_PATH
+        if path == ':memory:':
+            # A named shared-cache database, so every thread's connection sees the same data. It lives as long
+            # as at least one connection to it is open, which self._keepalive takes care of.
+            self.uri = 'file:generalist-{}?mode=memory&cache=shared'.format(next(_memory_databases))
+            self._write_lock = threading.Lock()
+        else:
+            self.uri = 'file:{}'.format(path)
+            self._write_lock = contextlib.nullcontext()
+        self._local = threading.local()
+        self._keepalive = self.connection()
+        self._keepalive.executescript(SCHEMA)
+        for table_name, column, definition in ADDED_COLUMNS:
+            columns = [row[1] for row in self._keepalive.execute('PRAGMA table_info({})'.format(table_name))]
+            if column not in columns:
+                with self._keepalive:
+                    self._keepalive.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(table_name, column, definition))
+
+    def connection(self):
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.uri, uri=True, timeout=SQLITE_TIMEOUT, cached_statements=64,
+                                   check_same_thread=False)
+            if 'mode=memory' not in self.uri:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+            else:
+                # Shared-cache connections lock tables, not the file, and one that finds a table locked by another
+                # thread fails at once rather than waiting out the timeout. Reads take no table locks, and
+                # transaction() takes writes one at a time.
+                conn.execute('PRAGMA read_uncommitted=true')
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """This thread's connection, inside a transaction that commits when the block ends."""
+        conn = self.connection()
+        with self._write_lock, conn:
+            yield conn
+
+    def warm(self):
+        try:
+            self.connection().execute('SELECT 1 FROM stored_session LIMIT 1').fetchall()
+        except sqlite3.Error:
+            return False
+        return True
+
+    @translate_errors
+    def get_session(self, user_id):
+        row = self.connection().execute('SELECT attributes FROM stored_session WHERE user_id = ?',
+                                        (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @translate_errors
+    def put_session(self, user_id, attributes, expected_version=0):
+        with self.transaction() as conn:
+            self.write_session(conn, user_id, attributes, expected_version)
+
+    @staticmethod
+    def write_session(conn, user_id, attributes, expected_version=0):
+        """put_session() inside the caller's transaction on conn."""
+        cursor = conn.execute(
+            'INSERT INTO stored_session (user_id, attributes, last_used) VALUES (?, ?, ?) '
+            'ON CONFLICT (user_id) DO UPDATE SET attributes = excluded.attributes, last_used = excluded.last_used '
+            "WHERE COALESCE(json_extract(stored_session.attributes, '$.sessionVersion'), 0) = ?",
+            (user_id, json.dumps(attributes, default=int), int(time.time()), int(expected_version)))
+        if cursor.rowcount == 0:
+            raise storage.ConflictError('ConflictError', 'stored session of {} is no longer at version {}'.format(
+                user_id, expected_version))
+
+    @translate_errors
+    def list_exists(self, user_id, list_name):
+        row = self.connection().execute('SELECT 1 FROM lists WHERE user_id = ? AND list_name = ?',
+                                        (user_id, list_name)).fetchone()
+        return row is not None
+
+    @translate_errors
+    def get_list_header(self, user_id, list_name):
+        row = self.connection().execute(
+            'SELECT number_of_steps, current_step, page_size, version, last_used FROM lists '
+            'WHERE user_id = ? AND list_name = ?', (user_id, list_name)).fetchone()
+        if row is None:
+            return None
+        return {'userId': user_id, 'listName': list_name, 'numberOfSteps': row[0], 'currentStep': row[1],
+                'pageSize': row[2], 'version': row[3], 'lastUsed': row[4]}
+
+    @translate_errors
+    def get_list_page(self, user_id, list_name, page):
+        row = self.connection().execute(
+            'SELECT list_items FROM list_pages WHERE user_id = ? AND list_name = ? AND page = ?',
+            (user_id, list_name, page)).fetchone()
+        if row is None:
+            return []
+        list_items = json.loads(row[0])
+        if isinstance(list_items, dict):
+            return storage.steps_from_map(list_items)[1]
+        return list_items
+
+    @translate_errors
+    def put_list(self, header, list_items, items_start=1, first_step=1):
+        with self.transaction() as conn:
+            return self.write_list(conn, header, list_items, items_start, first_step)
+
+    @staticmethod
+    def write_list(conn, header, list_items, items_start=1, first_step=1):
+        """put_list() inside the caller's transaction on conn."""
+        user_id = header['userId']
+        list_name = header['listName']
+        expected_version = int(header.get('version', 0))
+        values = (int(header['numberOfSteps']), int(header['currentStep']), int(header['pageSize']),
+                  expected_version + 1, int(time.time()), user_id, list_name)
+        pages = storage.split_pages(list_items, items_start, header['pageSize'], first_step)
+        if expected_version:
+            cursor = conn.execute(
+                'UPDATE lists SET number_of_steps = ?, current_step = ?, page_size = ?, version = ?, last_used = ? '
+                'WHERE user_id = ? AND list_name = ? AND version = ?', values + (expected_version,))
+        else:
+            cursor = conn.execute(
+                'INSERT INTO lists '
+                '(number_of_steps, current_step, page_size, version, last_used, user_id, list_name) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (user_id, list_name) DO UPDATE SET '
+                'number_of_steps = excluded.number_of_steps, current_step = excluded.current_step, '
+                'page_size = excluded.page_size, version = excluded.version, last_used = excluded.last_used '
+                'WHERE lists.version = 0', values)
+        if cursor.rowcount == 0:
+            raise storage.ConflictError('ConflictError', 'list {} is no longer at version {}'.format(
+                list_name, expected_version))
+        conn.executemany(
+            'INSERT OR REPLACE INTO list_pages (user_id, list_name, page, list_items) VALUES (?, ?, ?, ?)',
+            [(user_id, list_name, page, json.dumps(page_items)) for page, page_items in pages.items()])
+        return expected_version + 1
+
+    @translate_errors
+    def put_lists(self, lists):
+        count = 0
+        lists = iter(lists)
+        while True:
+            chunk = list(itertools.islice(lists, SQLITE_BULK_LISTS))
+            if not chunk:
+                return count
+            with self.transaction() as conn:
+                for header, list_items in chunk:
+                    key = (header['userId'], header['listName'])
+                    conn.execute('DELETE FROM list_pages WHERE user_id = ? AND list_name = ?', key)
+                    conn.executemany(
+                        'INSERT INTO list_pages (user_id, list_name, page, list_items) VALUES (?, ?, ?, ?)',
+                        [key + (page, json.dumps(page_items))
+                         for page, page_items in storage.split_pages(list_items, 1, header['pageSize']).items()])
+                    conn.execute(
+                        'INSERT OR REPLACE INTO lists '
+                        '(user_id, list_name, number_of_steps, current_step, page_size, version, last_used) '
+                        'VALUES (?, ?, ?, ?, ?, 1, ?)',
+                        key + (int(header['numberOfSteps']), int(header['currentStep']), int(header['pageSize']),
+                               int(time.time())))
+            count += len(chunk)
+
+    @translate_errors
+    def update_list_cursor(self, user_id, list_name, fields, expected_version=None):
+        with self.transaction() as conn:
+            if not self.write_cursor(conn, user_id, list_name, fields, expected_version):
+                return None
+            return self.get_list_header(user_id, list_name)
+
+    @staticmethod
+    def write_cursor(conn, user_id, list_name, fields, expected_version=None):
+        """update_list_cursor() inside the caller's transaction on conn. Returns False if there was no list to
+        update."""
+        columns = ', '.join('{} = ?'.format(CURSOR_COLUMNS[k]) for k in sorted(fields))
+        params = [int(fields[k]) for k in sorted(fields)] + [int(time.time()), user_id, list_name]
+        if expected_version is not None:
+            condition = ' AND version = ?'
+            params.append(int(expected_version))
+        elif 'currentStep' in fields:
+            condition = ' AND number_of_steps >= ?'
+            params.append(int(fields['currentStep']))
+        else:
+            condition = ''
+        cursor = conn.execute('UPDATE lists SET {}, last_used = ? '
+                              'WHERE user_id = ? AND list_name = ?{}'.format(columns, condition), params)
+        if cursor.rowcount == 0:
+            if expected_version is None:
+                return False
+            raise storage.ConflictError('ConflictError', 'list {} is no longer at version {}'.format(
+                list_name, expected_version))
+        return True
+
+    @translate_errors
+    def commit(self, writes):
+        with self.transaction() as conn:
+            for method, kwargs in writes:
+                getattr(self, COMMIT_WRITERS[method])(conn, **kwargs)
+        return True
+
+    @translate_errors
+    def delete_list(self, user_id, list_name):
+        with self.transaction() as conn:
+            cursor = conn.execute('DELETE FROM lists WHERE user_id = ? AND list_name = ?', (user_id, list_name))
+            conn.execute('DELETE FROM list_pages WHERE user_id = ? AND list_name = ?', (user_id, list_name))
+        return cursor.rowcount > 0
+
+    @translate_errors
+    def query_lists(self, user_id):
+        rows = self.connection().execute(
+            'SELECT list_name, number_of_steps, current_step, page_size, version, last_used FROM lists '
+            'WHERE user_id = ? ORDER BY list_name', (user_id,))
+        return [{'userId': user_id, 'listName': row[0], 'numberOfSteps': row[1], 'currentStep': row[2],
+                 'pageSize': row[3], 'version': row[4], 'lastUsed': row[5]} for row in rows]
+
+    @translate_errors
+    def query_list_summaries(self, user_id, limit, start_after=None):
+        # One row more than asked for tells whether there is anything after this batch.
+        rows = self.connection().execute(
+            'SELECT list_name, number_of_steps, last_used FROM lists WHERE user_id = ? AND list_name > ? '
+            'ORDER BY list_name LIMIT ?', (user_id, start_after or '', int(limit) + 1)).fetchall()
+        summaries = [{'listName': row[0], 'numberOfSteps': row[1], 'lastUsed': row[2]} for row in rows[:limit]]
+        return summaries, summaries[-1]['listName'] if len(rows) > limit else None
+
+    @translate_errors
+    def get_name_index(self, user_id):
+        row = self.connection().execute('SELECT name_index, version FROM list_names WHERE user_id = ?',
+                                        (user_id,)).fetchone()
+        return {'nameIndex': row[0], 'version': row[1]} if row is not None else None
+
+    @translate_errors
+    def put_name_index(self, user_id, name_index, expected_version=0):
+        with self.transaction() as conn:
+            if expected_version:
+                cursor = conn.execute(
+                    'UPDATE list_names SET name_index = ?, version = ? WHERE user_id = ? AND version = ?',
+                    (name_index, expected_version + 1, user_id, expected_version))
+            else:
+                cursor = conn.execute(
+                    'INSERT INTO list_names (user_id, name_index, version) VALUES (?, ?, 1) ON CONFLICT (user_id) '
+                    'DO UPDATE SET name_index = excluded.name_index, version = 1 WHERE list_names.version = 0',
+                    (user_id, name_index))
+            if cursor.rowcount == 0:
+                raise storage.ConflictError('ConflictError', 'name index of {} is no longer at version {}'.format(
+                    user_id, expected_version))
+        return expected_version + 1
+
+    def scan_sessions(self, segment, total_segments):
+        # A page of rows at a time, by rowid, so sessions can be deleted between pages.
+        after = 0
+        while True:
+            rows = self.scan_page(after, segment, total_segments)
+            for row in rows:
+                yield storage.session_summary(*row[1:])
+            if len(rows) < SQLITE_SCAN_ROWS:
+                return
+            after = rows[-1][0]
+
+    @translate_errors
+    def scan_page(self, after, segment, total_segments):
+        return self.connection().execute(
+            "SELECT rowid, user_id, last_used, json_extract(attributes, '$.currentTask'), "
+            "json_extract(attributes, '$.currentList'), json_extract(attributes, '$.unsavedSteps') "
+            "FROM stored_session "
+            'WHERE rowid > ? AND rowid % ? = ? ORDER BY rowid LIMIT ?',
+            (after, int(total_segments), int(segment), SQLITE_SCAN_ROWS)).fetchall()
+
+    @translate_errors
+    def date_session(self, user_id, last_used):
+        with self.transaction() as conn:
+            conn.execute('UPDATE stored_session SET last_used = ? WHERE user_id = ? AND last_used = 0',
+                         (int(last_used), user_id))
+
+    @translate_errors
+    def delete_sessions(self, user_ids):
+        with self.transaction() as conn:
+            conn.executemany('DELETE FROM stored_session WHERE user_id = ?', [(user_id,) for user_id in user_ids])
+
+    @translate_errors
+    def delete_lists(self, headers):
+        keys = [(header['userId'], header['listName']) for header in headers]
+        with self.transaction() as conn:
+            conn.executemany('DELETE FROM lists WHERE user_id = ? AND list_name = ?', keys)
+            conn.executemany('DELETE FROM list_pages WHERE user_id = ? AND list_name = ?', keys)
@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+
+"""
+Storage for GeneraList.
+
+The skill keeps two kinds of records: the stored session (one per user, so a user can pick up where they left
+off) and the lists themselves. The intent handlers in main.py only talk to the Storage interface defined here,
+and the backend behind it is picked with the GENERALIST_STORAGE environment variable:
+
+    dynamodb  The StoredSession and Lists tables in DynamoDB (the default, see dynamodb_storage.py)
+    sqlite    A local SQLite database for self-hosting and offline runs (see sqlite_storage.py)
+
+The backend is built once, lazily, and shared for the life of the Lambda container or server process.
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import threading
+import time
+
+__author__ = 'Mike Lane'
+__email__ = 'mikelane@gmail.com'
+
+SESSION_TABLENAME = 'StoredSession'
+LISTS_TABLENAME = 'Lists'
+
+STORAGE_BACKEND = os.environ.get('GENERALIST_STORAGE', 'dynamodb')
+
+# Lists are stored as a header plus fixed-size pages of steps, see "Lists layout" below.
+LIST_PAGE_SIZE = int(os.environ.get('GENERALIST_LIST_PAGE_SIZE', 50))
+
+# The backend shared by every request in this container.
+_backend = None
+
+
+class StorageError(Exception):
+    """Raised by every backend when a storage call fails. response holds whatever detail the backend has
+    about the failure (the botocore error response for DynamoDB, the message for SQLite) and code is a short
+    error name such as 'ProvisionedThroughputExceededException'."""
+
+    def __init__(self, code, response):
+        super(StorageError, self).__init__(code, response)
+        self.code = code
+        self.response = response
+
+
+class ConflictError(StorageError):
+    """Raised by a conditional write when the record was changed by someone else (another Echo device in the
+    same household, say) since the version the caller holds."""
+
+
+class UnavailableError(StorageError):
+    """Raised when storage could not be reached in time: the call kept being throttled or failing, or the
+    circuit breaker is turning calls away. Trying again shortly may work. See resilience.py."""
+
+
+# --------------- Lists layout ------------------
+#
+# A list is a header holding numberOfSteps, currentStep, pageSize and version, plus one page per pageSize steps. Pages
+# hold their steps in a listItems list in step order, so step n of page p is listItems[n - p * pageSize - 1].
+# Keeping the steps out of the header means no single record grows with the list, and a reader only moves the
+# page it needs.
+#
+# Records written before listItems became a list hold a {step: text} map instead, with the step numbers as
+# string keys. Readers take both, see steps_from_map().
+#
+# Every write to a list header also sets lastUsed, in seconds since the epoch, so a user's lists can be read
+# out with how recently each was used.
+#
+# Every write to a list header bumps its version, and writes that change the steps only succeed if the header
+# still has the version the writer read. Stored sessions do the same with their sessionVersion attribute.
+# Records from before versions existed count as version 0.
+#
+# Stored sessions record lastUsed too, alongside the session attributes rather than in them, so sweeper.py can
+# find the sessions of users who stopped using the skill. Sessions from before then read as lastUsed 0.
+
+def page_of(step, page_size):
+    """The page number that holds step number step (steps start at 1)."""
+    return (int(step) - 1) // int(page_size)
+
+
+def steps_from_map(list_items):
+    """Turn the old {step: text} form of listItems into (number of the first step, [text, ...]). The steps
+    must run on without gaps, which they always do because steps are only ever appended."""
+    if not list_items:
+        return 1, []
+    steps = sorted(int(step) for step in list_items)
+    return steps[0], [list_items[str(step)] for step in steps]
+
+
+def split_pages(list_items, items_start, page_size, first_step=1):
+    """Group the steps in list_items, the first of which is step number items_start, into {page: [text, ...]},
+    keeping only the pages that hold first_step and later. Every page that is kept must be complete in
+    list_items, because pages are written whole."""
+    pages = {}
+    first_page = page_of(first_step, page_size)
+    for step, text in enumerate(list_items, int(items_start)):
+        page = page_of(step, page_size)
+        if page >= first_page:
+            pages.setdefault(page, []).append(text)
+    return pages
+
+
+def list_header(item):
+    """Clean up a list header read from a backend."""
+    return {'userId': item['userId'],
+            'listName': item['listName'],
+            'numberOfSteps': int(item['numberOfSteps']),
+            'currentStep': int(item['currentStep']),
+            'pageSize': int(item.get('pageSize', LIST_PAGE_SIZE)),
+            'version': int(item.get('version', 0)),
+            'lastUsed': int(item.get('lastUsed', 0))}
+
+
+def list_summary(item):
+    """Clean up the few header fields query_list_summaries() reads."""
+    return {'listName': item['listName'],
+            'numberOfSteps': int(item['numberOfSteps']),
+            'lastUsed': int(item.get('lastUsed', 0))}
+
+
+def session_summary(user_id, last_used, current_task, current_list, unsaved_steps=0):
+    """The few fields of a stored session scan_sessions() reads."""
+    return {'userId': user_id,
+            'lastUsed': int(last_used or 0),
+            'currentTask': current_task or 'NONE',
+            'currentList': current_list or 'NONE',
+            'unsavedSteps': int(unsaved_steps or 0)}
+
+
+# --------------- Interface ------------------
+
+class Storage(object):
+    """Everything the skill needs from a storage backend. Every method raises StorageError on failure."""
+
+    def get_session(self, user_id):
+        """Return the stored session attributes of a user, or None if there are none."""
+        raise NotImplementedError
+
+    def put_session(self, user_id, attributes, expected_version=0):
+        """Replace the stored session attributes of a user, which hold their new sessionVersion. Raises
+        ConflictError, and writes nothing, unless the stored session is at expected_version (0 if there is no
+        stored session)."""
+        raise NotImplementedError
+
+    def list_exists(self, user_id, list_name):
+        """True if the user has a list called list_name. Never reads the steps."""
+        raise NotImplementedError
+
+    def get_list_header(self, user_id, list_name):
+        """Return the header of a list (see list_header()), or None if the user has no list called list_name.
+
+        A backend that finds the whole list while reading the header may hand every step back as a list under
+        'listItems' to save the caller a page read."""
+        raise NotImplementedError
+
+    def get_list_page(self, user_id, list_name, page):
+        """Return the steps of one page of a list as a list, first step first. Missing pages are empty."""
+        raise NotImplementedError
+
+    def put_list(self, header, list_items, items_start=1, first_step=1):
+        """Write the header of a list and the pages holding steps first_step and later. list_items holds the
+        steps from step number items_start on, see split_pages().
+        The header must never count steps whose page hasn't been written.
+
+        header['version'] is the version the caller read (0 for a new list). Returns the new version, or raises
+        ConflictError without touching the header if the stored list is no longer at that version."""
+        raise NotImplementedError
+
+    def put_lists(self, lists):
+        """Write many lists at once, for bulk imports. lists is an iterable of (header, list_items) pairs, where
+        list_items holds every step of the list; it is consumed as it goes, so it can be a generator over any
+        number of lists. Lists of the same name are replaced without checking their version, and every list
+        written gets version 1. Returns the number of lists written."""
+        raise NotImplementedError
+
+    def update_list_cursor(self, user_id, list_name, fields, expected_version=None):
+        """Set the given header fields of a list that is already stored. Its version is left as it is: it only
+        counts changes to the steps, so moving through a list on one device never refuses another device's
+        change to them. Returns the new header, or None, writing nothing, if the list no longer exists.
+
+        With expected_version, raises ConflictError unless the list is still at that version. Without it the
+        fields are merged into whatever is stored, as long as the list still has at least fields['currentStep']
+        steps."""
+        raise NotImplementedError
+
+    def commit(self, writes):
+        """Make several writes as one: either all of them are made or none are. writes is a list of
+        (method, kwargs) pairs, where method is 'put_session', 'put_list' or 'update_list_cursor' and kwargs are
+        the arguments that method takes. If any write's version check fails, raises ConflictError and writes
+        nothing.
+
+        Returns True once everything is written, or False, having written nothing, if this backend can't make
+        these writes as one. The caller then makes them one at a time."""
+        return False
+
+    def delete_list(self, user_id, list_name):
+        """Delete a list and all of its pages. Returns False if there was no such list."""
+        raise NotImplementedError
+
+    def query_lists(self, user_id):
+        """Return the headers of every list the user has."""
+        raise NotImplementedError
+
+    def query_list_summaries(self, user_id, limit, start_after=None):
+        """Return (summaries, start_after) for up to limit of the user's lists in listName order, beginning after
+        the list called start_after. A summary is only listName, numberOfSteps and lastUsed (see
+        list_summary()); no steps are read. The returned start_after continues from where this call stopped,
+        or is None once there are no more lists."""
+        raise NotImplementedError
+
+    def get_name_index(self, user_id):
+        """Return the user's list name index as stored by put_name_index(), as a dict of the 'nameIndex' itself
+        and its 'version', or None if there isn't one."""
+        raise NotImplementedError
+
+    def put_name_index(self, user_id, name_index, expected_version=0):
+        """Store the user's list name index, a string built by list_names.build(), replacing the one at
+        expected_version (0 if there is none). Returns the new version, or raises ConflictError, and writes
+        nothing, if the stored index is no longer at that version."""
+        raise NotImplementedError
+
+    def scan_sessions(self, segment, total_segments):
+        """Yield a summary (see session_summary()) of every stored session in one of total_segments parts of the
+        table, numbered from 0. Only userId, lastUsed, currentTask, currentList and unsavedSteps are read.
+        Sessions written while the scan is under way may or may not be seen."""
+        raise NotImplementedError
+
+    def date_session(self, user_id, last_used):
+        """Set lastUsed on a stored session written before sessions recorded it, leaving the session itself
+        alone. Does nothing to a session that has lastUsed, or to a user with no stored session."""
+        raise NotImplementedError
+
+    def delete_sessions(self, user_ids):
+        """Delete the stored sessions of many users at once, without checking their versions."""
+        raise NotImplementedError
+
+    def delete_lists(self, headers):
+        """Delete many lists and all of their pages at once, without checking their versions. headers are the
+        lists' headers as get_list_header() returns them."""
+        raise NotImplementedError
+
+    def consumed_capacity(self):
+        """Return (read, write), the capacity units the backend has reported consuming for calls made from this
+        thread so far. Backends that don't charge by capacity return (0.0, 0.0)."""
+        return 0.0, 0.0
+
+    def warm(self):
+        """Get ready to serve requests: build clients and open connections. Returns False if that failed,
+        never raises."""
+        return True
+
+
+def create_backend(name=None):
+    """Build the backend called name (defaults to GENERALIST_STORAGE)."""
+    name = name or STORAGE_BACKEND
+    if name == 'dynamodb':
+        import dynamodb_storage
+        return dynamodb_storage.DynamoDBStorage()
+    elif name == 'sqlite':
+        import sqlite_storage
+        return sqlite_storage.SQLiteStorage()
+    raise ValueError('Unknown storage backend', name)
+
+
+def backend():
+    """Return the container-wide storage backend, building it on first use. It is wrapped in an
+    InstrumentedStorage so the skill can report how many storage calls each request makes, and in the
+    retries, rate limiter and circuit breaker of resilience.py unless GENERALIST_RESILIENCE is 0."""
+    global _backend
+    if _backend is None:
+        import resilience
+        inner = create_backend()
+        if resilience.FAULT_RATE or resilience.FAULT_LATENCY:
+            inner = resilience.FaultInjectingStorage(inner)
+        if resilience.RESILIENCE:
+            inner = resilience.ResilientStorage(inner)
+        import metrics
+        # Only the metrics record reports bytes written, so they aren't counted without it.
+        _backend = InstrumentedStorage(inner, count_bytes=metrics.METRICS)
+    return _backend
+
+
+def set_backend(new_backend):
+    """Use new_backend for every following storage call. Passing None goes back to GENERALIST_STORAGE."""
+    global _backend
+    _backend = new_backend
+
+
+# --------------- Instrumentation ------------------
+
+class InstrumentedStorage(Storage):
+    """Wraps another backend and keeps count of the calls made through it, the time spent in them and roughly
+    how many bytes were written (the JSON size of what was sent). Call reset() to start a new count. Sizing a
+    write means turning it into JSON, so with count_bytes=False it isn't done and bytes_written stays 0.
+
+    The counts are kept per thread: calls, seconds and bytes_written are those of the calling thread, so each
+    request's figures are its own when server.py handles several at once."""
+
+    WRITE_METHODS = ('put_session', 'put_list', 'update_list_cursor', 'commit', 'delete_list', 'put_name_index',
+                     'date_session', 'delete_sessions', 'delete_lists')
+
+    def __init__(self, inner, count_bytes=True):
+        self.inner = inner
+        self.count_bytes = count_bytes
+        self.counters = threading.local()
+        self.reset()
+
+    def reset(self):
+        self.counters.calls = 0
+        self.counters.seconds = 0.0
+        self.counters.bytes_written = 0
+
+    @property
+    def calls(self):
+        return getattr(self.counters, 'calls', 0)
+
+    @property
+    def seconds(self):
+        return getattr(self.counters, 'seconds', 0.0)
+
+    @property
+    def bytes_written(self):
+        return getattr(self.counters, 'bytes_written', 0)
+
+    def measure(self, name, **kwargs):
+        start = time.perf_counter()
+        try:
+            return getattr(self.inner, name)(**kwargs)
+        finally:
+            counters = self.counters
+            counters.calls = self.calls + 1
+            counters.seconds = self.seconds + time.perf_counter() - start
+            if self.count_bytes and name in self.WRITE_METHODS:
+                counters.bytes_written = self.bytes_written + len(json.dumps(kwargs, default=str))
+
+    def get_session(self, user_id):
+        return self.measure('get_session', user_id=user_id)
+
+    def put_session(self, user_id, attributes, expected_version=0):
+        return self.measure('put_session', user_id=user_id, attributes=attributes,
+                            expected_version=expected_version)
+
+    def list_exists(self, user_id, list_name):
+        return self.measure('list_exists', user_id=user_id, list_name=list_name)
+
+    def get_list_header(self, user_id, list_name):
+        return self.measure('get_list_header', user_id=user_id, list_name=list_name)
+
+    def get_list_page(self, user_id, list_name, page):
+        return self.measure('get_list_page', user_id=user_id, list_name=list_name, page=page)
+
+    def put_list(self, header, list_items, items_start=1, first_step=1):
+        return self.measure('put_list', header=header, list_items=list_items, items_start=items_start,
+                            first_step=first_step)
+
+    def put_lists(self, lists):
+        return self.inner.put_lists(lists)
+
+    def update_list_cursor(self, user_id, list_name, fields, expected_version=None):
+        return self.measure('update_list_cursor', user_id=user_id, list_name=list_name, fields=fields,
+                            expected_version=expected_version)
+
+    def commit(self, writes):
+        return self.measure('commit', writes=writes)
+
+    def delete_list(self, user_id, list_name):
+        return self.measure('delete_list', user_id=user_id, list_name=list_name)
+
+    def query_lists(self, user_id):
+        return self.measure('query_lists', user_id=user_id)
+
+    def query_list_summaries(self, user_id, limit, start_after=None):
+        return self.measure('query_list_summaries', user_id=user_id, limit=limit, start_after=start_after)
+
+    def get_name_index(self, user_id):
+        return self.measure('get_name_index', user_id=user_id)
+
+    def put_name_index(self, user_id, name_index, expected_version=0):
+        return self.measure('put_name_index', user_id=user_id, name_index=name_index,
+                            expected_version=expected_version)
+
+    def scan_sessions(self, segment, total_segments):
+        return self.inner.scan_sessions(segment=segment, total_segments=total_segments)
+
+    def date_session(self, user_id, last_used):
+        return self.measure('date_session', user_id=user_id, last_used=last_used)
+
+    def delete_sessions(self, user_ids):
+        return self.measure('delete_sessions', user_ids=user_ids)
+
+    def delete_lists(self, headers):
+        return self.measure('delete_lists', headers=headers)
+
+    def consumed_capacity(self):
+        return self.inner.consumed_capacity()
+
+    def warm(self):
+        return self.inner.warm()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""
+Sweep stale sessions and abandoned lists out of GeneraList's tables.
+
+The skill never deletes anything unless a user asks. A StoredSession row outlives its user's interest in the
+skill, and so does a list left half-built when a session ended in the middle of creating it. Both tables only
+grow. This goes through the stored sessions and deletes
+
+    stale sessions   sessions that haven't been written for --days days, unless they hold steps of a list
+                     they were editing that the list doesn't have yet (unsavedSteps, see main.DEFER_STEPS)
+    abandoned lists  the list a stale session was still creating, with all of its pages, unless the list
+                     itself was used within --days days
+
+The StoredSession table is read with a parallel Scan of --segments segments, one thread each, that projects
+userId, lastUsed, currentTask, currentList and unsavedSteps. The projection keeps the bytes sent back down; a Scan
+is still charged read capacity for the whole items it reads. Deletes go out in batches (BatchWriteItem in chunks
+of 25 on DynamoDB), held to --rate items a second across every thread so a sweep doesn't take the capacity the
+skill needs.
+
+Sessions only record lastUsed since sweeping was added. Older ones are dated with the time of the first sweep that
+finds them and swept once they have gone unused for --days from then.
+
+BatchWriteItem can't make a delete conditional. A user who comes back in the moment between their session being
+scanned and deleted finds the skill as a new user would, and loses the list they were creating.
+
+A session holding back steps of a list it was editing is left until the user comes back and the skill writes them.
+The steps a session holds back while creating a list belong to that abandoned list and go with it.
+
+Abandoned lists are taken out of their users' name indexes (see list_names.py) once they are deleted, one index
+write per user, held to --rate with the deletes.
+
+With GENERALIST_SESSION_TTL_DAYS, sessions are written with an expiresAt time for DynamoDB's Time to Live, which
+deletes them without a sweep. Sessions partway through creating a list are left out, so this can delete the list
+with them, and so are sessions holding back steps.
+
+    python sweeper.py --days 90
+    python sweeper.py --days 30 --segments 8 --rate 200 --dry-run
+
+The backend is picked with GENERALIST_STORAGE, as for the skill itself.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import concurrent.futures
+import sys
+import threading
+import time
+
+import list_names
+import resilience
+import storage
+
+__author__ = 'Mike Lane'
+__email__ = 'mikelane@gmail.com'
+
+# Sessions, and the lists they were creating, deleted per batch by each thread.
+SWEEP_BATCH = 25
+
+
+class Sweep(object):
+    """One sweep of the stored sessions: what counts as stale, how fast to delete, and what was done."""
+
+    def __init__(self, backend, days, rate, dry_run=False):
+        self.backend = backend
+        self.now = int(time.time())
+        self.cutoff = self.now - int(days * 24 * 60 * 60)
+        # Burst of one second's worth, so the rate holds from the first batch on.
+        self.bucket = resilience.TokenBucket(rate, max(rate, SWEEP_BATCH)) if rate else None
+        self.dry_run = dry_run
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+
+    def count(self, **counts):
+        with self.lock:
+            self.counts.update(counts)
+
+    def segment(self, segment, total_segments):
+        """Sweep one segment of the StoredSession table."""
+        user_ids, headers = [], []
+        for session in self.backend.scan_sessions(segment=segment, total_segments=total_segments):
+            self.count(scanned=1)
+            if not session['lastUsed']:
+                if not self.dry_run:
+                    self.take(1)
+                    self.backend.date_session(user_id=session['userId'], last_used=self.now)
+                self.count(dated=1)
+                continue
+            if session['lastUsed'] > self.cutoff:
+                continue
+            if session['unsavedSteps'] and session['currentTask'] != 'CREATE':
+                # The only copy of steps the user was told were added to a list that is kept.
+                self.count(held=1)
+                continue
+
+            if session['currentTask'] == 'CREATE' and session['currentList'] != 'NONE':
+                header = self.backend.get_list_header(user_id=session['userId'], list_name=session['currentList'])
+                if header is not None and header['lastUsed'] > self.cutoff:
+                    # Written since by something other than this session, bulk_lists.py say. Leave both.
+                    self.count(skipped=1)
+                    continue
+                if header is not None:
+                    headers.append(header)
+            user_ids.append(session['userId'])
+            if len(user_ids) >= SWEEP_BATCH:
+                self.delete(user_ids, headers)
+                user_ids, headers = [], []
+        self.delete(user_ids, headers)
+
+    def delete(self, user_ids, headers):
+        """Delete the lists first, so a sweep that stops part way still finds them through their sessions."""
+        pages = sum(storage.page_of(header['numberOfSteps'], header['pageSize']) + 1 for header in headers)
+        if not self.dry_run:
+            if headers:
+                self.take(len(headers) + pages)
+                self.backend.delete_lists(headers=headers)
+                removed = collections.defaultdict(list)
+                for header in headers:
+                    removed[header['userId']].append(header['listName'])
+                self.take(len(removed))
+                for user_id, names in removed.items():
+                    list_names.update(user_id=user_id, removed=names)
+            if user_ids:
+                self.take(len(user_ids))
+                self.backend.delete_sessions(user_ids=user_ids)
+        self.count(sessions=len(user_ids), lists=len(headers), pages=pages)
+
+    def take(self, items):
+        if self.bucket is not None:
+            for _ in range(items):
+                self.bucket.take()
+
+    def run(self, segments):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=segments) as pool:
+            # list() so an error in any segment is raised here.
+            list(pool.map(self.segment, range(segments), [segments] * segments))
+        return self.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=float, default=90, help="sweep sessions not used for this many days")
+    parser.add_argument('--segments', type=int, default=4, help="parallel scan segments, one thread each")
+    parser.add_argument('--rate', type=float, default=100, help="items deleted per second at most (0 for no limit)")
+    parser.add_argument('--dry-run', action='store_true', help="count what would be swept, write nothing")
+    args = parser.parse_args()
+    if args.segments < 1:
+        parser.error('--segments must be at least 1')
+
+    backend = storage.create_backend()
+    storage.set_backend(backend)
+
+    start = time.perf_counter()
+    sweep = Sweep(backend, args.days, args.rate, args.dry_run)
+    try:
+        counts = sweep.run(args.segments)
+    except storage.StorageError as e:
+        sys.exit("storage error {} after {} sessions".format(e.code, sweep.counts['sessions']))
+    print("{verb} {sessions} of {scanned} sessions and {lists} abandoned lists ({pages} pages) in {seconds:.1f}s. "
+          "{dated} sessions had no lastUsed, {skipped} were left because their list is still in use, {held} because "
+          "they hold unsaved steps.".format(
+              verb='would sweep' if args.dry_run else 'swept', seconds=time.perf_counter() - start,
+              **{k: counts[k] for k in ('sessions', 'scanned', 'lists', 'pages', 'dated', 'skipped', 'held')}),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()